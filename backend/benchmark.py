@@ -0,0 +1,233 @@
+"""
+End-to-end benchmark for the Flask endpoints, runnable offline.
+
+Drives /api/question and /api/conversation in-process (Flask test client)
+against the deterministic MockLLMProvider, so no OpenAI money is spent, and
+reports latency percentiles, throughput, and LLM calls / Redis round-trips
+per request.
+
+Examples:
+    python benchmark.py                                  # defaults below
+    python benchmark.py --characters 100 1000 --concurrency 1 8 --engine async thread
+    python benchmark.py --scenario conversation --group-size 20 --latency-ms 500
+    python benchmark.py --redis url                      # use REDIS_URL instead of fakeredis
+    python benchmark.py --rpm 500 --tpm 200000           # with the shared LLM rate limiter on
+    python benchmark.py --prompt-batch 1 5 10            # characters per LLM call
+    python benchmark.py --verdict-only                   # polls without the characters' replies
+    python benchmark.py --scenario conversation --conversation-mode rounds --rounds 2
+
+Redis: by default an in-process fakeredis server is used (pip install -r
+requirements-dev.txt); with --redis url the server at REDIS_URL / localhost is used.
+Note that the benchmark initializes character:* keys on that server.
+"""
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import generateResponses as app_module
+
+
+class RedisCounter:
+    """Counts Redis round-trips: one per command, one per pipeline execute()."""
+
+    def __init__(self, client):
+        self.count = 0
+        self._lock = threading.Lock()
+
+        execute_command = client.execute_command
+        pipeline = client.pipeline
+
+        def counted_execute_command(*args, **kwargs):
+            self._bump()
+            return execute_command(*args, **kwargs)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted_execute(*a, **k):
+                self._bump()
+                return execute(*a, **k)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        client.execute_command = counted_execute_command
+        client.pipeline = counted_pipeline
+
+    def _bump(self):
+        with self._lock:
+            self.count += 1
+
+
+def make_redis(kind):
+    if kind == 'fake':
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit("The in-memory Redis needs fakeredis: pip install -r requirements-dev.txt "
+                             "(or pass --redis url to use a real server)")
+        return fakeredis.FakeRedis(decode_responses=True)
+    return app_module.get_redis()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_scenario(client, llm, redis_counter, scenario, characters, concurrency, requests, args):
+    """Fire `requests` requests, `concurrency` at a time. Returns a result row."""
+    engine = args.engine_current
+    prompt_batch = args.prompt_batch_current
+
+    def one_request(i):
+        if scenario == 'question':
+            body = {
+                # Unique questions so the question cache doesn't turn the run into cache hits
+                'question': f"Benchmark question {time.time_ns()}-{i}: should I buy these shoes?",
+                'num': characters,
+                'engine': engine,
+                'prompt_batch': prompt_batch,
+                'verdict_only': args.verdict_only,
+                'bypass_cache': not args.use_cache
+            }
+            path = '/api/question'
+        else:
+            ids = list(range(1 + (i * args.group_size) % characters, 1 + (i * args.group_size) % characters + args.group_size))
+            body = {
+                'character_ids': [((char_id - 1) % characters) + 1 for char_id in ids],
+                'prompt_batch': prompt_batch,
+                'mode': args.conversation_mode,
+                'rounds': args.rounds
+            }
+            path = '/api/conversation'
+
+        started = time.perf_counter()
+        response = client.post(path, json=body)
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code
+
+    llm.reset_stats()
+    app_module.metrics.reset()
+    redis_counter.count = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(one_request, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for elapsed, _ in outcomes]
+    failures = sum(1 for _, status in outcomes if status != 200)
+    return {
+        'scenario': scenario,
+        'engine': engine if scenario == 'question' else '-',
+        'characters': characters,
+        'concurrency': concurrency,
+        'prompt_batch': prompt_batch,
+        'requests': requests,
+        'failures': failures,
+        'p50_s': percentile(latencies, 50),
+        'p95_s': percentile(latencies, 95),
+        'p99_s': percentile(latencies, 99),
+        'throughput_rps': requests / wall if wall else 0.0,
+        'llm_calls_per_request': llm.stats['calls'] / requests,
+        'llm_errors_per_request': llm.stats['errors'] / requests,
+        'tokens_per_request': (llm.stats['prompt_tokens'] + llm.stats['completion_tokens']) / requests,
+        'redis_round_trips_per_request': redis_counter.count / requests,
+        'throttle_wait_s_per_request': app_module.metrics.total('llm_throttle_wait_seconds') / requests,
+    }
+
+
+def print_table(rows):
+    columns = [
+        ('scenario', '{}'), ('engine', '{}'), ('characters', '{}'), ('concurrency', '{}'),
+        ('prompt_batch', '{}'), ('requests', '{}'), ('failures', '{}'), ('p50_s', '{:.3f}'), ('p95_s', '{:.3f}'),
+        ('p99_s', '{:.3f}'), ('throughput_rps', '{:.2f}'), ('llm_calls_per_request', '{:.1f}'),
+        ('tokens_per_request', '{:.0f}'),
+        ('redis_round_trips_per_request', '{:.1f}'), ('throttle_wait_s_per_request', '{:.2f}'),
+    ]
+    cells = [[name for name, _ in columns]] + [[fmt.format(row[name]) for name, fmt in columns] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    for row in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', nargs='+', default=['question', 'conversation'], choices=['question', 'conversation'])
+    parser.add_argument('--characters', nargs='+', type=int, default=[100, 1000])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--engine', nargs='+', default=['async'], choices=['async', 'thread'])
+    parser.add_argument('--requests', type=int, default=4, help='Requests per configuration')
+    parser.add_argument('--group-size', type=int, default=10, help='Participants per conversation')
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='Median mock LLM latency')
+    parser.add_argument('--latency-distribution', default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of mock LLM calls that fail')
+    parser.add_argument('--completion-tokens', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warm-intro', action='store_true', help='Pre-generate intro monologues first')
+    parser.add_argument('--use-cache', action='store_true', help="Don't bypass the question cache")
+    parser.add_argument('--rpm', type=int, default=0, help='LLM requests per minute for the rate limiter (0: off)')
+    parser.add_argument('--tpm', type=int, default=0, help='LLM tokens per minute for the rate limiter (0: off)')
+    parser.add_argument('--prompt-batch', nargs='+', type=int, default=[1], help='Characters per LLM call')
+    parser.add_argument('--conversation-mode', default='sequential', choices=['sequential', 'rounds'])
+    parser.add_argument('--rounds', type=int, default=None, help="Response rounds in 'rounds' conversations")
+    parser.add_argument('--verdict-only', action='store_true', help='Poll for answers and passions only')
+    parser.add_argument('--redis', choices=['fake', 'url'], default='fake')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help="Show the server's per-character log lines")
+    args = parser.parse_args()
+
+    app_module.redis_client = make_redis(args.redis)
+    redis_counter = RedisCounter(app_module.redis_client)
+
+    llm = app_module.MockLLMProvider(
+        latency_ms=args.latency_ms,
+        latency_distribution=args.latency_distribution,
+        error_rate=args.error_rate,
+        completion_tokens=args.completion_tokens,
+        seed=args.seed
+    )
+    app_module.set_llm_provider(llm)
+    app_module.rate_limiter.rpm = args.rpm
+    app_module.rate_limiter.tpm = args.tpm
+
+    max_characters = max(args.characters)
+    app_module.init_characters(range(1, max_characters + 1))
+    if args.warm_intro:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            app_module.prewarm_intro_cache(range(1, max_characters + 1), workers=64)
+
+    client = app_module.app.test_client()
+    rows = []
+    for scenario in args.scenario:
+        for characters in args.characters:
+            for concurrency in args.concurrency:
+                for engine in (args.engine if scenario == 'question' else args.engine[:1]):
+                    for prompt_batch in args.prompt_batch:
+                        args.engine_current = engine
+                        args.prompt_batch_current = prompt_batch
+                        with contextlib.ExitStack() as stack:
+                            if not args.verbose:
+                                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+                            row = run_scenario(client, llm, redis_counter, scenario, characters, concurrency, args.requests, args)
+                        rows.append(row)
+                        print(f"done: {scenario} engine={row['engine']} characters={characters} "
+                              f"concurrency={concurrency} prompt_batch={prompt_batch} p50={row['p50_s']:.3f}s")
+
+    print()
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
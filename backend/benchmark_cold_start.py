@@ -0,0 +1,90 @@
+"""
+Cold-start benchmark for the serverless entry point.
+
+Starts a fresh interpreter for every run, imports api/index.py the way
+Vercel does, serves one GET /api/health, and reports the import time and the
+time to that first response. It exits with status 1 when the median of
+either is over its budget, so it can guard against regressions in CI.
+
+Examples:
+    python benchmark_cold_start.py
+    python benchmark_cold_start.py --runs 10 --import-budget-ms 300 --first-request-budget-ms 50
+
+It also reports whether the first request pulled in modules or clients that
+only LLM/Redis work should need (openai, pydantic, the Redis connection).
+No API key or Redis server is needed.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+
+# Runs in the fresh interpreter; prints one JSON line
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, 'api')
+from index import app
+imported = time.perf_counter()
+response = app.test_client().get('/api/health')
+answered = time.perf_counter()
+
+import generateResponses
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (answered - imported) * 1000,
+    'status': response.status_code,
+    'openai_loaded': 'openai' in sys.modules,
+    'pydantic_loaded': 'pydantic' in sys.modules,
+    'redis_client_created': getattr(generateResponses.redis_client, '_client', True) is not None,
+}))
+"""
+
+
+def run_once():
+    env = dict(os.environ)
+    env.pop('OPENAI_API_KEY', None)   # a cold start must not need it
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=500.0)
+    parser.add_argument('--first-request-budget-ms', type=float, default=100.0)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    first_request_ms = statistics.median(run['first_request_ms'] for run in runs)
+
+    print(f"runs:                 {args.runs}")
+    print(f"import (median):      {import_ms:.0f} ms  (budget {args.import_budget_ms:.0f} ms)")
+    print(f"first /api/health:    {first_request_ms:.0f} ms  (budget {args.first_request_budget_ms:.0f} ms)")
+    for flag in ('openai_loaded', 'pydantic_loaded', 'redis_client_created'):
+        print(f"{flag + ':':<22}{any(run[flag] for run in runs)}")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append('import time over budget')
+    if first_request_ms > args.first_request_budget_ms:
+        failures.append('first request over budget')
+    if any(run['status'] != 200 for run in runs):
+        failures.append('/api/health did not return 200')
+    if failures:
+        print("FAIL: " + ", ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
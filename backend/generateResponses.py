@@ -1,566 +1,4586 @@
+import asyncio
+import base64
+import bisect
+import csv
+import gzip
+import hashlib
+import io
 import json
 import os
-from openai import BaseModel, OpenAI
+import random
+import re
+import statistics
 import string
-from concurrent.futures import ThreadPoolExecutor, as_completed 
+import struct
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import partial
 from pathlib import Path
 import redis
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# ============================================
+# METRICS
+# ============================================
+# In-process counters, gauges and latency histograms, served in Prometheus
+# text format by GET /api/metrics. Recording is a dict update under a lock,
+# so it is cheap enough for the per-character hot path. Numbers are per
+# process: on Vercel every instance keeps (and reports) its own.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Histogram bucket upper bounds in seconds (LLM calls take 0.5-10 s, Redis and file work ms)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help) for every metric this module records
+METRIC_DEFINITIONS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status'),
+    'http_requests_in_flight': ('gauge', 'HTTP requests currently being handled'),
+    'http_request_errors_total': ('counter', 'HTTP requests that ended in a 5xx or an unhandled exception'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'stage_duration_seconds': ('histogram', 'Latency of internal stages (file loads, Redis round-trips, whole polls)'),
+    'llm_requests_total': ('counter', 'LLM completions by call site'),
+    'llm_requests_in_flight': ('gauge', 'LLM completions currently waiting for a reply'),
+    'llm_errors_total': ('counter', 'LLM completions that raised, by call site'),
+    'llm_request_duration_seconds': ('histogram', 'LLM completion latency by call site'),
+    'llm_prompt_tokens_total': ('counter', 'Prompt tokens reported by the LLM, by call site'),
+    'llm_completion_tokens_total': ('counter', 'Completion tokens reported by the LLM, by call site'),
+    'llm_cancelled_total': ('counter', 'LLM completions abandoned (lost hedges, poll deadlines), by call site'),
+    'llm_hedges_total': ('counter', 'Duplicate requests sent for slow LLM completions, by call site'),
+    'llm_hedges_won_total': ('counter', 'Hedged LLM completions where the duplicate answered first, by call site'),
+    'llm_throttle_wait_seconds': ('histogram', 'Time LLM calls waited for the shared rate limiter, by call site and priority'),
+    'llm_throttled_total': ('counter', 'LLM calls that had to wait for the rate limiter, by call site and priority'),
+    'llm_rate_limited_total': ('counter', 'LLM calls the API rejected with 429'),
+    'llm_batch_fallbacks_total': ('counter', 'Characters re-asked on their own after a batched LLM call, by call site'),
+    'poll_character_errors_total': ('counter', 'Characters whose poll answer failed'),
+    'poll_character_timeouts_total': ('counter', 'Characters with no answer by the poll deadline'),
+    'singleflight_requests_total': ('counter', 'Polls by single-flight role (leader, coalesced, timeout, fallback)'),
+}
+
+
+class _Timer:
+    """Context manager returned by Metrics.time()."""
+
+    __slots__ = ('metrics', 'name', 'labels', 'started')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+
+class Metrics:
+    """
+    Minimal thread-safe metric registry.
+
+    Series are keyed by (name, sorted label items). Histograms keep one count
+    per bucket plus sum and count, and are rendered cumulatively as
+    Prometheus expects.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, enabled=True):
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._values = {}       # (name, labels) -> float, counters and gauges
+        self._histograms = {}   # (name, labels) -> [bucket counts..., +Inf count, sum]
+
+    def inc(self, name, value=1, **labels):
+        """Add `value` to a counter (or gauge; value may be negative)."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record one observation in a histogram."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += seconds
+
+    def time(self, name, **labels):
+        """Time a `with` block into histogram `name`."""
+        return _Timer(self, name, labels)
+
+    def total(self, name):
+        """Sum of a counter over all its label sets, or of a histogram's observations."""
+        with self._lock:
+            return (sum(value for (key, _), value in self._values.items() if key == name)
+                    + sum(series[-1] for (key, _), series in self._histograms.items() if key == name))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """
+        Render every series in the Prometheus text exposition format.
+
+        Returns:
+            str: The /api/metrics response body
+        """
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), series in histograms.items():
+            by_name.setdefault(name, []).append((labels, series))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = METRIC_DEFINITIONS.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name]):
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+
+# ============================================
+# LLM PROVIDERS
+# ============================================
+# Every completion goes through llm_complete() / llm_complete_async(), which
+# call the active provider. 'openai' is the real API; 'mock' is a local,
+# deterministic stand-in (schema-valid structured output, configurable
+# latency, errors and token counts) for benchmarks and offline development.
+# Pick one with LLM_PROVIDER, or plug your own in with set_llm_provider().
+
+# What a provider returns for one completion
+LLMResult = namedtuple('LLMResult', ['content', 'prompt_tokens', 'completion_tokens'])
+
+
+class LLMProvider(ABC):
+    """
+    Base class for LLM providers.
+
+    Subclasses must implement complete(request) and async_session(); one
+    that doesn't can't be instantiated. `request` is
+    the keyword arguments of an OpenAI chat.completions.create call (see
+    _chat_request / _structured_request). Counters of calls, errors and
+    tokens are kept for benchmarks.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {'calls': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def _record(self, result=None):
+        with self._stats_lock:
+            self.stats['calls'] += 1
+            if result is None:
+                self.stats['errors'] += 1
+            else:
+                self.stats['prompt_tokens'] += result.prompt_tokens
+                self.stats['completion_tokens'] += result.completion_tokens
+
+    @abstractmethod
+    def complete(self, request):
+        """Run one completion synchronously. Returns an LLMResult."""
+
+    @abstractmethod
+    def async_session(self):
+        """
+        Return an async context manager for one event loop, yielding an
+        object with `async complete(request) -> LLMResult`.
+        """
+
+
+class OpenAIProvider(LLMProvider):
+    """The OpenAI API (OPENAI_API_KEY)."""
+
+    name = 'openai'
+
+    def __init__(self, api_key=None):
+        super().__init__()
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self._client = self.create_client()
+
+    def create_client(self, asynchronous=False):
+        """
+        Build an OpenAI client with an explicitly sized HTTP connection pool.
+
+        openai (and httpx) are imported here rather than at module level:
+        they take about half a second to import, which every serverless
+        cold start would otherwise pay, even for /api/health.
+        """
+        from openai import AsyncOpenAI, OpenAI
+        client_class = AsyncOpenAI if asynchronous else OpenAI
+        try:
+            import httpx
+        except ImportError:
+            # SDK builds that don't use httpx keep their default pool
+            return client_class(api_key=self.api_key)
+
+        limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+        http_client = httpx.AsyncClient(limits=limits) if asynchronous else httpx.Client(limits=limits)
+        return client_class(api_key=self.api_key, http_client=http_client)
+
+    @staticmethod
+    def _to_result(response):
+        usage = response.usage
+        return LLMResult(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0
+        )
+
+    def complete(self, request):
+        try:
+            result = self._to_result(self._client.chat.completions.create(**request))
+        except Exception:
+            self._record()
+            raise
+        self._record(result)
+        return result
+
+    def async_session(self):
+        return _OpenAIAsyncSession(self)
+
+
+class _OpenAIAsyncSession:
+    # An AsyncOpenAI client is bound to the event loop it was used on, and
+    # asyncio.run() closes the loop when a poll ends, so each poll gets one.
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    async def __aenter__(self):
+        self._client = self.provider.create_client(asynchronous=True)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.close()
+
+    async def complete(self, request):
+        try:
+            result = OpenAIProvider._to_result(await self._client.chat.completions.create(**request))
+        except Exception:
+            self.provider._record()
+            raise
+        self.provider._record(result)
+        return result
+
+
+class MockLLMError(Exception):
+    """Injected failure from MockLLMProvider."""
+
+
+class MockLLMTimeout(MockLLMError):
+    """A MockLLMProvider call whose drawn latency was over the request's timeout."""
+
+
+class MockLLMProvider(LLMProvider):
+    """
+    Deterministic local stand-in for the OpenAI API.
+
+    The same request (and seed) always produces the same content; structured
+    requests get JSON that validates against their response_format schema.
+    Latency is drawn from a 'fixed', 'uniform' or 'lognormal' distribution
+    around latency_ms; error_rate of calls raise MockLLMError. A call whose
+    latency is over the request's `timeout` waits that long and raises
+    MockLLMTimeout, like the real client would.
+    """
+
+    name = 'mock'
+
+    def __init__(self, latency_ms=0.0, latency_distribution='lognormal', latency_spread=0.5,
+                 error_rate=0.0, completion_tokens=None, seed=0):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.completion_tokens = completion_tokens   # None: a share of the request's max_tokens
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _draw(self, request):
+        """Seconds to wait and the exception to raise (or None), from the shared seeded RNG."""
+        with self._rng_lock:
+            if self.latency_distribution == 'fixed':
+                latency = self.latency_ms
+            elif self.latency_distribution == 'uniform':
+                spread = self.latency_ms * self.latency_spread
+                latency = self._rng.uniform(self.latency_ms - spread, self.latency_ms + spread)
+            else:
+                latency = self.latency_ms * self._rng.lognormvariate(0, self.latency_spread)
+            fails = self._rng.random() < self.error_rate
+        latency = max(0.0, latency) / 1000
+
+        timeout = request.get('timeout')
+        if timeout is not None and latency > timeout:
+            return timeout, MockLLMTimeout(f"Mock LLM call timed out after {timeout:.2f}s")
+        return latency, MockLLMError("Injected mock LLM failure") if fails else None
+
+    def _respond(self, request):
+        prompt = ''.join(message['content'] for message in request['messages'])
+        rng = random.Random(f"{self.seed}:{request.get('model')}:{prompt}")
+        completion_tokens = self.completion_tokens or max(1, int(request.get('max_tokens', 150) * 0.6))
+
+        response_format = request.get('response_format')
+        if response_format and response_format.get('type') == 'json_schema':
+            schema = response_format['json_schema']['schema']
+            defs = schema.get('$defs', {})
+            batch_ids = list(dict.fromkeys(int(i) for i in _BATCH_CHARACTER_RE.findall(prompt)))
+            if batch_ids and 'characters' in schema.get('properties', {}):
+                # Batched prompts get one entry per <CHARACTER id> block, like a cooperating model
+                item = schema['properties']['characters']['items']
+                tokens = max(1, completion_tokens // len(batch_ids))
+                value = {'characters': [
+                    dict(_mock_schema_value(item, rng, defs, tokens), id=char_id) for char_id in batch_ids
+                ]}
+            else:
+                value = _mock_schema_value(schema, rng, defs, completion_tokens)
+            content = json.dumps(value)
+        else:
+            content = _mock_text(rng, completion_tokens)
+        return LLMResult(content, estimate_tokens(prompt), completion_tokens)
+
+    def complete(self, request):
+        latency, error = self._draw(request)
+        time.sleep(latency)
+        if error is not None:
+            self._record()
+            raise error
+        result = self._respond(request)
+        self._record(result)
+        return result
+
+    def async_session(self):
+        return _MockAsyncSession(self)
+
+
+class _MockAsyncSession:
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    async def complete(self, request):
+        latency, error = self.provider._draw(request)
+        await asyncio.sleep(latency)
+        if error is not None:
+            self.provider._record()
+            raise error
+        result = self.provider._respond(request)
+        self.provider._record(result)
+        return result
+
+
+_MOCK_WORDS = (
+    "honestly friend think heart road money time risk dream family worth "
+    "maybe never always trust gut future chance listen value life choose"
+).split()
+
+_BATCH_CHARACTER_RE = re.compile(r'<CHARACTER (\d+)>')
+
+def _mock_text(rng, tokens):
+    # ~0.75 words per token
+    return ' '.join(rng.choice(_MOCK_WORDS) for _ in range(max(1, int(tokens * 0.75)))).capitalize() + '.'
+
+def _mock_schema_value(schema, rng, defs, tokens):
+    """Generate a value that validates against a (pydantic-style) JSON schema."""
+    if '$ref' in schema:
+        return _mock_schema_value(defs[schema['$ref'].split('/')[-1]], rng, defs, tokens)
+    if 'enum' in schema:
+        return rng.choice(schema['enum'])
+    if 'anyOf' in schema:
+        return _mock_schema_value(rng.choice(schema['anyOf']), rng, defs, tokens)
+
+    kind = schema.get('type')
+    if kind == 'object':
+        return {
+            name: _mock_schema_value(prop, rng, defs, tokens)
+            for name, prop in schema.get('properties', {}).items()
+        }
+    if kind == 'array':
+        count = rng.randint(schema.get('minItems', 1), schema.get('maxItems', 3))
+        return [_mock_schema_value(schema.get('items', {}), rng, defs, tokens) for _ in range(count)]
+    if kind == 'boolean':
+        return rng.random() < 0.5
+    if kind == 'integer':
+        return rng.randint(schema.get('minimum', 0), schema.get('maximum', 1000))
+    if kind == 'number':
+        return round(rng.uniform(schema.get('minimum', 0.0), schema.get('maximum', 1.0)), 2)
+    return _mock_text(rng, tokens)
+
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))   # HTTP connections per OpenAI client
+_llm_provider = None
+_llm_provider_lock = threading.Lock()
+
+def create_llm_provider(name=None):
+    """
+    Build a provider by name ('openai' or 'mock'). The mock reads
+    MOCK_LLM_LATENCY_MS, MOCK_LLM_LATENCY_DISTRIBUTION, MOCK_LLM_ERROR_RATE,
+    MOCK_LLM_COMPLETION_TOKENS and MOCK_LLM_SEED.
+    """
+    name = name or LLM_PROVIDER
+    if name == 'openai':
+        return OpenAIProvider()
+    if name == 'mock':
+        return MockLLMProvider(
+            latency_ms=float(os.getenv("MOCK_LLM_LATENCY_MS", "0")),
+            latency_distribution=os.getenv("MOCK_LLM_LATENCY_DISTRIBUTION", "lognormal"),
+            error_rate=float(os.getenv("MOCK_LLM_ERROR_RATE", "0")),
+            completion_tokens=int(os.getenv("MOCK_LLM_COMPLETION_TOKENS", "0")) or None,
+            seed=int(os.getenv("MOCK_LLM_SEED", "0"))
+        )
+    raise ValueError(f"Unknown LLM provider: {name!r}")
+
+def get_llm():
+    """Return the active LLM provider, creating it on first use."""
+    global _llm_provider
+    if _llm_provider is None:
+        with _llm_provider_lock:
+            if _llm_provider is None:
+                _llm_provider = create_llm_provider()
+    return _llm_provider
+
+def set_llm_provider(provider):
+    """Replace the active LLM provider (e.g. with a MockLLMProvider in a benchmark)."""
+    global _llm_provider
+    _llm_provider = provider
+
+# Hedged requests: when a completion has been outstanding longer than
+# HEDGE_PERCENTILE of recent successful calls from the same call site, a
+# duplicate is sent and whichever answers first wins (the other is cancelled
+# on the async path, or left to finish in the background on the thread path).
+# Hedges are capped at HEDGE_MAX_RATIO of calls so a slow API as a whole
+# doesn't double the traffic; HEDGE_PERCENTILE=0 turns hedging off.
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))    # latencies needed before hedging
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.1"))     # never hedge sooner than this (seconds)
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))     # hedges per call, at most
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "200"))           # threads for hedged sync calls
+
+
+class LatencyTracker:
+    """Sliding window of successful LLM call latencies per call site, plus a hedge budget."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}   # call_site -> deque of seconds
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def add(self, call_site, seconds):
+        with self._lock:
+            self._samples.setdefault(call_site, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, call_site, pct):
+        """The pct-th percentile latency, or None with fewer than HEDGE_MIN_SAMPLES samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(call_site, ()))
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def hedge_delay(self, call_site):
+        """Seconds to wait before hedging a call (None: don't hedge). Counts the call."""
+        with self._lock:
+            self._calls += 1
+            if self._calls >= 10 * self.window:
+                # Decay, so a long calm spell doesn't bank hedges for a slow one
+                self._calls //= 2
+                self._hedges //= 2
+        if HEDGE_PERCENTILE <= 0:
+            return None
+        delay = self.percentile(call_site, HEDGE_PERCENTILE)
+        return None if delay is None else max(delay, HEDGE_MIN_DELAY)
+
+    def try_hedge(self):
+        """Take one hedge from the budget; False when HEDGE_MAX_RATIO is used up."""
+        with self._lock:
+            if self._hedges + 1 > HEDGE_MAX_RATIO * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._calls = 0
+            self._hedges = 0
+
+
+llm_latencies = LatencyTracker()
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+def _get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+    return _hedge_executor
+
+# Rate limiting: every instance shares token buckets in Redis for requests
+# (LLM_RPM) and tokens (LLM_TPM), refilling at the per-minute limits and
+# holding at most a minute's worth. A call is charged its prompt tokens
+# (estimated) plus max_tokens, the way OpenAI counts it. Each limit is split
+# into two lanes: LLM_RATE_INTERACTIVE_RESERVE of it for calls a user is
+# waiting on (conversations), the rest for bulk work (polls, personas), so a
+# queued poll can't hold up a conversation. Interactive calls may also use
+# the bulk lane when that is sooner.
+#
+# A call that can't go now books the next slot (the bucket goes into debt)
+# and sleeps until then, so waiting costs one Redis round-trip, not a retry
+# loop. A call that would wait longer than LLM_RATE_MAX_WAIT fails instead.
+# A 429 from the API empties the buckets, pausing every instance. If Redis
+# is unreachable, calls go ahead unthrottled. Both limits are off unless
+# set to the account's real ones.
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))            # requests per minute across all instances, 0 for no limit
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))            # tokens per minute across all instances, 0 for no limit
+LLM_RATE_INTERACTIVE_RESERVE = float(os.getenv("LLM_RATE_INTERACTIVE_RESERVE", "0.2"))
+LLM_RATE_MAX_WAIT = float(os.getenv("LLM_RATE_MAX_WAIT", "30"))   # seconds a call may wait for its slot
+
+# Call sites a user is waiting on; everything else is bulk
+INTERACTIVE_CALL_SITES = frozenset({
+    'character_conversation_response', 'check_mind_changed', 'check_mind_changed_batch', 'summarize_conversation',
+    'character_prose'
+})
+
+# Book one request and ARGV[5] tokens in a lane. Returns the wait in ms
+# (0: go now), or minus the wait if it is over the maximum (nothing booked).
+# KEYS: requests/bulk, requests/interactive, tokens/bulk, tokens/interactive
+# ARGV: requests/s, request capacity, tokens/s, token capacity, tokens wanted,
+#       interactive share, 'interactive' or 'bulk', max wait (s)
+_RATE_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local want = {1, tonumber(ARGV[5])}
+local shares = {1 - tonumber(ARGV[6]), tonumber(ARGV[6])}
+
+-- Wait (s) for both resources in a lane, and their refilled levels
+local function lane_wait(lane)
+    local levels = {}
+    local wait = 0
+    for r = 1, 2 do
+        local rate = tonumber(ARGV[2 * r - 1]) * shares[lane]
+        local cap = tonumber(ARGV[2 * r]) * shares[lane]
+        if tonumber(ARGV[2 * r - 1]) > 0 then
+            if rate <= 0 then
+                return nil, nil
+            end
+            local state = redis.call('HMGET', KEYS[2 * r - 2 + lane], 'level', 'ts')
+            local level = tonumber(state[1]) or cap
+            local ts = tonumber(state[2]) or now
+            level = math.min(cap, level + math.max(0, now - ts) * rate)
+            levels[r] = level
+            if level < want[r] then
+                wait = math.max(wait, (want[r] - level) / rate)
+            end
+        end
+    end
+    return wait, levels
+end
+
+local lane = 1
+local wait, levels = lane_wait(1)
+if ARGV[7] == 'interactive' then
+    local lane_2_wait, lane_2_levels = lane_wait(2)
+    if lane_2_wait and (not wait or lane_2_wait <= wait) then
+        lane, wait, levels = 2, lane_2_wait, lane_2_levels
+    end
+end
+if not wait then
+    return -1
+end
+if wait > tonumber(ARGV[8]) then
+    return -math.ceil(wait * 1000)
+end
+
+for r = 1, 2 do
+    if levels[r] then
+        local key = KEYS[2 * r - 2 + lane]
+        local rate = tonumber(ARGV[2 * r - 1]) * shares[lane]
+        local cap = tonumber(ARGV[2 * r]) * shares[lane]
+        local level = levels[r] - want[r]
+        redis.call('HSET', key, 'level', tostring(level), 'ts', tostring(now))
+        -- Once refilled, a missing bucket means the same as a full one
+        redis.call('EXPIRE', key, math.ceil((cap - level) / rate) + 1)
+    end
+end
+return math.ceil(wait * 1000)
+"""
+
+# Empty every bucket (after a 429)
+_RATE_DRAIN_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+for i = 1, #KEYS do
+    redis.call('HSET', KEYS[i], 'level', '0', 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return 1
+"""
+
+
+class LLMRateLimited(Exception):
+    """An LLM call would have waited longer than LLM_RATE_MAX_WAIT for the rate limiter."""
+
+
+class RateLimiter:
+    """Request and token buckets for LLM calls, shared by all instances through Redis."""
+
+    KEYS = [
+        'ratelimit:llm:requests:bulk', 'ratelimit:llm:requests:interactive',
+        'ratelimit:llm:tokens:bulk', 'ratelimit:llm:tokens:interactive',
+    ]
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, interactive_reserve=LLM_RATE_INTERACTIVE_RESERVE,
+                 max_wait=LLM_RATE_MAX_WAIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.interactive_reserve = min(max(interactive_reserve, 0.0), 0.9)
+        self.max_wait = max_wait
+
+    @property
+    def enabled(self):
+        return self.rpm > 0 or self.tpm > 0
+
+    def reserve(self, tokens, priority='bulk', call_site=''):
+        """
+        Book a slot for one request of `tokens` tokens.
+
+        Returns:
+            float: Seconds to wait before sending it (0: send now)
+
+        Raises:
+            LLMRateLimited: If the slot is more than max_wait away
+        """
+        try:
+            wait_ms = int(redis_script(_RATE_ACQUIRE_LUA)(
+                keys=self.KEYS,
+                args=[self.rpm / 60, self.rpm, self.tpm / 60, self.tpm, tokens,
+                      self.interactive_reserve, priority, self.max_wait],
+                client=get_redis()
+            ))
+        except redis.RedisError as e:
+            print(f"Rate limiter unavailable, not throttling: {e}")
+            return 0.0
+        if wait_ms < 0:
+            raise LLMRateLimited(f"{call_site}: no LLM rate limit capacity within {self.max_wait:.0f}s")
+        return wait_ms / 1000
+
+    def acquire(self, tokens, priority='bulk', call_site=''):
+        """Block until the call may go. Returns the seconds spent waiting."""
+        wait = self.reserve(tokens, priority, call_site)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens, priority='bulk', call_site=''):
+        """Async twin of acquire (the Redis call runs in a worker thread)."""
+        wait = await asyncio.to_thread(self.reserve, tokens, priority, call_site)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def drain(self):
+        """Empty the buckets, e.g. after the API answered 429."""
+        try:
+            redis_script(_RATE_DRAIN_LUA)(keys=self.KEYS, client=get_redis())
+        except redis.RedisError as e:
+            print(f"Rate limiter unavailable: {e}")
+
+
+rate_limiter = RateLimiter()
+
+def _request_tokens(request):
+    """Tokens a request counts against TPM: estimated prompt tokens plus max_tokens."""
+    prompt = ''.join(message['content'] for message in request['messages'])
+    return estimate_tokens(prompt) + request.get('max_tokens', 0)
+
+def _throttle(request, call_site):
+    if not rate_limiter.enabled:
+        return
+    priority = 'interactive' if call_site in INTERACTIVE_CALL_SITES else 'bulk'
+    with metrics.time('llm_throttle_wait_seconds', call_site=call_site, priority=priority):
+        waited = rate_limiter.acquire(_request_tokens(request), priority, call_site)
+    if waited:
+        metrics.inc('llm_throttled_total', call_site=call_site, priority=priority)
+
+async def _throttle_async(request, call_site):
+    if not rate_limiter.enabled:
+        return
+    priority = 'interactive' if call_site in INTERACTIVE_CALL_SITES else 'bulk'
+    with metrics.time('llm_throttle_wait_seconds', call_site=call_site, priority=priority):
+        waited = await rate_limiter.acquire_async(_request_tokens(request), priority, call_site)
+    if waited:
+        metrics.inc('llm_throttled_total', call_site=call_site, priority=priority)
+
+def _check_rate_limited(exc):
+    # openai.RateLimitError (and anything else carrying an HTTP 429)
+    if getattr(exc, 'status_code', None) == 429:
+        metrics.inc('llm_rate_limited_total')
+        rate_limiter.drain()
+
+def _llm_call_started(call_site):
+    metrics.inc('llm_requests_in_flight', call_site=call_site)
+    return time.perf_counter()
+
+def _llm_call_finished(call_site, started, result, cancelled=False):
+    """Record latency, tokens (from the response's usage) or an error for one completion."""
+    elapsed = time.perf_counter() - started
+    metrics.inc('llm_requests_in_flight', -1, call_site=call_site)
+    metrics.inc('llm_requests_total', call_site=call_site)
+    metrics.observe('llm_request_duration_seconds', elapsed, call_site=call_site)
+    if cancelled:
+        # The losing half of a hedge, or a call abandoned at a poll deadline
+        metrics.inc('llm_cancelled_total', call_site=call_site)
+        return
+    if result is None:
+        metrics.inc('llm_errors_total', call_site=call_site)
+        return
+    llm_latencies.add(call_site, elapsed)
+    metrics.inc('llm_prompt_tokens_total', result.prompt_tokens, call_site=call_site)
+    metrics.inc('llm_completion_tokens_total', result.completion_tokens, call_site=call_site)
+
+def _llm_complete_once(request, call_site):
+    _throttle(request, call_site)
+    started = _llm_call_started(call_site)
+    result = None
+    try:
+        result = get_llm().complete(request)
+        return result
+    except Exception as exc:
+        _check_rate_limited(exc)
+        raise
+    finally:
+        _llm_call_finished(call_site, started, result)
+
+def _first_success(futures, backup, call_site):
+    """Result of whichever future succeeds first; re-raises the last error if both fail."""
+    error = None
+    for future in as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as exc:
+            error = exc
+            continue
+        if future is backup:
+            metrics.inc('llm_hedges_won_total', call_site=call_site)
+        return result
+    raise error
+
+def llm_complete(request, call_site, hedge=False):
+    """
+    Run one completion on the active provider.
+
+    Args:
+        request (dict): chat.completions.create keyword arguments
+        call_site (str): Which function is calling, for accounting
+        hedge (bool): Send a duplicate request if this one is slower than
+            HEDGE_PERCENTILE of recent calls, and use whichever answers first
+
+    Returns:
+        LLMResult
+    """
+    delay = llm_latencies.hedge_delay(call_site) if hedge else None
+    if delay is None:
+        return _llm_complete_once(request, call_site)
+
+    # Both halves run on the hedge pool; this thread only waits for them
+    executor = _get_hedge_executor()
+    primary = executor.submit(_llm_complete_once, request, call_site)
+    done, _ = wait([primary], timeout=delay)
+    if done or not llm_latencies.try_hedge():
+        return primary.result()
+    metrics.inc('llm_hedges_total', call_site=call_site)
+    backup = executor.submit(_llm_complete_once, request, call_site)
+    return _first_success([primary, backup], backup, call_site)
+
+async def _llm_complete_once_async(session, request, call_site):
+    await _throttle_async(request, call_site)
+    started = _llm_call_started(call_site)
+    result = None
+    cancelled = False
+    try:
+        result = await session.complete(request)
+        return result
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    except Exception as exc:
+        await asyncio.to_thread(_check_rate_limited, exc)
+        raise
+    finally:
+        _llm_call_finished(call_site, started, result, cancelled)
+
+async def llm_complete_async(session, request, call_site, hedge=False):
+    """Async twin of llm_complete, on a session from get_llm().async_session()."""
+    delay = llm_latencies.hedge_delay(call_site) if hedge else None
+    if delay is None:
+        return await _llm_complete_once_async(session, request, call_site)
+
+    primary = asyncio.ensure_future(_llm_complete_once_async(session, request, call_site))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not llm_latencies.try_hedge():
+            return await primary
+        metrics.inc('llm_hedges_total', call_site=call_site)
+        backup = asyncio.ensure_future(_llm_complete_once_async(session, request, call_site))
+        tasks.append(backup)
+
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        metrics.inc('llm_hedges_won_total', call_site=call_site)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # The slower half (or both, if the caller itself was cancelled)
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+# ============================================
+# REDIS CACHE SETUP
+# ============================================
+# Redis is an in-memory database - super fast for caching data
+# Install with: pip install redis
+# Make sure Redis server is running: redis-server
+
+# The client is created on first use, not at import, so a cold start (or a
+# request that never touches Redis, like /api/health) doesn't pay for it. It
+# shares one bounded connection pool across threads: when all connections are
+# busy, callers wait up to REDIS_POOL_TIMEOUT for one instead of failing. Idle
+# connections are PINGed before reuse and dropped connections are retried.
+
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "10"))                    # seconds to wait for a free connection
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))   # PING connections idle this long
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "10"))
+
+def create_redis_client():
+    """
+    Build the Redis client - supports both local development and Vercel (Upstash).
+
+    Returns:
+        redis.Redis
+    """
+    from redis.backoff import ExponentialBackoff
+    from redis.retry import Retry
+
+    options = {
+        'decode_responses': True,   # Automatically convert bytes to strings
+        'max_connections': REDIS_MAX_CONNECTIONS,
+        'timeout': REDIS_POOL_TIMEOUT,
+        'health_check_interval': REDIS_HEALTH_CHECK_INTERVAL,
+        'socket_timeout': REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': 5,
+        'socket_keepalive': True,
+        'retry': Retry(ExponentialBackoff(cap=1.0, base=0.05), 3),
+        'retry_on_error': [redis.ConnectionError, redis.TimeoutError],
+    }
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        # For Upstash Redis or Redis with URL format: redis://host:port
+        pool = redis.BlockingConnectionPool.from_url(redis_url, **options)
+    else:
+        # Fallback to localhost for local development
+        pool = redis.BlockingConnectionPool(
+            host='localhost',  # Redis server location
+            port=6379,         # Default Redis port
+            db=0,              # Database number (Redis has 16 databases by default)
+            **options
+        )
+    return redis.Redis(connection_pool=pool)
+
+
+class LazyRedis:
+    """Stands in for the Redis client and creates it on first use."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        """Return the real client, creating it if needed."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
+redis_client = LazyRedis(create_redis_client)
+
+def get_redis():
+    """The underlying redis.Redis client (useful where a real instance is required)."""
+    return redis_client.get_client() if isinstance(redis_client, LazyRedis) else redis_client
+
+_redis_scripts = {}
+
+def redis_script(source):
+    """
+    A Lua script object for `source`, registered once. Call it with an
+    explicit client= (redis_client or a pipeline).
+    """
+    script = _redis_scripts.get(source)
+    if script is None:
+        script = _redis_scripts[source] = get_redis().register_script(source)
+    return script
+
+# ============================================
+# CHARACTER REGISTRY
+# ============================================
+# all-characters.json is ~2.3 MB (sprites, layers, descriptions...) but the
+# backend only needs a handful of fields. Parse it once, keep a compact
+# id -> record index in memory and only re-parse when the file changes.
+
+CHARACTERS_JSON_PATH = Path(__file__).parent.parent / "frontend" / "public" / "characters" / "data" / "all-characters.json"
+
+class CharacterRegistry:
+    """
+    In-process, id-indexed view of all-characters.json.
+
+    The file is parsed on first use and again only when its mtime changes.
+    The mtime itself is checked at most once every `check_interval` seconds,
+    so lookups on the hot path never touch the disk.
+    """
+
+    def __init__(self, json_path, check_interval=2.0):
+        self.json_path = Path(json_path)
+        self.check_interval = check_interval
+        self._records = {}       # int id -> {'id', 'name', 'persona', 'attributes'}
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, mtime):
+        with open(self.json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        # Only these fields are kept in memory for each character
+        records = {}
+        for character in data["characters"].values():
+            char_id = int(character['id'])
+            records[char_id] = {
+                'id': char_id,
+                'name': character.get('name', ''),
+                'persona': character.get('persona', ''),
+                'attributes': character.get('attributes', {}),
+            }
+
+        # Swap in one assignment so readers never see a half-built index
+        self._records = records
+        self._mtime = mtime
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._mtime is not None and now < self._next_check:
+            return
+
+        with self._lock:
+            if self._mtime is not None and now < self._next_check:
+                return
+            mtime = os.stat(self.json_path).st_mtime_ns
+            if mtime != self._mtime:
+                with metrics.time('stage_duration_seconds', stage='character_json_load'):
+                    self._load(mtime)
+            self._next_check = now + self.check_interval
+
+    def reload(self):
+        """Force a re-parse of the JSON file on the next lookup."""
+        with self._lock:
+            self._mtime = None
+            self._next_check = 0.0
+
+    def get(self, char_id):
+        """
+        Look up a single character.
+
+        Args:
+            char_id (str or int): Character ID (e.g., "1", "0001", or 1)
+
+        Returns:
+            dict: {'id', 'name', 'persona', 'attributes'} or None if not found
+        """
+        self._ensure_fresh()
+        return self._records.get(int(char_id))
+
+    def get_many(self, char_ids):
+        """
+        Bulk lookup used by the fan-out paths (one freshness check per batch).
+
+        Args:
+            char_ids (iterable): Character IDs
+
+        Returns:
+            dict: int id -> record, unknown IDs are left out
+        """
+        self._ensure_fresh()
+        records = self._records
+        found = {}
+        for char_id in char_ids:
+            record = records.get(int(char_id))
+            if record is not None:
+                found[record['id']] = record
+        return found
+
+    def ids(self):
+        """Return all known character IDs in ascending order."""
+        self._ensure_fresh()
+        return sorted(self._records)
+
+
+character_registry = CharacterRegistry(CHARACTERS_JSON_PATH)
+
+def get_character_info(char_id):
+    """
+    Get character name and persona from the in-memory character registry.
+    
+    Args:
+        char_id (str or int): Character ID (e.g., "1", "0001", or 1)
+    
+    Returns:
+        dict: {'id': int, 'name': str, 'persona': str, 'attributes': dict} or None if not found
+    """
+    return character_registry.get(char_id)
+
+# ============================================
+# CHARACTER STATE STORAGE
+# ============================================
+# On Upstash every Redis command is a network hop, so writes for a character
+# go out as one HSET and bulk reads are pipelined. Whole-keyspace listing uses
+# SCAN (non-blocking, incremental) instead of KEYS.
+#
+# Poll state can live in a per-session namespace so concurrent users don't
+# overwrite each other's question and answers: with session "abc" the keys
+# are session:abc:character:{id}, session:abc:global:question, and so on.
+# Session keys expire SESSION_TTL seconds after their last write. The
+# default session (None) is the shared, unprefixed, non-expiring keyspace.
+
+SCAN_BATCH_SIZE = 500
+SESSION_TTL = int(os.getenv("SESSION_TTL", "86400"))   # seconds a session's state outlives its last write
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+def session_key(key, session=None):
+    """Namespace `key` under `session` (unchanged for the default session)."""
+    return key if session is None else f"session:{session}:{key}"
+
+def expire_session_keys(pipe, session, *keys):
+    """Queue an EXPIRE refresh for keys just written in a session (no-op for the default session)."""
+    if session is not None and SESSION_TTL:
+        for key in keys:
+            pipe.expire(key, SESSION_TTL)
+
+def new_session_id():
+    """Generate an ID for a new session."""
+    return uuid.uuid4().hex
+
+def validate_session_id(session):
+    """
+    Check a client-supplied session ID.
+
+    Returns:
+        str or None: The session ID (None for the default session)
+
+    Raises:
+        ValueError: If the ID is not 1-64 letters, digits, '-' or '_'
+    """
+    if session is None or session == '':
+        return None
+    if not isinstance(session, str) or not SESSION_ID_PATTERN.match(session):
+        raise ValueError('session_id must be 1-64 letters, digits, "-" or "_"')
+    return session
+
+def character_key(char_id, session=None):
+    """Redis key of a character's state hash."""
+    return session_key(f"character:{char_id}", session)
+
+# Every write to a session's characters or question bumps its state version,
+# so clients can revalidate GET /api/characters with an ETag instead of
+# downloading every chat again. The counter is never reset (clearing the
+# characters bumps it too), so a version is never reused for other state.
+def state_version_key(session=None):
+    return session_key('state:version', session)
+
+def bump_state_version(pipe, session=None):
+    """Queue an increment of the session's state version on `pipe`."""
+    key = state_version_key(session)
+    pipe.incr(key)
+    expire_session_keys(pipe, session, key)
+
+def get_state_version(session=None):
+    """The session's current state version (0 before its first write)."""
+    return int(redis_client.get(state_version_key(session)) or 0)
+
+# Fields of a character's state hash, in response order
+STATE_FIELDS = ('id', 'chat', 'answer', 'passion')
+
+def _decode_character(data, fields=STATE_FIELDS):
+    # `data` may come from HMGET, where missing fields are None
+    character = {'id': int(data['id'])}
+    if 'chat' in fields:
+        character['chat'] = data.get('chat') or ''
+    if 'answer' in fields:
+        character['answer'] = (data.get('answer') or 'false').lower() == 'true'
+    if 'passion' in fields:
+        character['passion'] = float(data.get('passion') or '0.0')
+    return character
+
+def parse_character_fields(fields):
+    """
+    Validate a field projection (comma-separated string or list).
+
+    Returns:
+        tuple: The requested fields in STATE_FIELDS order, always with 'id'
+        (all fields when `fields` is empty)
+
+    Raises:
+        ValueError: If a field isn't one of STATE_FIELDS
+    """
+    if not fields:
+        return STATE_FIELDS
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    requested = {'id'}
+    for field in fields:
+        field = field.strip() if isinstance(field, str) else field
+        if field not in STATE_FIELDS:
+            raise ValueError(f"fields must be a subset of {', '.join(STATE_FIELDS)}")
+        requested.add(field)
+    return tuple(field for field in STATE_FIELDS if field in requested)
+
+# Field values of a character nobody has asked anything yet
+CHARACTER_DEFAULTS = {
+    'chat': '',  # Conversation history
+    'answer': 'false',  # Store as string ('true' or 'false')
+    'passion': '0.0'  # Passion score as string
+}
+
+def init_character_cache(char_id, session=None, pipe=None):
+    """
+    Initialize a character in Redis cache with default values.
+    
+    Args:
+        char_id (int): Character ID
+        session (str, optional): Session namespace
+        pipe (redis.client.Pipeline, optional): Queue the write on this pipeline
+    """
+    key = character_key(char_id, session)
+    (pipe or redis_client).hset(key, mapping={'id': char_id, **CHARACTER_DEFAULTS})
+    # The defaults are "not asked yet", not a No vote
+    remove_poll_vote(char_id, pipe, session)
+
+def init_characters(char_ids, session=None, reset=False):
+    """
+    Make sure each character has a state hash, in pipelined batches.
+
+    Idempotent: characters that already exist keep their state (each field
+    is only set if missing), unless reset=True puts them back to the defaults.
+
+    Args:
+        char_ids (iterable): Character IDs
+        session (str, optional): Session namespace
+        reset (bool): Overwrite existing characters with the defaults
+
+    Returns:
+        int: How many characters were created (or reset)
+    """
+    char_ids = list(char_ids)
+    written = 0
+    for start in range(0, len(char_ids), SCAN_BATCH_SIZE):
+        batch = char_ids[start:start + SCAN_BATCH_SIZE]
+        pipe = redis_client.pipeline(transaction=False)
+        created_replies = []   # index of each character's HSETNX 'id' reply
+        for char_id in batch:
+            key = character_key(char_id, session)
+            if reset:
+                init_character_cache(char_id, session, pipe)
+            else:
+                created_replies.append(len(pipe))
+                pipe.hsetnx(key, 'id', char_id)
+                for field, value in CHARACTER_DEFAULTS.items():
+                    pipe.hsetnx(key, field, value)
+            expire_session_keys(pipe, session, key)
+        bump_state_version(pipe, session)
+        replies = pipe.execute()
+        written += len(batch) if reset else sum(1 for i in created_replies if replies[i])
+    return written
+
+def get_character_data(char_id, session=None):
+    """
+    Retrieve character data from Redis.
+    
+    Returns:
+        dict with keys: id (int), chat (str), answer (bool), passion (float)
+    """
+    key = character_key(char_id, session)
+    data = redis_client.hgetall(key)
+    
+    if not data:
+        return None
+    
+    return _decode_character(data)
+
+def get_characters_data(char_ids, session=None, fields=STATE_FIELDS):
+    """
+    Retrieve several characters in one pipelined round-trip.
+
+    Args:
+        char_ids (iterable): Character IDs
+        session (str, optional): Session namespace
+        fields (tuple, optional): Only read these fields (see
+            parse_character_fields); leaving out 'chat' saves most of the transfer
+
+    Returns:
+        list of dicts like get_character_data(), in the order given;
+        characters missing from Redis are left out
+    """
+    char_ids = list(char_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    projected = tuple(fields) != STATE_FIELDS
+    for char_id in char_ids:
+        if projected:
+            pipe.hmget(character_key(char_id, session), fields)
+        else:
+            pipe.hgetall(character_key(char_id, session))
+    replies = pipe.execute()
+    if projected:
+        replies = [dict(zip(fields, values)) if values[0] is not None else None for values in replies]
+    return [_decode_character(data, fields) for data in replies if data]
+
+def get_character_range(start, end, session=None, fields=STATE_FIELDS):
+    """
+    Retrieve characters start..end (inclusive) without scanning the keyspace.
+
+    Returns:
+        list of dicts like get_character_data(), sorted by id
+    """
+    return get_characters_data(range(start, end + 1), session, fields)
+
+def iter_character_ids(session=None):
+    """Yield the ID of every character hash in Redis, using SCAN rather than KEYS."""
+    for key in redis_client.scan_iter(match=character_key('*', session), count=SCAN_BATCH_SIZE):
+        suffix = key.rsplit(':', 1)[1]
+        if suffix.isdigit():
+            yield int(suffix)
+
+def _character_mapping(char_id, chat=None, answer=None, passion=None):
+    # 'id' is always written so a hash created by an update is still complete
+    mapping = {'id': char_id}
+    if chat is not None:
+        mapping['chat'] = chat
+    if answer is not None:
+        mapping['answer'] = 'true' if answer else 'false'
+    if passion is not None:
+        mapping['passion'] = str(passion)
+    return mapping
+
+def update_character_fields(char_id, chat=None, answer=None, passion=None, pipe=None, session=None):
+    """
+    Update several fields of a character with a single HSET.
+
+    Args:
+        char_id (int): Character ID
+        chat (str, optional): The conversation/response text
+        answer (bool, optional): True for yes, False for no
+        passion (float, optional): Passion score from 0.0 to 1.0
+        pipe (redis.client.Pipeline, optional): Queue the write on this
+            pipeline instead of sending it immediately
+        session (str, optional): Session namespace
+    """
+    mapping = _character_mapping(char_id, chat, answer, passion)
+    target = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    key = character_key(char_id, session)
+    target.hset(key, mapping=mapping)
+    expire_session_keys(target, session, key)
+    bump_state_version(target, session)
+    if answer is not None or passion is not None:
+        record_poll_vote(char_id, answer, passion, target, session)
+    if pipe is None:
+        target.execute()
+
+
+# Chat history is a capped list of JSON entries per character rather than
+# one ever-growing string in the character hash
+CHAT_HISTORY_MAX = int(os.getenv("CHAT_HISTORY_MAX", "50"))
+
+def chat_history_key(char_id, session=None):
+    """Redis key of a character's chat history list (outside character:* on purpose)."""
+    return session_key(f"chatlog:{char_id}", session)
+
+def chat_history_entry(kind, text, **extra):
+    """
+    Build a chat history entry.
+
+    Args:
+        kind (str): 'poll' or 'conversation'
+        text (str): What the character said
+        **extra: Additional fields (question, answer, conversation_id, ...)
+    """
+    return {'kind': kind, 'text': text, 'ts': time.time(), **extra}
+
+def append_chat_history(char_id, entry, pipe=None, session=None):
+    """
+    Append an entry to a character's chat history, dropping the oldest beyond CHAT_HISTORY_MAX.
+
+    Args:
+        char_id (int): Character ID
+        entry (dict): From chat_history_entry()
+        pipe (redis.client.Pipeline, optional): Queue on this pipeline instead
+        session (str, optional): Session namespace
+    """
+    target = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    key = chat_history_key(char_id, session)
+    target.rpush(key, json.dumps(entry))
+    target.ltrim(key, -CHAT_HISTORY_MAX, -1)
+    expire_session_keys(target, session, key)
+    if pipe is None:
+        target.execute()
+
+def get_chat_history(char_id, limit=None, session=None):
+    """
+    Get a character's chat history, oldest first.
+
+    Args:
+        char_id (int): Character ID
+        limit (int, optional): Only the most recent `limit` entries
+        session (str, optional): Session namespace
+
+    Returns:
+        list of dicts from chat_history_entry()
+    """
+    start = -limit if limit else 0
+    return [json.loads(raw) for raw in redis_client.lrange(chat_history_key(char_id, session), start, -1)]
+
+
+class WriteBehindBuffer:
+    """
+    Collects character updates in memory and sends them in one pipeline.
+
+    A poll hands one of these to its workers so that all 100+ results reach
+    Redis in a single round-trip when the poll finishes, instead of one HSET
+    per character. Updates to the same character are merged. All writes go
+    to the buffer's session namespace.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self._pending = {}   # char_id -> field mapping
+        self._history = []   # (char_id, chat history entry)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def update(self, char_id, chat=None, answer=None, passion=None):
+        """Queue an update; same arguments as update_character_fields."""
+        mapping = _character_mapping(char_id, chat, answer, passion)
+        with self._lock:
+            self._pending.setdefault(char_id, {}).update(mapping)
+
+    def append_history(self, char_id, entry):
+        """Queue a chat history entry; see append_chat_history."""
+        with self._lock:
+            self._history.append((char_id, entry))
+
+    def flush(self):
+        """
+        Write all queued updates in one pipeline.
+
+        Returns:
+            int: Number of characters written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            history, self._history = self._history, []
+        if not pending and not history:
+            return 0
+
+        pipe = redis_client.pipeline(transaction=False)
+        for char_id, mapping in pending.items():
+            key = character_key(char_id, self.session)
+            pipe.hset(key, mapping=mapping)
+            expire_session_keys(pipe, self.session, key)
+            if 'answer' in mapping or 'passion' in mapping:
+                record_poll_vote(
+                    char_id,
+                    mapping['answer'] == 'true' if 'answer' in mapping else None,
+                    float(mapping['passion']) if 'passion' in mapping else None,
+                    pipe,
+                    self.session
+                )
+        for char_id, entry in history:
+            append_chat_history(char_id, entry, pipe, self.session)
+        if pending:
+            bump_state_version(pipe, self.session)
+        with metrics.time('stage_duration_seconds', stage='redis_flush'):
+            pipe.execute()
+        return len(pending)
+
+def set_global_question(question, session=None):
+    """
+    Store the global question in Redis.
+    
+    Args:
+        question (str): The question being asked to all characters
+        session (str, optional): Session namespace
+    """
+    # A new question starts a new poll, so its aggregates start from zero
+    key = session_key('global:question', session)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(key, question)
+    expire_session_keys(pipe, session, key)
+    bump_state_version(pipe, session)
+    reset_poll_aggregates(question, pipe, session)
+    pipe.execute()
+
+def get_global_question(session=None):
+    """
+    Retrieve the global question from Redis.
+    
+    Returns:
+        str: The current global question, or empty string if not set
+    """
+    question = redis_client.get(session_key('global:question', session))
+    return question if question else ''
+
+def save_conversation(character_ids, conversation_log, session=None):
+    """
+    Save a conversation to Redis.
+    
+    Args:
+        character_ids (list): List of character IDs involved
+        conversation_log (str): The full conversation text
+        session (str, optional): Session namespace
+    
+    Returns:
+        str: The conversation ID
+    """
+    # Generate a unique conversation ID (the counter is shared, so IDs are unique across sessions)
+    conv_id = redis_client.incr('conversation:counter')
+    key = session_key(f"conversation:{conv_id}", session)
+    
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(key, mapping={
+        'id': conv_id,
+        'character_ids': json.dumps(character_ids),
+        'conversation_log': conversation_log
+    })
+    expire_session_keys(pipe, session, key)
+    pipe.execute()
+    
+    return str(conv_id)
+
+def get_conversation(conv_id, session=None):
+    """
+    Retrieve a conversation from Redis.
+    
+    Args:
+        conv_id (str or int): Conversation ID
+        session (str, optional): Session namespace
+    
+    Returns:
+        dict: Conversation data with id, character_ids, conversation_log
+    """
+    key = session_key(f"conversation:{conv_id}", session)
+    data = redis_client.hgetall(key)
+    
+    if not data:
+        return None
+    
+    return {
+        'id': int(data['id']),
+        'character_ids': json.loads(data['character_ids']),
+        'conversation_log': data['conversation_log']
+    }
+
+def get_all_characters_data(session=None, fields=STATE_FIELDS):
+    """
+    Get all character data from Redis.
+    
+    Returns:
+        list of dicts with character data
+    """
+    char_ids = sorted(iter_character_ids(session))
+    return get_characters_data(char_ids, session, fields)
+
+def clear_all_characters(session=None):
+    """Clear all character data (state hashes and chat histories) from Redis cache."""
+    for pattern in (character_key('*', session), chat_history_key('*', session)):
+        batch = []
+        for key in redis_client.scan_iter(match=pattern, count=SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            redis_client.unlink(*batch)
+    redis_client.unlink(*_poll_keys(session))
+    pipe = redis_client.pipeline(transaction=False)
+    bump_state_version(pipe, session)
+    pipe.execute()
+
+# ============================================
+# POLL AGGREGATES
+# ============================================
+# Running totals for the current question (per session), kept in Redis and
+# updated by a Lua script in the same round-trip as each character's result:
+#   poll:agg            hash: question, yes, no, count, passion_sum, hist:<bucket>
+#   poll:votes          hash: char_id -> "<1|0>:<passion>" (the vote counted)
+#   poll:passion        sorted set: char_id scored by passion
+#   poll:passion:yes/no the same, split by answer
+# A re-vote (e.g. a mind change after a conversation) replaces the character's
+# previous vote, so the totals never double count; resetting a character to
+# its defaults takes its vote out. Summary and top-k reads
+# are O(1) / O(log n + k) instead of a scan over every character hash.
+
+POLL_AGG_KEY = 'poll:agg'
+POLL_VOTES_KEY = 'poll:votes'
+POLL_PASSION_KEY = 'poll:passion'
+PASSION_HISTOGRAM_BUCKETS = 10   # [0.0, 0.1), [0.1, 0.2), ... [0.9, 1.0]
+
+def _passion_key(answer=None, session=None):
+    """Sorted set of all voters, or only the Yes (True) / No (False) voters."""
+    if answer is None:
+        return session_key(POLL_PASSION_KEY, session)
+    return session_key(f"{POLL_PASSION_KEY}:{'yes' if answer else 'no'}", session)
+
+def _poll_keys(session=None):
+    return [
+        session_key(POLL_AGG_KEY, session), session_key(POLL_VOTES_KEY, session),
+        _passion_key(None, session), _passion_key(True, session), _passion_key(False, session)
+    ]
+
+# KEYS: agg, votes, passion, passion:yes, passion:no
+# ARGV: char_id, answer ('1', '0', '' to keep or '-' to remove the vote),
+#       passion ('' to keep), buckets, TTL in seconds for all five keys ('0' = no expiry)
+_RECORD_VOTE_LUA = """
+local function bucket(p)
+    local b = math.floor(p * tonumber(ARGV[4]))
+    return 'hist:' .. math.max(0, math.min(tonumber(ARGV[4]) - 1, b))
+end
+local answer, passion = ARGV[2], ARGV[3]
+local previous = redis.call('HGET', KEYS[2], ARGV[1])
+if previous then
+    local sep = string.find(previous, ':', 1, true)
+    local old_answer = string.sub(previous, 1, sep - 1)
+    local old_passion = string.sub(previous, sep + 1)
+    if answer == '' then answer = old_answer end
+    if passion == '' then passion = old_passion end
+    redis.call('HINCRBY', KEYS[1], old_answer == '1' and 'yes' or 'no', -1)
+    redis.call('HINCRBY', KEYS[1], 'count', -1)
+    redis.call('HINCRBYFLOAT', KEYS[1], 'passion_sum', -tonumber(old_passion))
+    redis.call('HINCRBY', KEYS[1], bucket(tonumber(old_passion)), -1)
+    redis.call('ZREM', old_answer == '1' and KEYS[4] or KEYS[5], ARGV[1])
+end
+if answer == '-' then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    return 0
+end
+if answer == '' or passion == '' then
+    return 0
+end
+local p = tonumber(passion)
+redis.call('HINCRBY', KEYS[1], answer == '1' and 'yes' or 'no', 1)
+redis.call('HINCRBY', KEYS[1], 'count', 1)
+redis.call('HINCRBYFLOAT', KEYS[1], 'passion_sum', p)
+redis.call('HINCRBY', KEYS[1], bucket(p), 1)
+redis.call('ZADD', KEYS[3], p, ARGV[1])
+redis.call('ZADD', answer == '1' and KEYS[4] or KEYS[5], p, ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], answer .. ':' .. passion)
+if tonumber(ARGV[5]) > 0 then
+    for i = 1, 5 do redis.call('EXPIRE', KEYS[i], ARGV[5]) end
+end
+return 1
+"""
+
+def record_poll_vote(char_id, answer=None, passion=None, pipe=None, session=None):
+    """
+    Count (or re-count) a character's vote in the poll aggregates.
+
+    Args:
+        char_id (int): Character ID
+        answer (bool, optional): New answer, None keeps the previous one
+        passion (float, optional): New passion, None keeps the previous one
+        pipe (redis.client.Pipeline, optional): Queue the update on this pipeline
+        session (str, optional): Session namespace
+    """
+    redis_script(_RECORD_VOTE_LUA)(
+        keys=_poll_keys(session),
+        args=[
+            char_id,
+            '' if answer is None else ('1' if answer else '0'),
+            '' if passion is None else repr(float(passion)),
+            PASSION_HISTOGRAM_BUCKETS,
+            SESSION_TTL if session is not None else 0
+        ],
+        client=pipe or redis_client
+    )
+
+def remove_poll_vote(char_id, pipe=None, session=None):
+    """Take a character's vote (if any) out of the poll aggregates."""
+    redis_script(_RECORD_VOTE_LUA)(
+        keys=_poll_keys(session),
+        args=[char_id, '-', '', PASSION_HISTOGRAM_BUCKETS, SESSION_TTL if session is not None else 0],
+        client=pipe or redis_client
+    )
+
+def reset_poll_aggregates(question='', pipe=None, session=None):
+    """Drop every vote and start the aggregates over for `question`."""
+    target = pipe or redis_client.pipeline(transaction=True)
+    agg_key = session_key(POLL_AGG_KEY, session)
+    target.delete(*_poll_keys(session))
+    target.hset(agg_key, 'question', question)
+    expire_session_keys(target, session, agg_key)
+    if pipe is None:
+        target.execute()
+
+def get_poll_summary(session=None):
+    """
+    Current poll totals from the aggregates (no per-character reads).
+
+    Returns:
+        dict: {'question', 'yes_count', 'no_count', 'total', 'average_passion',
+        'passion_histogram': [{'min', 'max', 'count'}, ...]}
+    """
+    agg = redis_client.hgetall(session_key(POLL_AGG_KEY, session))
+    total = int(agg.get('count', 0))
+    width = 1.0 / PASSION_HISTOGRAM_BUCKETS
+    return {
+        'question': agg.get('question', ''),
+        'yes_count': int(agg.get('yes', 0)),
+        'no_count': int(agg.get('no', 0)),
+        'total': total,
+        'average_passion': float(agg.get('passion_sum', 0.0)) / total if total else 0.0,
+        'passion_histogram': [
+            {
+                'min': round(i * width, 4),
+                'max': round((i + 1) * width, 4),
+                'count': int(agg.get(f'hist:{i}', 0))
+            }
+            for i in range(PASSION_HISTOGRAM_BUCKETS)
+        ]
+    }
+
+def get_passion_ranking(answer=None, limit=10, offset=0, descending=True, min_passion=None, max_passion=None,
+                        session=None):
+    """
+    Characters ranked by passion, optionally only Yes or No voters.
+
+    Args:
+        answer (bool, optional): True for Yes voters, False for No voters, None for all
+        limit (int): Max characters returned
+        offset (int): Ranks to skip
+        descending (bool): Most passionate first
+        min_passion (float, optional): Lowest passion included
+        max_passion (float, optional): Highest passion included
+        session (str, optional): Session namespace
+
+    Returns:
+        list: Character dicts (see get_character_data) in rank order
+    """
+    key = _passion_key(answer, session)
+    if min_passion is None and max_passion is None:
+        start, end = offset, offset + limit - 1
+        if descending:
+            ranked = redis_client.zrevrange(key, start, end, withscores=True)
+        else:
+            ranked = redis_client.zrange(key, start, end, withscores=True)
+    else:
+        low = '-inf' if min_passion is None else min_passion
+        high = '+inf' if max_passion is None else max_passion
+        if descending:
+            ranked = redis_client.zrevrangebyscore(key, high, low, start=offset, num=limit, withscores=True)
+        else:
+            ranked = redis_client.zrangebyscore(key, low, high, start=offset, num=limit, withscores=True)
+
+    ranked_ids = [int(member) for member, _ in ranked]
+    characters = {c['id']: c for c in get_characters_data(ranked_ids, session)}
+    ranking = []
+    for rank, char_id in enumerate(ranked_ids, start=offset + 1):
+        if char_id in characters:
+            ranking.append(dict(characters[char_id], rank=rank))
+    return ranking
+
+# ============================================
+# POLL HISTORY
+# ============================================
+# character:{id} only holds the latest answer, so every finished poll is also
+# appended to a per-session Redis stream as one compact entry (this replaces
+# the old char_x1000/ answer files, one per character and poll):
+#   poll:history   stream; entry ID = poll ID (its first part is the time in ms)
+#     question, mode ('full' or 'sample'), total (characters asked)
+#     ids        little-endian uint32 character IDs, ascending
+#     answers    bitset, bit i (LSB first) set when ids[i] answered yes
+#     passions   little-endian uint16 passion x 10000, same order as ids
+#   or, for a poll answered by an earlier one (question cache or a shared
+#   concurrent poll), no arrays but
+#     source     poll ID of the poll whose results were reused
+# The arrays are base64 encoded (the client decodes replies as text), so a
+# 100-character poll is about 1 KB. Ranges of polls are read back with
+# XRANGE in pages, see iter_poll_history and GET /api/polls/export.
+
+POLL_HISTORY_KEY = 'poll:history'
+POLL_HISTORY_MAXLEN = int(os.getenv("POLL_HISTORY_MAXLEN", "10000"))   # polls kept per session, 0 for all
+POLL_HISTORY_PAGE_SIZE = 100
+PASSION_SCALE = 10000
+POLL_ID_PATTERN = re.compile(r'^\d+(-\d+)?$')
+
+def poll_history_key(session=None):
+    return session_key(POLL_HISTORY_KEY, session)
+
+def pack_poll_results(results):
+    """
+    Pack per-character poll results into the base64 arrays stored in history.
+
+    Args:
+        results (dict): char_id -> {'answer': bool, 'passion': float, ...}
+
+    Returns:
+        dict: {'ids', 'answers', 'passions'} as base64 strings
+    """
+    # Results that went through JSON (caches, jobs) have string keys
+    ordered = sorted((int(char_id), result) for char_id, result in results.items())
+    ids = [char_id for char_id, _ in ordered]
+    answers = bytearray((len(ids) + 7) // 8)
+    passions = []
+    for i, (_, result) in enumerate(ordered):
+        if result['answer']:
+            answers[i // 8] |= 1 << (i % 8)
+        passions.append(round(min(max(float(result['passion']), 0.0), 1.0) * PASSION_SCALE))
+    return {
+        'ids': base64.b64encode(struct.pack(f'<{len(ids)}I', *ids)).decode('ascii'),
+        'answers': base64.b64encode(bytes(answers)).decode('ascii'),
+        'passions': base64.b64encode(struct.pack(f'<{len(ids)}H', *passions)).decode('ascii')
+    }
+
+def unpack_poll_results(fields):
+    """Inverse of pack_poll_results: a list of (char_id, answer, passion) tuples."""
+    raw_ids = base64.b64decode(fields['ids'])
+    count = len(raw_ids) // 4
+    ids = struct.unpack(f'<{count}I', raw_ids)
+    answers = base64.b64decode(fields['answers'])
+    passions = struct.unpack(f'<{count}H', base64.b64decode(fields['passions']))
+    return [
+        (char_id, bool(answers[i // 8] >> (i % 8) & 1), passions[i] / PASSION_SCALE)
+        for i, char_id in enumerate(ids)
+    ]
+
+def record_poll(question, results, total=None, mode='full', session=None, source=None):
+    """
+    Append a finished poll to the session's history.
+
+    Args:
+        question (str): The question that was asked
+        results (dict): char_id -> {'answer', 'passion', ...} for every character that answered
+        total (int, optional): Characters asked, including any that didn't answer
+        mode (str): 'full' or 'sample'
+        session (str, optional): Session namespace
+        source (str, optional): ID of an earlier poll whose results these are;
+            only that reference is stored, so exports don't count them twice
+
+    Returns:
+        str: The poll ID, or None if it couldn't be stored (the poll itself
+        has succeeded by then, so that isn't an error)
+    """
+    key = poll_history_key(session)
+    fields = {
+        'question': question,
+        'mode': mode,
+        'total': total if total is not None else len(results),
+        **({'source': source} if source else pack_poll_results(results))
+    }
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        if POLL_HISTORY_MAXLEN:
+            pipe.xadd(key, fields, maxlen=POLL_HISTORY_MAXLEN, approximate=True)
+        else:
+            pipe.xadd(key, fields)
+        expire_session_keys(pipe, session, key)
+        with metrics.time('stage_duration_seconds', stage='poll_history_write'):
+            return pipe.execute()[0]
+    except redis.RedisError as e:
+        print(f"Could not record poll history: {e}")
+        return None
+
+def _decode_poll(poll_id, fields):
+    poll = {
+        'poll_id': poll_id,
+        'timestamp': int(poll_id.split('-')[0]) / 1000,
+        'question': fields['question'],
+        'mode': fields.get('mode', 'full'),
+        'total': int(fields['total']),
+        'source_poll_id': fields.get('source'),
+    }
+    if 'source' in fields:
+        # Reused results: the source poll (possibly another session's) holds them
+        return dict(poll, characters=[])
+
+    characters = unpack_poll_results(fields)
+    count_yes = sum(1 for _, answer, _ in characters if answer)
+    return {
+        **poll,
+        'answered': len(characters),
+        'yes_count': count_yes,
+        'no_count': len(characters) - count_yes,
+        'average_passion': sum(p for _, _, p in characters) / len(characters) if characters else 0.0,
+        'characters': [{'id': char_id, 'answer': answer, 'passion': passion} for char_id, answer, passion in characters]
+    }
+
+def _next_poll_id(poll_id):
+    """The smallest stream ID after poll_id, to continue an XRANGE."""
+    ms, _, seq = poll_id.partition('-')
+    return f"{ms}-{int(seq or 0) + 1}"
+
+def iter_poll_history(start='-', end='+', limit=None, session=None):
+    """
+    Yield the session's recorded polls, oldest first, a page per round-trip.
+
+    Args:
+        start (str): First poll ID (or time in ms) to include, '-' for the oldest
+        end (str): Last poll ID (or time in ms) to include, '+' for the newest
+        limit (int, optional): Most polls yielded
+        session (str, optional): Session namespace
+
+    Yields:
+        dict: A poll (see _decode_poll), with every character's answer and passion
+    """
+    key = poll_history_key(session)
+    yielded = 0
+    while limit is None or yielded < limit:
+        count = POLL_HISTORY_PAGE_SIZE if limit is None else min(POLL_HISTORY_PAGE_SIZE, limit - yielded)
+        page = redis_client.xrange(key, start, end, count=count)
+        for poll_id, fields in page:
+            yield _decode_poll(poll_id, fields)
+        yielded += len(page)
+        if len(page) < count:
+            return
+        start = _next_poll_id(page[-1][0])
+
+def _chat_request(prompt, model="gpt-4o-mini", timeout=None, max_tokens=150, temperature=1.2):
+    """Keyword arguments for a free-text completion (shared by sync and async callers)."""
+    kwargs = {
+        'model': model,
+        'messages': [
+            {"role": "system", "content": prompt}
+        ],
+        'max_tokens': max_tokens,     # limit the response length
+        'temperature': temperature,   # randomness of output
+    }
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    return kwargs
+
+def _structured_request(prompt, schema_name, timeout=None, model="gpt-4o-mini", max_tokens=800):
+    """Keyword arguments for a structured-output completion against response_schemas()[schema_name]."""
+    kwargs = {
+        'model': model,
+        'messages': [
+            {"role": "system", "content": prompt}
+        ],
+        'response_format': prompt_templates.response_format(schema_name),
+        'max_tokens': max_tokens,
+        'temperature': 0.8,
+    }
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    return kwargs
+
+def query_gpt(prompt, model = "gpt-4o-mini", timeout=None, call_site='query_gpt', hedge=False):
+    response = llm_complete(_chat_request(prompt, model, timeout), call_site, hedge)
+
+    # Extract the assistant’s reply
+    message = response.content
+    return message
+
+async def query_gpt_async(llm_session, prompt, model="gpt-4o-mini", timeout=None, call_site='query_gpt', hedge=False):
+    """Async twin of query_gpt, on an LLM async session."""
+    response = await llm_complete_async(llm_session, _chat_request(prompt, model, timeout), call_site, hedge)
+    return response.content
+
+def _build_response_schemas():
+    # pydantic is only needed to build the response_format payloads (once per
+    # process), so it is imported on first use instead of at cold start
+    from pydantic import BaseModel
+
+    class CharacterResponse(BaseModel):
+        class Config:
+            extra = "forbid"  # This sets additionalProperties to false
+        
+        name: str
+        persona: str
+
+    class CharacterQuestionResponse(BaseModel):
+        class Config:
+            extra = "forbid"  # This sets additionalProperties to false
+        
+        response: str  # The character's response text
+        answer: bool   # Yes/No answer
+        passion: float # Passion score from 0.0 to 1.0
+
+    class BatchCharacterResponse(BaseModel):
+        class Config:
+            extra = "forbid"
+
+        id: int        # Character the answer belongs to
+        response: str
+        answer: bool
+        passion: float
+
+    class CharacterBatchResponse(BaseModel):
+        class Config:
+            extra = "forbid"
+
+        characters: list[BatchCharacterResponse]  # One entry per character asked
+
+    class CharacterVerdict(BaseModel):
+        class Config:
+            extra = "forbid"
+
+        answer: bool   # Yes/No answer, without the prose that leads to it
+        passion: float
+
+    class BatchCharacterVerdict(BaseModel):
+        class Config:
+            extra = "forbid"
+
+        id: int
+        answer: bool
+        passion: float
+
+    class CharacterBatchVerdict(BaseModel):
+        class Config:
+            extra = "forbid"
+
+        characters: list[BatchCharacterVerdict]
+
+    return {
+        'character_response': CharacterResponse,
+        'character_question_response': CharacterQuestionResponse,
+        'character_batch_response': CharacterBatchResponse,
+        'character_verdict': CharacterVerdict,
+        'character_batch_verdict': CharacterBatchVerdict,
+    }
+
+# ============================================
+# PROMPT TEMPLATES
+# ============================================
+# Prompt files are resolved relative to this module (not the CWD, which is
+# different under Vercel's api/index.py), read once and re-read only when
+# they change on disk. The structured-output payloads are built once too.
+
+PROMPTS_DIR = Path(__file__).parent / "prompts"
+
+_response_schemas = None
+
+def response_schemas():
+    """response_format name -> pydantic model describing the schema."""
+    global _response_schemas
+    if _response_schemas is None:
+        _response_schemas = _build_response_schemas()
+    return _response_schemas
+
+
+class PromptTemplates:
+    """
+    Cached prompt templates from backend/prompts with mtime-based hot reload.
+
+    File mtimes are checked at most once every `check_interval` seconds, so
+    building a prompt on the per-character hot path is pure string work.
+    """
+
+    def __init__(self, prompts_dir, check_interval=2.0):
+        self.prompts_dir = Path(prompts_dir)
+        self.check_interval = check_interval
+        self._texts = {}          # template name -> file contents
+        self._mtimes = {}         # template name -> st_mtime_ns at last read
+        self._next_check = {}     # template name -> monotonic time of next stat
+        self._response_formats = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Return the contents of prompts/<name>.txt.
+
+        Args:
+            name (str): Template name without extension (e.g. 'pre')
+
+        Returns:
+            str: The template text
+        """
+        now = time.monotonic()
+        if name in self._texts and now < self._next_check[name]:
+            return self._texts[name]
+
+        with self._lock:
+            path = self.prompts_dir / f"{name}.txt"
+            mtime = os.stat(path).st_mtime_ns
+            if self._mtimes.get(name) != mtime:
+                with metrics.time('stage_duration_seconds', stage='prompt_file_read'), \
+                        open(path, 'r', encoding='utf-8') as f:
+                    self._texts[name] = f.read()
+                self._mtimes[name] = mtime
+            self._next_check[name] = now + self.check_interval
+            return self._texts[name]
+
+    def intro_prompt(self, persona):
+        """Prompt for the question-independent introduction monologue."""
+        return persona + self.get('introduction')
+
+    def question_prompt(self, persona, monologue, question, verdict_only=False):
+        """Prompt asking the character the question, after its monologue (for just a verdict if verdict_only)."""
+        return (
+            persona + self.get('introduction') + monologue
+            + self.get('pre') + question + self.get('verdict_post' if verdict_only else 'post')
+        )
+
+    def prose_prompt(self, persona, monologue, question, answer):
+        """Prompt for the reply behind a verdict the character already gave."""
+        return (
+            persona + self.get('introduction') + monologue
+            + self.get('pre') + question + self.get('prose_post').replace('{answer}', 'Yes' if answer else 'No')
+        )
+
+    def batch_question_prompt(self, characters, question, verdict_only=False):
+        """
+        Prompt asking several characters the question in one call.
+
+        Args:
+            characters (list): (char_id, persona, monologue) tuples
+            verdict_only (bool): Ask for verdicts without replies
+
+        Returns:
+            str: The prompt; each character sits in a <CHARACTER id> block
+        """
+        introduction = self.get('introduction')
+        blocks = ''.join(
+            f"<CHARACTER {char_id}>\n{persona}{introduction}{monologue}\n"
+            f"<END OF PERSONA DESCRIPTION>\n</CHARACTER {char_id}>\n\n"
+            for char_id, persona, monologue in characters
+        )
+        return (
+            self.get('batch_introduction') + blocks
+            + self.get('batch_pre') + question + self.get('batch_verdict_post' if verdict_only else 'batch_post')
+        )
+
+    def response_format(self, name):
+        """
+        Return the strict json_schema response_format payload for `name`.
+
+        Args:
+            name (str): A key of response_schemas()
+
+        Returns:
+            dict: Ready to pass as response_format to chat.completions.create
+        """
+        payload = self._response_formats.get(name)
+        if payload is None:
+            payload = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": name,
+                    "strict": True,
+                    "schema": response_schemas()[name].model_json_schema()
+                }
+            }
+            self._response_formats[name] = payload
+        return payload
+
+
+prompt_templates = PromptTemplates(PROMPTS_DIR)
+    
+# ============================================
+# PERSONA GENERATION
+# ============================================
+# Generates a name and persona for each character from its description.
+# Results are appended to a JSONL journal as they arrive, so an interrupted
+# run resumes where it stopped; all-characters.json is only rewritten at the
+# end, atomically (write a temp file, then rename over the original).
+# For large runs the same requests can go through the OpenAI Batch API:
+# write_persona_batch_file() -> upload -> import_persona_batch_results().
+
+PERSONA_JOURNAL_PATH = Path(__file__).parent / "persona_journal.jsonl"
+PERSONA_WORKERS = int(os.getenv("PERSONA_WORKERS", "16"))
+PERSONA_MAX_RETRIES = 5
+
+_journal_lock = threading.Lock()
+
+def _character_key(char_id):
+    return f"character_{int(char_id):04d}"
+
+def _persona_prompt(description):
+    # Make it concise to fit in token limit
+    return f"{description}\n\nCreate a brief character profile with a name and a 2-3 sentence persona based on the description above."
+
+def load_character_descriptions(char_ids=None):
+    """
+    Read character descriptions from all-characters.json.
+
+    Args:
+        char_ids (iterable, optional): Only these IDs (default: every character)
+
+    Returns:
+        dict: char_id -> description
+    """
+    with open(CHARACTERS_JSON_PATH, 'r', encoding='utf-8') as f:
+        characters = json.load(f)["characters"]
+    if char_ids is None:
+        return {int(c['id']): c['description'] for c in characters.values()}
+    return {int(char_id): characters[_character_key(char_id)]["description"] for char_id in char_ids}
+
+def read_persona_journal(journal_path=PERSONA_JOURNAL_PATH):
+    """
+    Read finished personas from the journal.
+
+    Returns:
+        dict: char_id -> {'name', 'persona'}; a torn last line from a crash is ignored
+    """
+    personas = {}
+    if not os.path.exists(journal_path):
+        return personas
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                personas[int(entry['id'])] = {'name': entry['name'], 'persona': entry['persona']}
+            except (json.JSONDecodeError, KeyError, ValueError):
+                continue
+    return personas
+
+def append_persona_journal(char_id, persona, journal_path=PERSONA_JOURNAL_PATH):
+    """Durably append one finished persona to the journal (thread-safe)."""
+    line = json.dumps({'id': int(char_id), 'name': persona['name'], 'persona': persona['persona']}, ensure_ascii=False)
+    with _journal_lock:
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def generate_persona(description, max_retries=PERSONA_MAX_RETRIES):
+    """
+    Generate a name and persona from a description, retrying with exponential backoff.
+
+    Returns:
+        dict: {'name': str, 'persona': str}
+
+    Raises:
+        Exception: The last error once all retries are used up
+    """
+    for attempt in range(max_retries):
+        try:
+            response = llm_complete(
+                _structured_request(_persona_prompt(description), 'character_response'),
+                'createNamePersona_x100'
+            )
+            result = json.loads(response.content)
+            return {'name': result['name'], 'persona': result['persona']}
+        except Exception as e:
+            if attempt == max_retries - 1:
+                raise
+            # 1s, 2s, 4s, ... (capped) with jitter so workers don't retry in lockstep
+            delay = min(30.0, 2 ** attempt) * (0.5 + random.random())
+            print(f"Persona generation failed (attempt {attempt + 1}/{max_retries}): {e}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def merge_personas(personas, json_path=None):
+    """
+    Write names and personas into all-characters.json atomically.
+
+    Args:
+        personas (dict): char_id -> {'name', 'persona'}
+        json_path (Path, optional): The characters file (defaults to CHARACTERS_JSON_PATH)
+    """
+    json_path = json_path or CHARACTERS_JSON_PATH
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    for char_id, persona in personas.items():
+        character = data["characters"][_character_key(char_id)]
+        character["name"] = persona['name']
+        character["persona"] = persona['persona']
+
+    # Write next to the original and rename over it, so readers (and the
+    # character registry) never see a half-written file
+    tmp_path = Path(json_path).with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, json_path)
+
+def generate_personas(char_ids=None, workers=None, journal_path=PERSONA_JOURNAL_PATH, merge=True):
+    """
+    Generate personas concurrently, resuming from the journal.
+
+    Args:
+        char_ids (iterable, optional): Characters to generate (default: all)
+        workers (int, optional): Concurrent LLM calls (defaults to PERSONA_WORKERS)
+        journal_path (Path): Checkpoint journal
+        merge (bool): Merge the journal into all-characters.json at the end
+
+    Returns:
+        dict: {'generated': int, 'skipped': int, 'failed': [char_id, ...]}
+    """
+    descriptions = load_character_descriptions(char_ids)
+    done = read_persona_journal(journal_path)
+    pending = [char_id for char_id in descriptions if char_id not in done]
+    print(f"{len(done)} personas already in the journal, generating {len(pending)}")
+
+    generated = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers or PERSONA_WORKERS) as executor:
+        futures = {
+            executor.submit(generate_persona, descriptions[char_id]): char_id
+            for char_id in pending
+        }
+        for future in as_completed(futures):
+            char_id = futures[future]
+            try:
+                persona = future.result()
+            except Exception as e:
+                print(f"Failed to generate {_character_key(char_id)}: {e}")
+                failed.append(char_id)
+                continue
+            append_persona_journal(char_id, persona, journal_path)
+            done[char_id] = persona
+            generated += 1
+            print(f"Updated {_character_key(char_id)}: {persona['name']}")
+
+    if merge:
+        print(f"Saving {len(done)} personas to {CHARACTERS_JSON_PATH}...")
+        merge_personas({char_id: done[char_id] for char_id in descriptions if char_id in done})
+
+    print("Done!")
+    return {'generated': generated, 'skipped': len(descriptions) - len(pending), 'failed': sorted(failed)}
+
+def createNamePersona_x100():
+    return generate_personas(range(1, 101))
+
+def write_persona_batch_file(out_path, char_ids=None, journal_path=PERSONA_JOURNAL_PATH):
+    """
+    Write an OpenAI Batch API input file (JSONL) for personas not yet in the journal.
+
+    Returns:
+        int: Number of requests written
+    """
+    descriptions = load_character_descriptions(char_ids)
+    done = read_persona_journal(journal_path)
+    written = 0
+    with open(out_path, 'w', encoding='utf-8') as f:
+        for char_id, description in descriptions.items():
+            if char_id in done:
+                continue
+            f.write(json.dumps({
+                'custom_id': _character_key(char_id),
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': _structured_request(_persona_prompt(description), 'character_response')
+            }, ensure_ascii=False) + "\n")
+            written += 1
+    return written
+
+def import_persona_batch_results(results_path, journal_path=PERSONA_JOURNAL_PATH, merge=True):
+    """
+    Append the personas from an OpenAI Batch API output file (JSONL) to the
+    journal, then optionally merge the journal into all-characters.json.
+
+    Returns:
+        dict: {'imported': int, 'failed': [custom_id, ...]}
+    """
+    imported = 0
+    failed = []
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            custom_id = item.get('custom_id', '')
+            try:
+                body = item['response']['body']
+                persona = json.loads(body['choices'][0]['message']['content'])
+                append_persona_journal(int(custom_id.split('_')[1]), persona, journal_path)
+                imported += 1
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"Skipping {custom_id}: {e}")
+                failed.append(custom_id)
+
+    if merge:
+        merge_personas(read_persona_journal(journal_path))
+    return {'imported': imported, 'failed': failed}
+
+def personas_cli(argv):
+    """`python generateResponses.py personas [--ids 1-1000] [--workers N] [--batch-out FILE | --batch-in FILE]`"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='generateResponses.py personas')
+    parser.add_argument('--ids', default='1-1000', help='Character ID range, e.g. 1-100')
+    parser.add_argument('--workers', type=int, default=PERSONA_WORKERS)
+    parser.add_argument('--journal', default=str(PERSONA_JOURNAL_PATH))
+    parser.add_argument('--batch-out', help='Write a Batch API input file instead of calling the API')
+    parser.add_argument('--batch-in', help='Import a Batch API output file')
+    args = parser.parse_args(argv)
+
+    start, _, end = args.ids.partition('-')
+    char_ids = range(int(start), int(end or start) + 1)
+
+    if args.batch_out:
+        print(f"Wrote {write_persona_batch_file(args.batch_out, char_ids, args.journal)} requests to {args.batch_out}")
+    elif args.batch_in:
+        print(import_persona_batch_results(args.batch_in, args.journal))
+    else:
+        print(generate_personas(char_ids, args.workers, args.journal))
+
+# ============================================
+# INTRO MONOLOGUE CACHE
+# ============================================
+# The first LLM call in considerQuestion (persona + introduction prompt) does
+# not depend on the question, so its output is cached per character in the
+# hash intro:{id} = {version, text, uses}. The version is a hash of the
+# persona and the introduction prompt, so editing either regenerates it.
+
+INTRO_CACHE_TTL = int(os.getenv("INTRO_CACHE_TTL", "0"))             # seconds, 0 = keep forever
+INTRO_CACHE_MAX_USES = int(os.getenv("INTRO_CACHE_MAX_USES", "0"))   # regenerate after N polls, 0 = never
+
+def intro_cache_version(persona):
+    """Version tag for a character's monologue: hash of persona + introduction prompt."""
+    source = persona + "\0" + prompt_templates.get('introduction')
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+
+# Read monologues and count the reads in one round-trip, atomically, so two
+# polls can't both take the last use of a regeneration budget.
+# KEYS: intro:{id}...  ARGV: max_uses (0: unlimited), count (1: count the
+# reads), then one expected version per key. Returns the texts, false on a miss.
+_INTRO_CACHE_READ_LUA = """
+local max_uses = tonumber(ARGV[1])
+local count = ARGV[2] == '1'
+local texts = {}
+for i, key in ipairs(KEYS) do
+    local cached = redis.call('HMGET', key, 'version', 'text', 'uses')
+    local text = false
+    if cached[1] == ARGV[i + 2] and cached[2] then
+        local uses = tonumber(cached[3]) or 0
+        if max_uses == 0 or uses < max_uses then
+            text = cached[2]
+            if count and max_uses > 0 then
+                redis.call('HINCRBY', key, 'uses', 1)
+            end
+        end
+    end
+    texts[i] = text
+end
+return texts
+"""
+
+def get_cached_intros(versions, count_use=True):
+    """
+    Look up several cached introduction monologues in one round-trip.
+
+    Args:
+        versions (dict): char_id -> expected version from intro_cache_version()
+        count_use (bool): Count each hit against INTRO_CACHE_MAX_USES (not
+            for checks that don't use the text, like prewarming)
+
+    Returns:
+        dict: char_id -> the cached monologue, or None on a miss (absent,
+        stale version or regeneration budget used up); all None if Redis
+        is unavailable
+    """
+    char_ids = list(versions)
+    if not char_ids:
+        return {}
+    try:
+        with metrics.time('stage_duration_seconds', stage='intro_cache_read'):
+            texts = redis_script(_INTRO_CACHE_READ_LUA)(
+                keys=[f"intro:{char_id}" for char_id in char_ids],
+                args=[INTRO_CACHE_MAX_USES, int(count_use)] + [versions[char_id] for char_id in char_ids],
+                client=redis_client
+            )
+    except redis.RedisError as e:
+        print(f"Intro cache read failed for characters {char_ids[0]}..{char_ids[-1]}: {e}")
+        return dict.fromkeys(char_ids)
+    return {char_id: text or None for char_id, text in zip(char_ids, texts)}
+
+def get_cached_intro(char_id, version, count_use=True):
+    """
+    Look up a cached introduction monologue.
+
+    Args:
+        char_id (int): Character ID
+        version (str): Expected version from intro_cache_version()
+        count_use (bool): Count a hit against INTRO_CACHE_MAX_USES
+
+    Returns:
+        str: The cached monologue, or None on a miss (absent, stale version,
+        regeneration budget used up, or Redis unavailable)
+    """
+    return get_cached_intros({char_id: version}, count_use)[char_id]
+
+def store_cached_intro(char_id, version, text):
+    """
+    Store an introduction monologue in the cache.
+
+    Args:
+        char_id (int): Character ID
+        version (str): Version from intro_cache_version()
+        text (str): The generated monologue
+    """
+    key = f"intro:{char_id}"
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={'version': version, 'text': text, 'uses': 0})
+        if INTRO_CACHE_TTL:
+            pipe.expire(key, INTRO_CACHE_TTL)
+        with metrics.time('stage_duration_seconds', stage='intro_cache_write'):
+            pipe.execute()
+    except redis.RedisError as e:
+        print(f"Intro cache write failed for character {char_id}: {e}")
+
+def get_intro_monologue(char_id, char_info, timeout=None, hedge=False):
+    """
+    Return the character's introduction monologue, generating it on a cache miss.
+
+    Args:
+        char_id (int): Character ID
+        char_info (dict): Registry record with the character's persona
+        timeout (float, optional): Timeout in seconds for the LLM call
+        hedge (bool): Hedge a slow LLM call (see llm_complete)
+
+    Returns:
+        str: The monologue
+    """
+    version = intro_cache_version(char_info['persona'])
+    text = get_cached_intro(char_id, version)
+    if text is None:
+        text = generate_intro_monologue(char_id, char_info, version, timeout, hedge)
+    return text
+
+def generate_intro_monologue(char_id, char_info, version, timeout=None, hedge=False):
+    """Generate a character's introduction monologue and cache it under `version`."""
+    text = query_gpt(prompt_templates.intro_prompt(char_info['persona']), timeout=timeout, hedge=hedge)
+    store_cached_intro(char_id, version, text)
+    return text
+
+async def generate_intro_monologue_async(llm_session, char_id, char_info, version, timeout=None, hedge=False):
+    """Async twin of generate_intro_monologue."""
+    text = await query_gpt_async(
+        llm_session, prompt_templates.intro_prompt(char_info['persona']), timeout=timeout, hedge=hedge
+    )
+    await asyncio.to_thread(store_cached_intro, char_id, version, text)
+    return text
+
+async def get_intro_monologue_async(llm_session, char_id, char_info, timeout=None, hedge=False):
+    """Async twin of get_intro_monologue (Redis access runs in a worker thread)."""
+    version = intro_cache_version(char_info['persona'])
+    text = await asyncio.to_thread(get_cached_intro, char_id, version)
+    if text is None:
+        text = await generate_intro_monologue_async(llm_session, char_id, char_info, version, timeout, hedge)
+    return text
+
+def get_intro_monologues(char_infos, timeout=None, hedge=False):
+    """
+    Return several characters' monologues: one cache read for all of them,
+    then the misses generated concurrently.
+
+    Args:
+        char_infos (dict): char_id -> registry record with the character's persona
+
+    Returns:
+        dict: char_id -> the monologue, or the exception that stopped it
+        being generated
+    """
+    versions = {char_id: intro_cache_version(char_info['persona']) for char_id, char_info in char_infos.items()}
+    monologues = get_cached_intros(versions)
+    missing = [char_id for char_id, text in monologues.items() if text is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = {
+                char_id: executor.submit(
+                    generate_intro_monologue, char_id, char_infos[char_id], versions[char_id], timeout, hedge
+                )
+                for char_id in missing
+            }
+        for char_id, future in futures.items():
+            try:
+                monologues[char_id] = future.result()
+            except Exception as exc:
+                monologues[char_id] = exc
+    return monologues
+
+async def get_intro_monologues_async(llm_session, char_infos, timeout=None, hedge=False):
+    """Async twin of get_intro_monologues."""
+    versions = {char_id: intro_cache_version(char_info['persona']) for char_id, char_info in char_infos.items()}
+    monologues = await asyncio.to_thread(get_cached_intros, versions)
+    missing = [char_id for char_id, text in monologues.items() if text is None]
+    generated = await asyncio.gather(*(
+        generate_intro_monologue_async(llm_session, char_id, char_infos[char_id], versions[char_id], timeout, hedge)
+        for char_id in missing
+    ), return_exceptions=True)
+    monologues.update(zip(missing, generated))
+    return monologues
+
+def prewarm_intro_cache(char_ids, workers=16):
+    """
+    Generate any missing or stale introduction monologues ahead of the first poll.
+
+    Args:
+        char_ids (iterable): Character IDs to warm
+        workers (int): Number of concurrent LLM calls
+
+    Returns:
+        int: How many monologues were (re)generated
+    """
+    char_infos = character_registry.get_many(char_ids)
+    versions = {char_id: intro_cache_version(char_info['persona']) for char_id, char_info in char_infos.items()}
+    # Checking isn't using: leave the regeneration budgets alone
+    cached = get_cached_intros(versions, count_use=False)
+    missing = [char_id for char_id, text in cached.items() if text is None]
+
+    generated = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(generate_intro_monologue, char_id, char_infos[char_id], versions[char_id]): char_id
+            for char_id in missing
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+                generated += 1
+            except Exception as exc:
+                print(f"Could not warm intro for character {futures[future]}: {exc}")
+    return generated
+
+# Tallies only need answer and passion. A verdict-only call asks for just
+# those ({"answer": true, "passion": 0.35} is ~15 tokens) instead of a
+# paragraph of prose; the prose can be generated later, on demand, with
+# generate_character_prose.
+VERDICT_MAX_TOKENS = 30
+
+def _question_request(prompt, timeout=None, verdict_only=False):
+    if verdict_only:
+        return _structured_request(prompt, 'character_verdict', timeout, max_tokens=VERDICT_MAX_TOKENS)
+    return _structured_request(prompt, 'character_question_response', timeout)
+
+def considerQuestion(question, char_id, char_info=None, timeout=None, verdict_only=False):
+    # Extract character persona and name (callers fanning out over many
+    # characters pass char_info in, prefetched with character_registry.get_many).
+    if char_info is None:
+        char_info = get_character_info(char_id)
+
+    # The monologue doesn't depend on the question, so it usually comes from cache.
+    # Polls fan out over many characters, so both calls are hedged against stragglers.
+    response_1 = get_intro_monologue(int(char_id), char_info, timeout, hedge=True)
+    prompt_2 = prompt_templates.question_prompt(char_info['persona'], response_1, question, verdict_only)
+    
+    # Use structured output for the response ({'answer', 'passion'} only if verdict_only)
+    response = llm_complete(_question_request(prompt_2, timeout, verdict_only), 'considerQuestion', hedge=True)
+    
+    # Parse and return the structured response
+    return json.loads(response.content)
+
+async def considerQuestion_async(llm_session, question, char_id, char_info=None, timeout=None, verdict_only=False):
+    """Async twin of considerQuestion: same two-call chain on an LLM async session."""
+    if char_info is None:
+        char_info = get_character_info(char_id)
+
+    response_1 = await get_intro_monologue_async(llm_session, int(char_id), char_info, timeout, hedge=True)
+    prompt_2 = prompt_templates.question_prompt(char_info['persona'], response_1, question, verdict_only)
+
+    response = await llm_complete_async(
+        llm_session, _question_request(prompt_2, timeout, verdict_only), 'considerQuestion', hedge=True
+    )
+    return json.loads(response.content)
+
+def save_character_result(char_id, result, buffer=None, question=None, session=None):
+    """
+    Store a character's poll result (response, answer, passion) in Redis.
+
+    Args:
+        char_id (int): Character ID
+        result (dict): {'response': str, 'answer': bool, 'passion': float};
+            a verdict without 'response' clears the stored chat until
+            generate_character_prose fills it in
+        buffer (WriteBehindBuffer, optional): Queue the write here instead of
+            sending it now (the buffer's session is used)
+        question (str, optional): When given, the response is also added to
+            the character's chat history
+        session (str, optional): Session namespace for an unbuffered write
+
+    Returns:
+        dict: The stored {'response', 'answer', 'passion'} values
+    """
+    # Extract structured data
+    response_text = result.get('response', '')
+    answer_bool = result['answer']
+    passion_score = result['passion']
+    
+    # Update Redis cache with the character's response, answer, and passion
+    # (a verdict's history entry is added with its prose, if that is ever asked for)
+    entry = None
+    if question is not None and response_text:
+        entry = chat_history_entry('poll', response_text, question=question, answer=answer_bool, passion=passion_score)
+    if buffer is not None:
+        buffer.update(char_id, chat=response_text, answer=answer_bool, passion=passion_score)
+        if entry:
+            buffer.append_history(char_id, entry)
+    else:
+        pipe = redis_client.pipeline(transaction=False)
+        update_character_fields(char_id, chat=response_text, answer=answer_bool, passion=passion_score,
+                                pipe=pipe, session=session)
+        if entry:
+            append_chat_history(char_id, entry, pipe, session)
+        with metrics.time('stage_duration_seconds', stage='redis_write'):
+            pipe.execute()
+    
+    return {
+        'response': response_text,
+        'answer': answer_bool,
+        'passion': passion_score
+    }
+
+def process_character(char_id, question, char_info=None, timeout=None, buffer=None, session=None,
+                      verdict_only=False):
+    """
+    Process a single character's response to a question.
+    Now returns structured response with response text, answer, and passion.
+    Updates Redis cache with the conversation, answer, and passion
+    (or queues the update on `buffer`, see WriteBehindBuffer) in the
+    given session's namespace. With verdict_only the response text is ''.
+    """
+    result = considerQuestion(question, char_id, char_info, timeout, verdict_only)
+    return save_character_result(char_id, result, buffer, question, session)
+
+async def process_character_async(llm_session, char_id, question, char_info=None, timeout=None, buffer=None,
+                                  session=None, verdict_only=False):
+    """
+    Async twin of process_character. Without a write-behind buffer the
+    (blocking) Redis write runs in a worker thread so it doesn't stall the
+    event loop.
+    """
+    result = await considerQuestion_async(llm_session, question, char_id, char_info, timeout, verdict_only)
+    if buffer is not None:
+        return save_character_result(char_id, result, buffer, question)
+    return await asyncio.to_thread(save_character_result, char_id, result, None, question, session)
+
+PROSE_MAX_TOKENS = 300
+
+def generate_character_prose(char_id, session=None):
+    """
+    Write the reply behind a character's stored verdict (after a verdict-only poll).
+
+    The answer and passion stay as they are: the prompt tells the character
+    which answer it gave. A character that already has a reply keeps it.
+
+    Args:
+        char_id (int): Character ID
+        session (str, optional): Session namespace
+
+    Returns:
+        dict: The character's {'id', 'chat', 'answer', 'passion'}, or None
+        if it has no state in the session
+    """
+    characters = get_characters_data([char_id], session)
+    if not characters:
+        return None
+    character = characters[0]
+    if character['chat']:
+        return character
+
+    char_info = get_character_info(char_id)
+    question = get_global_question(session)
+    monologue = get_intro_monologue(int(char_id), char_info)
+    prompt = prompt_templates.prose_prompt(char_info['persona'], monologue, question, character['answer'])
+    text = llm_complete(_chat_request(prompt, max_tokens=PROSE_MAX_TOKENS), 'character_prose').content
+
+    pipe = redis_client.pipeline(transaction=False)
+    update_character_fields(char_id, chat=text, pipe=pipe, session=session)
+    append_chat_history(char_id, chat_history_entry(
+        'poll', text, question=question, answer=character['answer'], passion=character['passion']
+    ), pipe, session)
+    pipe.execute()
+    return {**character, 'chat': text}
+
+def character_conversation_response(char_id, conversation_so_far, char_info=None, question=None, session=None):
+    """
+    Get a character's response to the ongoing conversation.
+    
+    Args:
+        char_id (int): Character ID
+        conversation_so_far (str): The conversation that has happened so far
+        char_info (dict, optional): Prefetched registry record for the character
+        question (str, optional): The question under discussion (read from
+            the session when not given)
+        session (str, optional): Session namespace
+    
+    Returns:
+        str: The character's response to add to the conversation
+    """
+    if char_info is None:
+        char_info = get_character_info(char_id)
+    if question is None:
+        question = get_global_question(session)
+    
+    prompt = f"""{char_info['persona']}
+
+The question being discussed is: {question}
+
+Conversation so far:
+{conversation_so_far}
+
+As {char_info['name']}, respond to this conversation with your thoughts. Keep your response conversational and under 100 words."""
+    
+    response = query_gpt(prompt, call_site='character_conversation_response')
+    return response
+
+def check_mind_changed(char_id, conversation_log, char_info=None, question=None, session=None):
+    """
+    Ask a character if their mind has changed after the conversation.
+    
+    Args:
+        char_id (int): Character ID
+        conversation_log (str): The full conversation
+        char_info (dict, optional): Prefetched registry record for the character
+        question (str, optional): The original question (read from the
+            session when not given)
+        session (str, optional): Session namespace
+    
+    Returns:
+        dict: {'answer': bool, 'passion': float}
+    """
+    if char_info is None:
+        char_info = get_character_info(char_id)
+    if question is None:
+        question = get_global_question(session)
+    
+    prompt = f"""{char_info['persona']}
+
+Original question: {question}
+
+After this conversation:
+{conversation_log}
+
+Has your answer changed? Respond with your final position on the question."""
+    
+    # Only the verdict is kept, so don't pay for a reply
+    response = llm_complete(
+        _structured_request(prompt, 'character_verdict', max_tokens=VERDICT_MAX_TOKENS), 'check_mind_changed'
+    )
+    
+    result = json.loads(response.content)
+    return {
+        'answer': result['answer'],
+        'passion': result['passion']
+    }
+
+MIND_CHANGE_WORKERS = int(os.getenv("MIND_CHANGE_WORKERS", "20"))   # parallel re-evaluations per conversation
+
+def check_minds_changed(char_ids, conversation_log, char_infos=None, workers=None, question=None, session=None,
+                        prompt_batch=None):
+    """
+    Run check_mind_changed for every participant concurrently.
+
+    Every call sees the same finished conversation, so they are independent;
+    a failure for one character doesn't affect the others. With prompt_batch
+    above 1, participants are first asked in groups (see
+    check_minds_changed_batch) and only those without a valid verdict are
+    asked on their own.
+
+    Args:
+        char_ids (list): Participant IDs
+        conversation_log (str): The full conversation
+        char_infos (dict, optional): Prefetched registry records by ID
+        workers (int, optional): Max concurrent LLM calls (defaults to MIND_CHANGE_WORKERS)
+        question (str, optional): The original question (read once from the session when not given)
+        session (str, optional): Session namespace
+        prompt_batch (int, optional): Participants per call (defaults to MIND_CHANGE_PROMPT_BATCH)
+
+    Returns:
+        tuple: (verdicts, errors) - char_id -> {'answer', 'passion'} for the
+        characters that answered, and char_id -> error message for the rest
+    """
+    char_infos = char_infos or character_registry.get_many(char_ids)
+    workers = max(1, min(workers or MIND_CHANGE_WORKERS, len(char_ids)))
+    prompt_batch = max(1, prompt_batch or MIND_CHANGE_PROMPT_BATCH)
+    if question is None:
+        question = get_global_question(session)
+
+    verdicts = {}
+    errors = {}
+    pending = list(char_ids)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if prompt_batch > 1:
+            future_to_group = {
+                executor.submit(check_minds_changed_batch, group, conversation_log, char_infos, question): group
+                for group in _batches(char_ids, prompt_batch)
+            }
+            for future in as_completed(future_to_group):
+                group = future_to_group[future]
+                try:
+                    verdicts.update(future.result())
+                except LLMRateLimited as exc:
+                    errors.update(dict.fromkeys(group, str(exc)))
+                except Exception as exc:
+                    print(f"Batched mind-change check for characters {group} failed: {exc}")
+            pending = [char_id for char_id in char_ids if char_id not in verdicts and char_id not in errors]
+            if pending:
+                metrics.inc('llm_batch_fallbacks_total', len(pending), call_site='check_mind_changed')
+
+        future_to_char = {
+            executor.submit(check_mind_changed, char_id, conversation_log, char_infos.get(char_id), question): char_id
+            for char_id in pending
+        }
+        for future in as_completed(future_to_char):
+            char_id = future_to_char[future]
+            try:
+                verdicts[char_id] = future.result()
+            except Exception as exc:
+                print(f"Mind-change check for character {char_id} failed: {exc}")
+                errors[char_id] = str(exc)
+    return verdicts, errors
+
+# ============================================
+# BATCHED PROMPTING
+# ============================================
+# One call can carry K characters: their personas (and, for polls, their
+# cached monologues) go in <CHARACTER id> blocks next to the shared question
+# or conversation, which is then sent once instead of K times. The reply is
+# a strict JSON list of {id, response, answer, passion}. Every item is
+# checked; characters missing from the reply or with a malformed item, and
+# the whole group if the call fails, are asked again with the
+# single-character call. K=1 (the default) keeps one call per character.
+
+POLL_PROMPT_BATCH = int(os.getenv("POLL_PROMPT_BATCH", "1"))                # characters per poll call
+MIND_CHANGE_PROMPT_BATCH = int(os.getenv("MIND_CHANGE_PROMPT_BATCH", "1"))  # participants per mind-change call
+MAX_PROMPT_BATCH = 40
+BATCH_TOKENS_PER_CHARACTER = 400   # completion budget per character in a batched reply
+BATCH_VERDICT_TOKENS_PER_CHARACTER = 25   # ... and in a batched verdict-only reply
+
+def _batches(char_ids, size):
+    """Split char_ids into consecutive groups of at most `size`."""
+    char_ids = list(char_ids)
+    return [char_ids[i:i + size] for i in range(0, len(char_ids), size)]
+
+def _batch_request(prompt, count, timeout=None, verdict_only=False):
+    """A batched request with room for `count` answers (character_batch_verdict ones if verdict_only)."""
+    if verdict_only:
+        return _structured_request(prompt, 'character_batch_verdict', timeout,
+                                   max_tokens=BATCH_VERDICT_TOKENS_PER_CHARACTER * count)
+    return _structured_request(prompt, 'character_batch_response', timeout,
+                               max_tokens=min(16000, BATCH_TOKENS_PER_CHARACTER * count))
+
+def parse_batch_response(content, char_ids, verdict_only=False):
+    """
+    Validate a character_batch_response reply against the characters asked.
+
+    Args:
+        content (str): The reply's JSON
+        char_ids (list): Characters the call was for
+        verdict_only (bool): The reply is a character_batch_verdict (no 'response')
+
+    Returns:
+        dict: char_id -> {'response', 'answer', 'passion'} ({'answer',
+        'passion'} if verdict_only) for every valid item; unknown ids,
+        repeats and malformed items are left out
+    """
+    try:
+        items = json.loads(content)['characters']
+    except (ValueError, KeyError, TypeError):
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    wanted = set(char_ids)
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        char_id = item.get('id')
+        response = item.get('response')
+        answer = item.get('answer')
+        passion = item.get('passion')
+        if (
+            char_id not in wanted or char_id in results
+            or not (verdict_only or isinstance(response, str) and response.strip())
+            or not isinstance(answer, bool)
+            or isinstance(passion, bool) or not isinstance(passion, (int, float)) or not 0 <= passion <= 1
+        ):
+            continue
+        results[char_id] = {'answer': answer, 'passion': float(passion)}
+        if not verdict_only:
+            results[char_id]['response'] = response
+    return results
+
+def considerQuestion_batch(question, char_ids, char_infos, timeout=None, verdict_only=False):
+    """
+    Ask several characters the question in one structured call.
+
+    Args:
+        question (str): The question being asked
+        char_ids (list): Characters to ask together
+        char_infos (dict): Prefetched registry records by ID
+        timeout (float, optional): Per-call timeout in seconds
+        verdict_only (bool): Ask for {'answer', 'passion'} only
+
+    Returns:
+        dict: char_id -> {'response', 'answer', 'passion'} for the characters
+        with a valid item in the reply (a character whose monologue couldn't
+        be produced is left out of the call)
+    """
+    char_infos = {char_id: char_infos.get(char_id) or get_character_info(char_id) for char_id in char_ids}
+    monologues = get_intro_monologues(char_infos, timeout, hedge=True)
+    characters = []
+    for char_id in char_ids:
+        if isinstance(monologues[char_id], Exception):
+            print(f"No intro monologue for character {char_id}: {monologues[char_id]}")
+        else:
+            characters.append((char_id, char_infos[char_id]['persona'], monologues[char_id]))
+    if not characters:
+        return {}
+
+    prompt = prompt_templates.batch_question_prompt(characters, question, verdict_only)
+    response = llm_complete(
+        _batch_request(prompt, len(characters), timeout, verdict_only), 'considerQuestion_batch', hedge=True
+    )
+    return parse_batch_response(response.content, [char_id for char_id, _, _ in characters], verdict_only)
+
+async def considerQuestion_batch_async(llm_session, question, char_ids, char_infos, timeout=None,
+                                       verdict_only=False):
+    """Async twin of considerQuestion_batch."""
+    char_infos = {char_id: char_infos.get(char_id) or get_character_info(char_id) for char_id in char_ids}
+    monologues = await get_intro_monologues_async(llm_session, char_infos, timeout, hedge=True)
+    characters = []
+    for char_id in char_ids:
+        monologue = monologues[char_id]
+        if isinstance(monologue, Exception):
+            print(f"No intro monologue for character {char_id}: {monologue}")
+        else:
+            characters.append((char_id, char_infos[char_id]['persona'], monologue))
+    if not characters:
+        return {}
+
+    prompt = prompt_templates.batch_question_prompt(characters, question, verdict_only)
+    response = await llm_complete_async(
+        llm_session, _batch_request(prompt, len(characters), timeout, verdict_only), 'considerQuestion_batch',
+        hedge=True
+    )
+    return parse_batch_response(response.content, [char_id for char_id, _, _ in characters], verdict_only)
+
+def _save_batch_results(results, buffer, question, session):
+    """save_character_result for each batched answer, as (char_id, result, exc) outcomes."""
+    outcomes = []
+    for char_id, result in results.items():
+        try:
+            outcomes.append((char_id, save_character_result(char_id, result, buffer, question, session), None))
+        except Exception as exc:
+            outcomes.append((char_id, None, exc))
+    return outcomes
+
+def _batch_failed(char_ids, exc):
+    """Log a failed batched call; rate limiting isn't retried one character at a time."""
+    if isinstance(exc, LLMRateLimited):
+        raise exc
+    print(f"Batched call for characters {char_ids} failed, asking them one by one: {exc}")
+    return {}
+
+def process_characters_batch(char_ids, question, char_infos, timeout=None, buffer=None, session=None,
+                             verdict_only=False):
+    """
+    Batched twin of process_character for a group of characters.
+
+    Characters without a valid answer in the batched reply fall back to
+    process_character, concurrently.
+
+    Returns:
+        list: (char_id, result, exc) for every character, as iter_thread_poll yields them
+    """
+    try:
+        results = considerQuestion_batch(question, char_ids, char_infos, timeout, verdict_only)
+    except Exception as exc:
+        results = _batch_failed(char_ids, exc)
+    outcomes = _save_batch_results(results, buffer, question, session)
+
+    missing = [char_id for char_id in char_ids if char_id not in results]
+    if missing:
+        metrics.inc('llm_batch_fallbacks_total', len(missing), call_site='considerQuestion')
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            future_to_char = {
+                executor.submit(process_character, char_id, question, char_infos.get(char_id), timeout, buffer,
+                                session, verdict_only): char_id
+                for char_id in missing
+            }
+            for future in as_completed(future_to_char):
+                try:
+                    outcomes.append((future_to_char[future], future.result(), None))
+                except Exception as exc:
+                    outcomes.append((future_to_char[future], None, exc))
+    return outcomes
+
+async def process_characters_batch_async(llm_session, char_ids, question, char_infos, timeout=None, buffer=None,
+                                         session=None, verdict_only=False):
+    """Async twin of process_characters_batch."""
+    try:
+        results = await considerQuestion_batch_async(
+            llm_session, question, char_ids, char_infos, timeout, verdict_only
+        )
+    except Exception as exc:
+        results = _batch_failed(char_ids, exc)
+    if buffer is not None:
+        outcomes = _save_batch_results(results, buffer, question, session)
+    else:
+        outcomes = await asyncio.to_thread(_save_batch_results, results, None, question, session)
+
+    async def fallback(char_id):
+        try:
+            result = await process_character_async(
+                llm_session, char_id, question, char_infos.get(char_id), timeout, buffer, session, verdict_only
+            )
+            return char_id, result, None
+        except Exception as exc:
+            return char_id, None, exc
+
+    missing = [char_id for char_id in char_ids if char_id not in results]
+    if missing:
+        metrics.inc('llm_batch_fallbacks_total', len(missing), call_site='considerQuestion')
+        outcomes.extend(await asyncio.gather(*(fallback(char_id) for char_id in missing)))
+    return outcomes
+
+def check_minds_changed_batch(char_ids, conversation_log, char_infos, question):
+    """
+    Ask several participants in one call whether the conversation changed their minds.
+
+    Args:
+        char_ids (list): Participants to ask together
+        conversation_log (str): The conversation (as every participant saw it)
+        char_infos (dict): Prefetched registry records by ID
+        question (str): The original question
+
+    Returns:
+        dict: char_id -> {'answer', 'passion'} for the participants with a
+        valid item in the reply
+    """
+    blocks = ''.join(
+        f"<CHARACTER {char_id}>\n{(char_infos.get(char_id) or get_character_info(char_id))['persona']}\n"
+        f"</CHARACTER {char_id}>\n\n"
+        for char_id in char_ids
+    )
+    prompt = f"""You are playing each of the characters below, separately. Each one knows only its own persona.
+
+{blocks}Original question: {question}
+
+After this conversation:
+{conversation_log}
+
+Has each character's answer changed? For every character above, give its final position on the question, using its id."""
+
+    response = llm_complete(_batch_request(prompt, len(char_ids), verdict_only=True), 'check_mind_changed_batch')
+    return parse_batch_response(response.content, char_ids, verdict_only=True)
+
+# ============================================
+# CONVERSATION CONTEXT
+# ============================================
+# Re-sending the whole transcript to every next speaker makes prompt tokens
+# grow quadratically with group size. Speakers instead see the last few
+# turns verbatim plus a running summary of everything before them.
+
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "6"))      # turns kept verbatim
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))   # summary + recent turns
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "200"))
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token for English)."""
+    return len(text) // 4 + 1
+
+def summarize_conversation(previous_summary, turns, question=''):
+    """
+    Fold turns that scrolled out of the window into the running summary.
+
+    Args:
+        previous_summary (str): Summary so far ('' at first)
+        turns (list): "Name: text" lines to fold in
+        question (str): The question under discussion
+
+    Returns:
+        str: The updated summary
+    """
+    prompt = f"""Summarize this group discussion about the question "{question}" in under {CONTEXT_SUMMARY_TOKENS // 2} words.
+Keep who said what and where each person stands.
+
+Summary so far:
+{previous_summary or '(none)'}
+
+New remarks:
+{chr(10).join(turns)}"""
+    try:
+        response = llm_complete(
+            _chat_request(prompt, max_tokens=CONTEXT_SUMMARY_TOKENS, temperature=0.3),
+            'summarize_conversation'
+        )
+        return response.content.strip()
+    except Exception as e:
+        # Fall back to keeping the tail of the raw text within the summary budget
+        print(f"Conversation summary failed, truncating instead: {e}")
+        text = (previous_summary + "\n" + "\n".join(turns)).strip()
+        return text[-CONTEXT_SUMMARY_TOKENS * 4:]
+
+
+class ConversationContext:
+    """
+    Transcript of a group conversation with a bounded prompt view.
+
+    add() records every turn (full_log() returns them all, for storage);
+    render() returns what the next speaker sees: a summary of older turns
+    plus the most recent ones verbatim, within CONTEXT_TOKEN_BUDGET.
+    """
+
+    def __init__(self, question='', recent_turns=None, token_budget=None):
+        self.question = question
+        self.recent_turns = recent_turns or CONTEXT_RECENT_TURNS
+        self.token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+        self.turns = []         # every "Name: text" line
+        self.recent = deque()   # the verbatim window
+        self.summary = ''
+
+    def __len__(self):
+        return len(self.turns)
+
+    def _window_tokens(self):
+        return estimate_tokens(self.summary) + sum(estimate_tokens(turn) for turn in self.recent)
+
+    def add(self, speaker, text):
+        """Record a turn, summarizing whatever falls out of the window."""
+        self.add_many([(speaker, text)])
+
+    def add_many(self, turns):
+        """Record several (speaker, text) turns, e.g. a whole round, with at most one summary call."""
+        for speaker, text in turns:
+            turn = f"{speaker}: {text}"
+            self.turns.append(turn)
+            self.recent.append(turn)
+
+        if len(self.recent) <= self.recent_turns and self._window_tokens() <= self.token_budget:
+            return
+
+        # Over the limit: fold the older half of the window into the summary in
+        # one go, so there is one summary call every few turns, not every turn
+        keep = max(1, self.recent_turns // 2)
+        evicted = []
+        while len(self.recent) > 1 and (
+            len(self.recent) > keep or self._window_tokens() > self.token_budget
+        ):
+            evicted.append(self.recent.popleft())
+        self.summary = summarize_conversation(self.summary, evicted, self.question)
+
+    def render(self):
+        """The bounded transcript to put in the next speaker's prompt."""
+        recent = "\n\n".join(self.recent) + "\n\n"
+        if not self.summary:
+            return recent
+        return f"(Summary of the earlier discussion: {self.summary})\n\n{recent}"
+
+    def full_log(self):
+        """The complete transcript, in the original "Name: text" format."""
+        return "".join(turn + "\n\n" for turn in self.turns)
+
+# ============================================
+# CONVERSATION ROUNDS
+# ============================================
+# A sequential conversation has each speaker answer the one before, so N
+# participants cost N-1 LLM latencies back to back. In round mode everyone
+# opens with their poll reply, then in each round every participant
+# responds at once to the transcript as it stood at the end of the previous
+# round. Latency grows with the number of rounds, not participants. A
+# round's turns are added in speaking (passion) order, whatever order the
+# calls finish in, so the transcript is deterministic.
+
+CONVERSATION_MODE = os.getenv("CONVERSATION_MODE", "sequential")     # 'sequential' or 'rounds'
+CONVERSATION_ROUNDS = int(os.getenv("CONVERSATION_ROUNDS", "1"))      # response rounds after the openings
+MAX_CONVERSATION_ROUNDS = 5
+CONVERSATION_WORKERS = int(os.getenv("CONVERSATION_WORKERS", "20"))   # concurrent turns within a round
+
+def run_conversation_rounds(context, participants, char_infos, question, rounds=None, workers=None, session=None):
+    """
+    Run a round-based conversation.
+
+    Args:
+        context (ConversationContext): Transcript the turns are added to
+        participants (list): Character data ({'id', 'chat', ...}) in speaking order
+        char_infos (dict): Prefetched registry records by ID
+        question (str): The question under discussion
+        rounds (int, optional): Response rounds after the openings (defaults to CONVERSATION_ROUNDS)
+        workers (int, optional): Max concurrent LLM calls (defaults to CONVERSATION_WORKERS)
+        session (str, optional): Session namespace
+
+    Returns:
+        tuple: (spoken, errors) - char_id -> list of what the character said,
+        and char_id -> error message for characters that missed a turn (the
+        rest of the conversation goes on without that turn)
+    """
+    rounds = CONVERSATION_ROUNDS if rounds is None else rounds
+    char_ids = [participant['id'] for participant in participants]
+    workers = max(1, min(workers or CONVERSATION_WORKERS, len(char_ids)))
+    spoken = {char_id: [] for char_id in char_ids}
+    errors = {}
+
+    def add_round(texts):
+        turns = [(char_infos[char_id]['name'], texts[char_id]) for char_id in char_ids if char_id in texts]
+        context.add_many(turns)
+        for char_id in char_ids:
+            if char_id in texts:
+                spoken[char_id].append(texts[char_id])
+
+    def gather(future_to_char, pick=lambda result: result):
+        texts = {}
+        for future in as_completed(future_to_char):
+            char_id = future_to_char[future]
+            try:
+                texts[char_id] = pick(future.result())
+            except Exception as exc:
+                print(f"Character {char_id} missed a conversation turn: {exc}")
+                errors[char_id] = str(exc)
+        return texts
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Openings are the poll replies, written now if the poll was verdict-only
+        openings = {participant['id']: participant['chat'] for participant in participants if participant['chat']}
+        openings.update(gather({
+            executor.submit(generate_character_prose, char_id, session): char_id
+            for char_id in char_ids if char_id not in openings
+        }, pick=lambda character: character['chat']))
+        add_round(openings)
+
+        for _ in range(rounds):
+            transcript = context.render()
+            add_round(gather({
+                executor.submit(character_conversation_response, char_id, transcript, char_infos[char_id], question):
+                    char_id
+                for char_id in char_ids
+            }))
+    return spoken, errors
+
+# ============================================
+# POLL ENGINES
+# ============================================
+# promptCharacters fans a question out to many characters. Two engines:
+#   'async'  - coroutines on one async LLM session, bounded by a semaphore
+#   'thread' - the original ThreadPoolExecutor (kept as a fallback and for
+#              side-by-side benchmarking)
+# A poll stops at its deadline (POLL_DEADLINE, under Vercel's 60 s function
+# limit) and returns what it has: characters still outstanding are reported
+# as timed out and characters whose chain failed as errors. Neither counts
+# towards the yes/no totals. A call cut off by its own timeout once the
+# deadline has passed is a straggler too, so it is reported as timed out.
+# Both engines give a character's whole chain the same deadline: on a cold
+# intro cache that is two calls in a row, so short deadlines answer far fewer
+# characters until the cache is warm (see prewarm_intro_cache).
+
+POLL_ENGINE = os.getenv("POLL_ENGINE", "async")
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "100"))   # max characters in flight
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))             # seconds per completion call
+POLL_DEADLINE = float(os.getenv("POLL_DEADLINE", "50"))         # seconds per poll, 0 for none
+POLL_WRITE_BEHIND = os.getenv("POLL_WRITE_BEHIND", "1") != "0"  # flush a poll's results in one pipeline
+
+
+class PollDeadlineExceeded(Exception):
+    """A character had not answered when its poll's deadline passed."""
 
-# ============================================
-# REDIS CACHE SETUP
-# ============================================
-# Redis is an in-memory database - super fast for caching data
-# Install with: pip install redis
-# Make sure Redis server is running: redis-server
 
-# Redis connection - supports both local development and Vercel (Upstash)
-redis_url = os.getenv("REDIS_URL")
-if redis_url:
-    # For Upstash Redis or Redis with URL format: redis://host:port
-    redis_client = redis.from_url(redis_url, decode_responses=True)
-else:
-    # Fallback to localhost for local development
-    redis_client = redis.Redis(
-        host='localhost',  # Redis server location
-        port=6379,         # Default Redis port
-        db=0,              # Database number (Redis has 16 databases by default)
-        decode_responses=True  # Automatically convert bytes to strings
-    )
+class PollTally:
+    """Running yes/no/passion totals for one poll, shared by both engines."""
 
-def get_character_info(char_id):
-    """
-    Get character name and persona from all-characters.json
-    
-    Args:
-        char_id (str or int): Character ID (e.g., "1", "0001", or 1)
-    
-    Returns:
-        dict: {'name': str, 'persona': str} or None if not found
-    """
-    # Format the character ID with leading zeros
-    char_id_str = str(char_id)
-    while len(char_id_str) < 4:
-        char_id_str = "0" + char_id_str
-    
-    char_key = f"character_{char_id_str}"
-    
-    # Path to the JSON file (change this to your actual path)
-    json_path = Path(__file__).parent.parent / "frontend" / "public" / "characters" / "data" / "all-characters.json"
-    
-    # Load and extract data
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    if char_key in data["characters"]:
-        character = data["characters"][char_key]
+    def __init__(self, total):
+        self.total = total
+        self.count_yes = 0
+        self.count_no = 0
+        self.total_passion = 0.0
+        self.errors = 0
+        self.results = {}   # char_id -> {'response', 'answer', 'passion'}
+        self.failed = {}    # char_id -> error message
+        self.timed_out = []
+        self.poll_id = None # set once the poll is recorded in the history
+
+    @property
+    def completed(self):
+        return self.count_yes + self.count_no
+
+    @property
+    def partial(self):
+        """True when some characters failed or ran out of time."""
+        return self.completed < self.total
+
+    def add(self, char_id, result):
+        answer = result['answer']
+        passion = result['passion']
+        self.results[char_id] = result
+
+        if answer:
+            self.count_yes += 1
+        else:
+            self.count_no += 1
+
+        self.total_passion += passion
+        print(f"Character {char_id} completed: {'Yes' if answer else 'No'} (passion: {passion:.2f})")
+
+    def add_error(self, char_id, exc):
+        if isinstance(exc, PollDeadlineExceeded):
+            self.add_timeout(char_id)
+            return
+        print(f"Character {char_id} generated an exception: {exc}")
+        metrics.inc('poll_character_errors_total')
+        self.failed[char_id] = str(exc)
+        self.errors += 1
+
+    def add_timeout(self, char_id):
+        print(f"Character {char_id} timed out")
+        metrics.inc('poll_character_timeouts_total')
+        self.timed_out.append(char_id)
+
+    def summary(self):
         return {
-            'name': character.get('name', ''),
-            'persona': character.get('persona', '')
+            'yes_count': self.count_yes,
+            'no_count': self.count_no,
+            'total': self.total,
+            'answered': self.completed,
+            'average_passion': self.total_passion / self.completed if self.completed else 0.0,
+            'partial': self.partial,
+            'timed_out': sorted(self.timed_out),
+            'errors': sorted(self.failed),
+            'poll_id': self.poll_id
+        }
+
+    def running(self):
+        """Tallies so far, for progress reporting while the poll is still going."""
+        return {
+            'yes_count': self.count_yes,
+            'no_count': self.count_no,
+            'completed': self.completed,
+            'total': self.total,
+            'errors': self.errors,
+            'timed_out': len(self.timed_out),
+            'average_passion': self.total_passion / self.completed if self.completed else 0.0
         }
-    
-    return None
 
-def init_character_cache(char_id):
+
+def _poll_limits(timeout, deadline):
     """
-    Initialize a character in Redis cache with default values.
-    
-    Args:
-        char_id (int): Character ID
+    Resolve a poll's per-call timeout and deadline (both in seconds).
+
+    No single call may outlast the whole poll, so the per-call timeout is
+    capped at the deadline. A deadline of 0 (or less) means none.
     """
-    key = f"character:{char_id}"
-    redis_client.hset(key, mapping={
-        'id': char_id,
-        'chat': '',  # Conversation history
-        'answer': 'false',  # Store as string ('true' or 'false')
-        'passion': '0.0'  # Passion score as string
-    })
+    timeout = timeout or LLM_TIMEOUT
+    if deadline is None:
+        deadline = POLL_DEADLINE
+    if deadline <= 0:
+        return timeout, None
+    return min(timeout, deadline), deadline
+
+
+def _is_call_timeout(exc):
+    """True if `exc` is an LLM call's own timeout (mock, OpenAI client or asyncio)."""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, MockLLMTimeout)):
+        return True
+    openai = sys.modules.get('openai')   # only imported once the OpenAI provider is used
+    return openai is not None and isinstance(exc, openai.APITimeoutError)
 
-def get_character_data(char_id):
+
+def _past_deadline(exc, started, deadline):
     """
-    Retrieve character data from Redis.
-    
+    Report a call that timed out at or after the poll's deadline as a straggler.
+
+    Per-call timeouts are capped at the deadline, so a straggler's own timeout
+    fires at the same moment the deadline does.
+
     Returns:
-        dict with keys: id (int), chat (str), answer (bool), passion (float)
+        Exception: PollDeadlineExceeded for such a timeout, otherwise `exc`
     """
-    key = f"character:{char_id}"
-    data = redis_client.hgetall(key)
-    
-    if not data:
-        return None
-    
-    return {
-        'id': int(data['id']),
-        'chat': data['chat'],
-        'answer': data['answer'].lower() == 'true',
-        'passion': float(data.get('passion', '0.0'))
-    }
+    if deadline is not None and _is_call_timeout(exc) and time.monotonic() - started >= deadline:
+        return PollDeadlineExceeded(f"No answer within {deadline:.1f}s")
+    return exc
 
-def update_character_chat(char_id, chat_text):
+
+def iter_thread_poll(question, char_ids, char_infos, concurrency, timeout, buffer=None, task=None, session=None,
+                     deadline=None, prompt_batch=1, verdict_only=False):
     """
-    Update the chat field for a character.
-    
+    Run the thread engine and yield each character as soon as it finishes.
+
     Args:
-        char_id (int): Character ID
-        chat_text (str): The conversation/response text
+        task (callable, optional): Called as task(char_id, question, char_info,
+            timeout, buffer, session) for each character (defaults to
+            process_character; not used when prompt_batch is above 1)
+        session (str, optional): Session namespace the results are written to
+        deadline (float, optional): Seconds from now after which the characters
+            still outstanding are given up on (None: wait for all of them)
+        prompt_batch (int): Characters per LLM call (see process_characters_batch)
+        verdict_only (bool): Ask for answers and passions without prose (a
+            custom `task` handles this itself)
+
+    Yields:
+        tuple: (char_id, result, exc) - exactly one of result/exc is None;
+        characters given up on at the deadline get a PollDeadlineExceeded
     """
-    key = f"character:{char_id}"
-    redis_client.hset(key, 'chat', chat_text)
+    task = task or partial(process_character, verdict_only=verdict_only)
+    started = time.monotonic()
+
+    # Use ThreadPoolExecutor to parallelize API calls. `concurrency` counts
+    # characters, so a batched call takes prompt_batch of them.
+    executor = ThreadPoolExecutor(max_workers=max(1, -(-concurrency // prompt_batch)))
+    try:
+        # Submit all tasks
+        if prompt_batch > 1:
+            future_to_chars = {
+                executor.submit(process_characters_batch, group, question, char_infos, timeout, buffer, session,
+                                verdict_only): group
+                for group in _batches(char_ids, prompt_batch)
+            }
+        else:
+            future_to_chars = {
+                executor.submit(task, i, question, char_infos.get(i), timeout, buffer, session): [i]
+                for i in char_ids
+            }
+
+        # Process results as they complete
+        pending = set(future_to_chars)
+        try:
+            for future in as_completed(future_to_chars, timeout=deadline):
+                pending.discard(future)
+                group = future_to_chars[future]
+                try:
+                    outcomes = future.result() if prompt_batch > 1 else [(group[0], future.result(), None)]
+                except Exception as exc:
+                    outcomes = [(char_id, None, exc) for char_id in group]
+                for char_id, result, exc in outcomes:
+                    yield char_id, result, exc if exc is None else _past_deadline(exc, started, deadline)
+        except TimeoutError:
+            # Threads can't be interrupted: calls already running finish in the
+            # background (a buffered write is dropped), the rest never start
+            for future in sorted(pending, key=lambda f: future_to_chars[f][0]):
+                future.cancel()
+                for char_id in future_to_chars[future]:
+                    yield char_id, None, PollDeadlineExceeded(f"No answer within {deadline:.1f}s")
+    finally:
+        # If the consumer stops early (e.g. a streaming client disconnects),
+        # drop the characters that haven't started yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_thread_poll(question, char_ids, char_infos, tally, concurrency, timeout, buffer, session, deadline,
+                     prompt_batch, verdict_only):
+    for char_id, result, exc in iter_thread_poll(
+        question, char_ids, char_infos, concurrency, timeout, buffer, session=session, deadline=deadline,
+        prompt_batch=prompt_batch, verdict_only=verdict_only
+    ):
+        if exc is None:
+            tally.add(char_id, result)
+        else:
+            tally.add_error(char_id, exc)
+
+
+async def _run_async_poll(question, char_ids, char_infos, tally, concurrency, timeout, buffer, session, deadline,
+                          prompt_batch, verdict_only):
+    if not char_ids:
+        return   # asyncio.wait() rejects an empty set
+    semaphore = asyncio.Semaphore(max(1, -(-concurrency // prompt_batch)))
+    started = time.monotonic()
+
+    # The session is scoped to this event loop; asyncio.run() closes the loop
+    # afterwards, so its connection pool can't be shared across polls.
+    async with get_llm().async_session() as llm_session:
+
+        async def run_group(group):
+            async with semaphore:
+                try:
+                    if prompt_batch > 1:
+                        return await process_characters_batch_async(
+                            llm_session, group, question, char_infos, timeout, buffer, session, verdict_only
+                        )
+                    result = await process_character_async(
+                        llm_session, group[0], question, char_infos.get(group[0]), timeout, buffer, session,
+                        verdict_only
+                    )
+                    return [(group[0], result, None)]
+                except Exception as exc:
+                    return [(char_id, None, exc) for char_id in group]
+
+        tasks = {asyncio.ensure_future(run_group(group)): group for group in _batches(char_ids, prompt_batch)}
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+        # Unlike threads, the stragglers' LLM calls really are cancelled
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+        for task in sorted(tasks, key=lambda t: tasks[t][0]):
+            if task in pending:
+                for char_id in tasks[task]:
+                    tally.add_timeout(char_id)
+                continue
+            for char_id, result, exc in task.result():
+                if exc is None:
+                    tally.add(char_id, result)
+                else:
+                    tally.add_error(char_id, _past_deadline(exc, started, deadline))
+
 
-def update_character_answer(char_id, answer):
+def run_poll(question, char_ids, engine=None, concurrency=None, timeout=None, write_behind=None, session=None,
+             deadline=None, record=True, prompt_batch=None, verdict_only=False):
     """
-    Update the answer field for a character.
-    
+    Ask the given characters the question and tally their answers.
+
     Args:
-        char_id (int): Character ID
-        answer (bool): True for yes, False for no
+        question (str): The question being asked
+        char_ids (list): Character IDs to poll
+        engine (str, optional): 'async' or 'thread' (defaults to POLL_ENGINE)
+        concurrency (int, optional): Max characters in flight (defaults to POLL_CONCURRENCY)
+        timeout (float, optional): Per-call timeout in seconds (defaults to LLM_TIMEOUT)
+        write_behind (bool, optional): Buffer the Redis writes and flush them in
+            one pipeline at the end (defaults to POLL_WRITE_BEHIND)
+        session (str, optional): Session namespace the results are written to
+        deadline (float, optional): Seconds the whole poll may take (defaults
+            to POLL_DEADLINE, 0 for none); characters without an answer by
+            then are tallied as timed out
+        record (bool): Append the poll to the session's history (see record_poll)
+        prompt_batch (int, optional): Characters asked per LLM call (defaults
+            to POLL_PROMPT_BATCH, see process_characters_batch)
+        verdict_only (bool): Only ask for answers and passions; each
+            character's response is '' until generate_character_prose
+
+    Returns:
+        PollTally: Totals plus each character's result
     """
-    key = f"character:{char_id}"
-    redis_client.hset(key, 'answer', 'true' if answer else 'false')
+    engine = engine or POLL_ENGINE
+    concurrency = concurrency or POLL_CONCURRENCY
+    prompt_batch = max(1, prompt_batch or POLL_PROMPT_BATCH)
+    timeout, deadline = _poll_limits(timeout, deadline)
+    if write_behind is None:
+        write_behind = POLL_WRITE_BEHIND
+    buffer = WriteBehindBuffer(session) if write_behind else None
+
+    num = len(char_ids)
+    tally = PollTally(num)
+    if not char_ids:
+        return tally
 
-def update_character_passion(char_id, passion):
+    # Look up every persona up front so the workers never touch the disk
+    char_infos = character_registry.get_many(char_ids)
+
+    started = time.perf_counter()
+    if engine == 'thread':
+        _run_thread_poll(
+            question, char_ids, char_infos, tally, concurrency, timeout, buffer, session, deadline, prompt_batch,
+            verdict_only
+        )
+    elif engine == 'async':
+        asyncio.run(_run_async_poll(
+            question, char_ids, char_infos, tally, concurrency, timeout, buffer, session, deadline, prompt_batch,
+            verdict_only
+        ))
+    else:
+        raise ValueError(f"Unknown poll engine: {engine!r}")
+    if buffer is not None:
+        buffer.flush()
+    if record:
+        tally.poll_id = record_poll(question, tally.results, num, session=session)
+    elapsed = time.perf_counter() - started
+    metrics.observe('stage_duration_seconds', elapsed, stage=f'poll_{engine}')
+    print(f"Polled {num} characters with the {engine} engine in {elapsed:.2f}s "
+          f"({tally.completed} answered, {len(tally.timed_out)} timed out, {tally.errors} errors)")
+    return tally
+
+def promptCharacters(question, num, engine=None, concurrency=None, timeout=None, deadline=None):
     """
-    Update the passion field for a character.
-    
-    Args:
-        char_id (int): Character ID
-        passion (float): Passion score from 0.0 to 1.0
+    Ask characters 1..num the question and tally their answers.
+
+    Returns:
+        dict: {'yes_count', 'no_count', 'total', 'answered', 'average_passion',
+        'partial', 'timed_out', 'errors'}
     """
-    key = f"character:{char_id}"
-    redis_client.hset(key, 'passion', str(passion))
+    tally = run_poll(question, list(range(1, num+1)), engine, concurrency, timeout, deadline=deadline)
 
-def set_global_question(question):
+    # Return results as a dictionary
+    return tally.summary()
+
+# ============================================
+# SAMPLED POLLS
+# ============================================
+# Polling every character costs one LLM chain each. A sampled poll draws
+# characters from the whole population in batches and stops as soon as the
+# confidence intervals for the yes share and the mean passion are narrower
+# than the requested precision (or the query budget runs out).
+
+SAMPLE_BATCH_SIZE = int(os.getenv("SAMPLE_BATCH_SIZE", "50"))
+SAMPLE_MIN_SIZE = 30          # never stop on fewer answers than this
+
+def sample_population():
+    """IDs of every character that has a persona to answer with."""
+    return [char_id for char_id, info in character_registry.get_many(character_registry.ids()).items() if info['persona']]
+
+def sample_order(char_ids, stratify_by=None, seed=None):
     """
-    Store the global question in Redis.
-    
+    Random order in which to query characters.
+
+    With `stratify_by` (an attribute such as 'skin_color' or 'leg_type'),
+    every stratum is spread evenly through the order, so each prefix - and
+    so each batch - is close to a proportional stratified sample.
+
     Args:
-        question (str): The question being asked to all characters
-    """
-    redis_client.set('global:question', question)
+        char_ids (list): Population to draw from
+        stratify_by (str, optional): Attribute name to stratify on
+        seed (int, optional): Seed for a reproducible order
 
-def get_global_question():
-    """
-    Retrieve the global question from Redis.
-    
     Returns:
-        str: The current global question, or empty string if not set
+        list: The IDs in query order
     """
-    question = redis_client.get('global:question')
-    return question if question else ''
+    rng = random.Random(seed)
+    if not stratify_by:
+        order = list(char_ids)
+        rng.shuffle(order)
+        return order
+
+    char_infos = character_registry.get_many(char_ids)
+    strata = {}
+    for char_id in char_ids:
+        strata.setdefault(char_infos[char_id]['attributes'].get(stratify_by), []).append(char_id)
+
+    # Member k of a stratum of size n lands at (k + jitter) / n of the way through
+    positioned = []
+    for members in strata.values():
+        rng.shuffle(members)
+        for k, char_id in enumerate(members):
+            positioned.append(((k + rng.random()) / len(members), char_id))
+    positioned.sort()
+    return [char_id for _, char_id in positioned]
 
-def save_conversation(character_ids, conversation_log):
+def _finite_population_correction(n, population):
+    if population <= 1 or n >= population:
+        return 0.0
+    return ((population - n) / (population - 1)) ** 0.5
+
+def proportion_interval(successes, n, z, population):
+    """Wilson score interval for a proportion, with finite population correction."""
+    if n == 0:
+        return 0.0, 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half = z * ((p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5) / denominator
+    half *= _finite_population_correction(n, population)
+    return p, max(0.0, center - half), min(1.0, center + half)
+
+def mean_interval(values, z, population):
+    """Normal-approximation interval for a mean, with finite population correction."""
+    n = len(values)
+    if n == 0:
+        return 0.0, 0.0, 1.0
+    mean = sum(values) / n
+    if n < 2:
+        return mean, 0.0, 1.0
+    half = z * statistics.stdev(values) / n ** 0.5 * _finite_population_correction(n, population)
+    return mean, max(0.0, mean - half), min(1.0, mean + half)
+
+def sampled_poll(question, precision=0.05, confidence=0.95, max_queries=None,
+                 stratify_by=None, batch_size=None, seed=None, engine=None, session=None, deadline=None,
+                 prompt_batch=None, verdict_only=False):
     """
-    Save a conversation to Redis.
-    
+    Estimate the yes share and mean passion of the whole population from a sample.
+
     Args:
-        character_ids (list): List of character IDs involved
-        conversation_log (str): The full conversation text
-    
+        question (str): The question being asked
+        precision (float): Stop once both interval half-widths are at most this
+        confidence (float): Confidence level of the intervals
+        max_queries (int, optional): Most characters to query (default: all)
+        stratify_by (str, optional): Attribute to stratify the sample on
+        batch_size (int, optional): Characters queried between checks
+            (defaults to SAMPLE_BATCH_SIZE)
+        seed (int, optional): Seed for a reproducible sample
+        engine (str, optional): Poll engine, see run_poll
+        session (str, optional): Session namespace the results are written to
+        deadline (float, optional): Seconds the whole sampled poll may take
+            (defaults to POLL_DEADLINE, 0 for none)
+        prompt_batch (int, optional): Characters per LLM call, see run_poll
+        verdict_only (bool): Skip the prose, see run_poll
+
     Returns:
-        str: The conversation ID
+        tuple: (summary dict, {char_id: result} for every character that answered)
+
+    Raises:
+        ValueError: If batch_size or max_queries is not a positive integer
     """
-    # Generate a unique conversation ID
-    conv_id = redis_client.incr('conversation:counter')
-    key = f"conversation:{conv_id}"
-    
-    redis_client.hset(key, mapping={
-        'id': conv_id,
-        'character_ids': json.dumps(character_ids),
-        'conversation_log': conversation_log
-    })
-    
-    return str(conv_id)
+    for value in (batch_size, max_queries):
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            raise ValueError("batch_size and max_queries must be positive integers")
+    _, deadline = _poll_limits(None, deadline)
+    ends_at = time.monotonic() + deadline if deadline else None
+    population = sample_population()
+    order = sample_order(population, stratify_by, seed)
+    if max_queries:
+        order = order[:max_queries]
+    batch_size = batch_size or SAMPLE_BATCH_SIZE
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+
+    results = {}
+    queried = 0
+    batches = 0
+    stopped_reason = 'population_exhausted'
+    yes_share = passion = (0.0, 0.0, 1.0)
+
+    while queried < len(order):
+        remaining = ends_at - time.monotonic() if ends_at else 0
+        if ends_at and remaining <= 0:
+            stopped_reason = 'deadline_reached'
+            break
+        batch = order[queried:queried + batch_size]
+        queried += len(batch)
+        batches += 1
+        tally = run_poll(
+            question, batch, engine, session=session, deadline=remaining, record=False, prompt_batch=prompt_batch,
+            verdict_only=verdict_only
+        )
+        results.update(tally.results)
+
+        answered = len(results)
+        yes_share = proportion_interval(sum(1 for r in results.values() if r['answer']), answered, z, len(population))
+        passion = mean_interval([r['passion'] for r in results.values()], z, len(population))
+        widest = max(yes_share[2] - yes_share[0], yes_share[0] - yes_share[1],
+                     passion[2] - passion[0], passion[0] - passion[1])
+        print(f"Sampled {queried}/{len(population)}: yes {yes_share[0]:.2f} [{yes_share[1]:.2f}, {yes_share[2]:.2f}], "
+              f"passion {passion[0]:.2f} [{passion[1]:.2f}, {passion[2]:.2f}]")
+
+        if answered >= SAMPLE_MIN_SIZE and widest <= precision:
+            stopped_reason = 'precision_reached'
+            break
+        if max_queries and queried >= max_queries:
+            stopped_reason = 'budget_exhausted'
+            break
+        if tally.timed_out:
+            stopped_reason = 'deadline_reached'
+            break
+
+    answered = len(results)
+    count_yes = sum(1 for r in results.values() if r['answer'])
+    summary = {
+        'mode': 'sample',
+        'population': len(population),
+        'queried': queried,
+        'answered': answered,
+        'batches': batches,
+        'stopped_reason': stopped_reason,
+        'confidence': confidence,
+        'precision': precision,
+        'yes_count': count_yes,
+        'no_count': answered - count_yes,
+        'yes_share': {'estimate': yes_share[0], 'low': yes_share[1], 'high': yes_share[2]},
+        'average_passion': {'estimate': passion[0], 'low': passion[1], 'high': passion[2]},
+        'estimated_yes_count': round(yes_share[0] * len(population))
+    }
+    summary['poll_id'] = record_poll(question, results, queried, mode='sample', session=session)
+    return summary, results
+
+# ============================================
+# QUESTION RESPONSE CACHE
+# ============================================
+# Users ask the same (or nearly the same) question again and again. Finished
+# polls are cached under a fingerprint of the normalized question. Optionally
+# (QUESTION_CACHE_SIMILARITY < 1) near-duplicates are served too. Questions are
+# shingled into ordered word pairs, so "man bites dog" and "dog bites man"
+# share none. MinHash signatures of the shingles, bucketed by LSH bands, find
+# the candidates, and a candidate is used if the exact Jaccard similarity of
+# the shingles reaches the threshold. Negations and numbers flip a question's
+# meaning with a one-word edit, so a candidate must also have exactly the same
+# ones ("buy" / "not buy", "2 pairs" / "3 pairs" never match). Matching is
+# lexical: other one-word edits ("cat" / "car") still score high in long
+# questions, so keep the threshold high.
+#
+#   qcache:entry:{fp}        hash  question, results, characters, signature,
+#                                  source_poll_id, source_session (the poll it came from)
+#   qcache:lru               zset  fp -> last access time (for eviction)
+#   qcache:lsh:{band}:{hash} set   fps whose signature falls in that bucket
+#   qcache:stats             hash  hits / near_hits / misses / evictions
+
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "200"))                 # polls kept (LRU)
+QUESTION_CACHE_SIMILARITY = float(os.getenv("QUESTION_CACHE_SIMILARITY", "1.0"))  # 1.0 = exact matches only
+
+MINHASH_PERMUTATIONS = 32
+LSH_BANDS = 8                     # 8 bands x 4 rows
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(1337)
+_MINHASH_PARAMS = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+_PUNCTUATION_TABLE = str.maketrans({c: ' ' for c in string.punctuation})
+# After punctuation folding "don't" is "don t", so a lone "t" is a negation too
+NEGATION_WORDS = frozenset({
+    'no', 'not', 'never', 'nor', 'neither', 'none', 'nothing', 'nobody', 'nowhere', 'without', 'cannot', 't',
+    'dont', 'doesnt', 'didnt', 'isnt', 'arent', 'wasnt', 'werent', 'cant', 'couldnt', 'shouldnt', 'wouldnt',
+    'wont', 'havent', 'hasnt', 'hadnt', 'mustnt',
+})
+NUMBER_WORDS = frozenset({
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve',
+    'twenty', 'thirty', 'forty', 'fifty', 'hundred', 'thousand', 'million', 'billion', 'half', 'once', 'twice',
+})
+
+def normalize_question(question):
+    """Fold case, punctuation and whitespace: "Should I buy these shoes?" -> "should i buy these shoes"."""
+    return ' '.join(question.lower().translate(_PUNCTUATION_TABLE).split())
+
+def question_fingerprint(question):
+    """Stable ID for a question, equal for questions that normalize the same."""
+    return hashlib.sha1(normalize_question(question).encode('utf-8')).hexdigest()[:20]
+
+def question_shingles(normalized):
+    """Ordered word pairs of a normalized question, with start and end markers."""
+    words = ['^'] + normalized.split() + ['$']
+    return {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+def question_polarity(normalized):
+    """The negations and numbers in a normalized question, which a near match must share exactly."""
+    return sorted(
+        word for word in normalized.split()
+        if word in NEGATION_WORDS or word in NUMBER_WORDS or any(c.isdigit() for c in word)
+    )
+
+def shingle_similarity(normalized_a, normalized_b):
+    """Jaccard similarity of two normalized questions' shingles."""
+    a, b = question_shingles(normalized_a), question_shingles(normalized_b)
+    return len(a & b) / len(a | b)
 
-def get_conversation(conv_id):
+def question_minhash(normalized):
     """
-    Retrieve a conversation from Redis.
-    
+    MinHash signature of the question's shingles (see question_shingles).
+
     Args:
-        conv_id (str or int): Conversation ID
-    
+        normalized (str): Output of normalize_question()
+
     Returns:
-        dict: Conversation data with id, character_ids, conversation_log
+        list: MINHASH_PERMUTATIONS ints; the share of equal positions between
+        two signatures estimates the Jaccard similarity of the questions
     """
-    key = f"conversation:{conv_id}"
-    data = redis_client.hgetall(key)
-    
+    shingles = question_shingles(normalized)
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for shingle in shingles
+    ]
+    return [min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PARAMS]
+
+def _lsh_keys(signature):
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    keys = []
+    for band in range(LSH_BANDS):
+        chunk = ','.join(map(str, signature[band * rows:(band + 1) * rows]))
+        keys.append(f"qcache:lsh:{band}:{hashlib.sha1(chunk.encode()).hexdigest()[:16]}")
+    return keys
+
+def _load_cache_entry(fp):
+    data = redis_client.hgetall(f"qcache:entry:{fp}")
     if not data:
         return None
-    
     return {
-        'id': int(data['id']),
-        'character_ids': json.loads(data['character_ids']),
-        'conversation_log': data['conversation_log']
+        'question': data['question'],
+        'results': json.loads(data['results']),
+        'characters': {int(k): v for k, v in json.loads(data['characters']).items()},
+        'source_poll_id': data.get('source_poll_id') or None,
+        'source_session': data.get('source_session') or None,
     }
 
-def get_all_characters_data():
+def lookup_question_cache(question, total=None):
     """
-    Get all character data from Redis.
-    
+    Find a cached poll for this question or a near-duplicate of it.
+
+    Args:
+        question (str): The incoming question
+        total (int, optional): Only accept polls of this many characters
+
     Returns:
-        list of dicts with character data
+        tuple: (entry, kind) where entry is {'question', 'results', 'characters',
+        'source_poll_id', 'source_session'}
+        and kind is 'exact' or 'near', or (None, None) on a miss
     """
-    keys = redis_client.keys('character:*')
-    characters = []
-    
-    for key in keys:
-        data = redis_client.hgetall(key)
-        characters.append({
-            'id': int(data['id']),
-            'chat': data['chat'],
-            'answer': data['answer'].lower() == 'true',
-            'passion': float(data.get('passion', '0.0'))
-        })
-    
-    return sorted(characters, key=lambda x: x['id'])
+    fp = question_fingerprint(question)
+    entry = _load_cache_entry(fp)
+    kind = 'exact' if entry else None
 
-def clear_all_characters():
-    """Clear all character data from Redis cache."""
-    keys = redis_client.keys('character:*')
-    if keys:
-        redis_client.delete(*keys)
+    if entry is None and QUESTION_CACHE_SIMILARITY < 1.0:
+        normalized = normalize_question(question)
+        polarity = question_polarity(normalized)
+        pipe = redis_client.pipeline(transaction=False)
+        for key in _lsh_keys(question_minhash(normalized)):
+            pipe.smembers(key)
+        candidates = sorted(set().union(*pipe.execute()))
 
-def cleanAnswers():
+        if candidates:
+            pipe = redis_client.pipeline(transaction=False)
+            for candidate in candidates:
+                pipe.hget(f"qcache:entry:{candidate}", 'question')
+            # The LSH buckets only nominate candidates; score them exactly
+            best_fp, best_score = None, 0.0
+            for candidate, cached_question in zip(candidates, pipe.execute()):
+                if cached_question is None:
+                    continue
+                cached = normalize_question(cached_question)
+                if question_polarity(cached) != polarity:
+                    continue
+                score = shingle_similarity(normalized, cached)
+                if score > best_score:
+                    best_fp, best_score = candidate, score
+            if best_fp and best_score >= QUESTION_CACHE_SIMILARITY:
+                fp = best_fp
+                entry = _load_cache_entry(fp)
+                kind = 'near' if entry else None
 
-    for i in range(1, 1001):
+    if entry and total is not None and entry['results'].get('total') != total:
+        entry, kind = None, None
 
-        # ID should be padded on the left with 0s.
-        char_id = str(i)
-        while (len(char_id) < 4): char_id = "0" + char_id
+    pipe = redis_client.pipeline(transaction=False)
+    if entry:
+        pipe.zadd('qcache:lru', {fp: time.time()})
+        pipe.hincrby('qcache:stats', 'hits' if kind == 'exact' else 'near_hits', 1)
+    else:
+        pipe.hincrby('qcache:stats', 'misses', 1)
+    pipe.execute()
 
-        # Empty the answer and short-answer files
-        dir_path = f"char_x1000/character_{char_id}"
-        full_path = os.path.join(dir_path, "answer.txt")
-        short_path = os.path.join(dir_path, "short-answer.txt")
+    return entry, kind
 
-        # Empty the files
-        open(full_path, 'w').close()
-        open(short_path, 'w').close()
+def store_question_cache(question, results, characters, poll_id=None, session=None):
+    """
+    Cache a finished poll, evicting the least recently used entries over QUESTION_CACHE_SIZE.
 
-def query_gpt(prompt, model = "gpt-4o-mini"):
-    response = client.chat.completions.create(model=model,
-    messages=[
-        {"role": "system", "content": prompt}
-    ],
-    max_tokens=150,       # limit the response length
-    temperature=1.2       # randomness of output
-    )
+    Args:
+        question (str): The question that was asked
+        results (dict): Aggregate from PollTally.summary()
+        characters (dict): char_id -> {'response', 'answer', 'passion'}
+        poll_id (str, optional): The poll's ID in its session's history
+        session (str, optional): Session that ran the poll
+    """
+    fp = question_fingerprint(question)
+    signature = question_minhash(normalize_question(question))
+    # poll_id belongs to the session that ran the poll; a hit records a reference to it
+    results = {k: v for k, v in results.items() if k != 'poll_id'}
 
-    # Extract the assistant’s reply
-    message = response.choices[0].message.content
-    return message
+    pipe = redis_client.pipeline()
+    pipe.hset(f"qcache:entry:{fp}", mapping={
+        'question': question,
+        'results': json.dumps(results),
+        'characters': json.dumps(characters),
+        'signature': json.dumps(signature),
+        'source_poll_id': poll_id or '',
+        'source_session': session or '',
+    })
+    pipe.zadd('qcache:lru', {fp: time.time()})
+    for key in _lsh_keys(signature):
+        pipe.sadd(key, fp)
+    pipe.execute()
 
-class CharacterResponse(BaseModel):
-    class Config:
-        extra = "forbid"  # This sets additionalProperties to false
-    
-    name: str
-    persona: str
+    overflow = redis_client.zcard('qcache:lru') - QUESTION_CACHE_SIZE
+    if overflow > 0:
+        evicted = [member for member, _ in redis_client.zpopmin('qcache:lru', overflow)]
+        pipe = redis_client.pipeline(transaction=False)
+        for old_fp in evicted:
+            pipe.hget(f"qcache:entry:{old_fp}", 'signature')
+        signatures = pipe.execute()
 
-class CharacterQuestionResponse(BaseModel):
-    class Config:
-        extra = "forbid"  # This sets additionalProperties to false
-    
-    response: str  # The character's response text
-    answer: bool   # Yes/No answer
-    passion: float # Passion score from 0.0 to 1.0
-    
-def createNamePersona_x100():
-    # Path to the JSON file
-    json_path = Path(__file__).parent.parent / "frontend" / "public" / "characters" / "data" / "all-characters.json"
-    
-    # Load the JSON file once
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+        pipe = redis_client.pipeline(transaction=False)
+        for old_fp, raw in zip(evicted, signatures):
+            if raw is not None:
+                for key in _lsh_keys(json.loads(raw)):
+                    pipe.srem(key, old_fp)
+            pipe.delete(f"qcache:entry:{old_fp}")
+        pipe.hincrby('qcache:stats', 'evictions', len(evicted))
+        pipe.execute()
 
-    for char_id in range(1, 101):
-        # Format the character ID with leading zeros
-        char_id_str = str(char_id)
-        while len(char_id_str) < 4:
-            char_id_str = "0" + char_id_str
-        
-        char_key = f"character_{char_id_str}"
-        
-        # Get character description
-        description = data["characters"][char_key]["description"]
-        
-        # Create the prompt - make it more concise to fit in token limit
-        prompt = f"{description}\n\nCreate a brief character profile with a name and a 2-3 sentence persona based on the description above."
+def hydrate_from_question_cache(entry, session=None):
+    """
+    Write a cached poll's per-character results back into the session's character hashes.
 
-        # Retry logic for API calls
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Make API call
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": prompt}
-                    ],
-                    response_format={
-                        "type": "json_schema",
-                        "json_schema": {
-                            "name": "character_response",
-                            "strict": True,
-                            "schema": CharacterResponse.model_json_schema()
-                        }
-                    },
-                    max_tokens=800,
-                    temperature=0.8
-                )
-                
-                # Parse the response
-                result = json.loads(response.choices[0].message.content)
-                
-                # Update the character data with name and persona
-                data["characters"][char_key]["name"] = result["name"]
-                data["characters"][char_key]["persona"] = result["persona"]
-                
-                print(f"Updated {char_key}: {result['name']}")
-                break  # Success, exit retry loop
-                
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error for {char_key} (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt == max_retries - 1:
-                    print(f"Failed to update {char_key} after {max_retries} attempts. Skipping.")
-                    data["characters"][char_key]["name"] = "Unknown"
-                    data["characters"][char_key]["persona"] = "Character generation failed."
-            except Exception as e:
-                print(f"Unexpected error for {char_key}: {e}")
-                if attempt == max_retries - 1:
-                    data["characters"][char_key]["name"] = "Unknown"
-                    data["characters"][char_key]["persona"] = "Character generation failed."
-    
-    # Save the updated JSON file
-    print(f"Saving updated file to {json_path}...")
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    
-    print("Done!")
+    A poll this session ran itself already has its chat history entries, so
+    they are only added in other sessions.
+    """
+    question = None if entry.get('source_session') == session else entry['question']
+    buffer = WriteBehindBuffer(session)
+    for char_id, result in entry['characters'].items():
+        save_character_result(char_id, result, buffer, question)
+    buffer.flush()
 
-def considerQuestion(question, char_id):
-    # ID should be padded on the left with 0s.
-    char_id = str(char_id)
-    while (len(char_id) < 4): char_id = "0" + char_id
+def record_reused_poll(question, entry, total, session=None):
+    """Record a poll answered from `entry` (a cache entry or shared poll) as a reference to its source."""
+    return record_poll(question, entry['characters'], total, session=session, source=entry.get('source_poll_id'))
 
-    # Extract character persona and name.
-    char_info = get_character_info(char_id)
+def get_question_cache_stats():
+    """Return the question cache counters and current size."""
+    stats = redis_client.hgetall('qcache:stats')
+    return {
+        'hits': int(stats.get('hits', 0)),
+        'near_hits': int(stats.get('near_hits', 0)),
+        'misses': int(stats.get('misses', 0)),
+        'evictions': int(stats.get('evictions', 0)),
+        'size': redis_client.zcard('qcache:lru'),
+    }
 
-    with (
-        open('prompts/introduction.txt', 'r') as intro_f,
-        open('prompts/pre.txt', 'r') as pre_f,
-        open('prompts/post.txt', 'r') as post_f,
-    ):
-        introduction_prompt = intro_f.read()
-        pre_prompt = pre_f.read()
-        post_prompt = post_f.read()
-
-    response_1 = query_gpt(char_info['persona'] + introduction_prompt)
-    prompt_2 = char_info['persona'] + introduction_prompt + response_1 + pre_prompt + question + post_prompt
-    
-    # Use structured output for the response
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": prompt_2}
-        ],
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "character_question_response",
-                "strict": True,
-                "schema": CharacterQuestionResponse.model_json_schema()
-            }
-        },
-        max_tokens=800,
-        temperature=0.8
-    )
-    
-    # Parse and return the structured response
-    return json.loads(response.choices[0].message.content)
+# ============================================
+# SINGLE-FLIGHT POLLS
+# ============================================
+# When a question trends, several clients ask it within seconds of each
+# other. Only the first (the leader) runs the poll; duplicates that arrive
+# while it is running (followers) wait for its result instead of launching
+# their own LLM calls. This works across processes:
+#   sf:lock:{key}     string   leader's token, SET NX with a TTL
+#   sf:result:{key}   string   the leader's result, briefly, for followers
+#                              that subscribe just after it was published
+#   sf:done:{key}     channel  the leader publishes its result here
+#   sf:stats          hash     leader / coalesced / timeout / fallback counts
 
-def getAnswer(prompt):
-    short = prompt[-60:]
-    if "yes" in short or "Yes" in short:
-        return True
-    else:
-        return False
-    
-def writeOut(answer, char_id):
-    # ID should be padded on the left with 0s.
-    char_id = str(char_id)
-    while (len(char_id) < 4): char_id = "0" + char_id
+# Everything a request does, including a follower's wait and any poll it ends
+# up running itself, must fit in the serverless function's maxDuration (60 s
+# in vercel.json), with some time left over to write the response. The
+# leader stores when its own poll deadline ends next to its lock token, and
+# followers wait until then (plus a grace period for storing and publishing
+# the result). A follower that then has to poll itself only gets the time its
+# request has left, and gives up with SingleFlightTimeout if that is too little.
+FUNCTION_MAX_DURATION = float(os.getenv("FUNCTION_MAX_DURATION", "60"))
+REQUEST_BUDGET = 0.9 * FUNCTION_MAX_DURATION   # seconds a request may spend before responding
+SINGLE_FLIGHT_WAIT = float(os.getenv("SINGLE_FLIGHT_WAIT", REQUEST_BUDGET))   # most seconds a follower waits
+SINGLE_FLIGHT_GRACE = 2.0   # seconds past the leader's deadline for its result to arrive
+SINGLE_FLIGHT_MIN_BUDGET = float(os.getenv("SINGLE_FLIGHT_MIN_BUDGET", "5"))   # least time worth polling with
+SINGLE_FLIGHT_LOCK_TTL = int(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "150"))   # lock expiry if a leader dies
+SINGLE_FLIGHT_RESULT_TTL = 30
+SINGLE_FLIGHT_ROLES = ('leader', 'coalesced', 'timeout', 'fallback')
+
+
+class SingleFlightTimeout(Exception):
+    """A follower got no result in time and has too little time left to compute it itself."""
+
+
+# Delete the lock only if we still hold it
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
 
-    # Build the directory path
-    dir_path = f"char_x1000/character_{char_id}"
-    os.makedirs(dir_path, exist_ok=True)
+def _record_single_flight(role):
+    metrics.inc('singleflight_requests_total', role=role)
+    try:
+        redis_client.hincrby('sf:stats', role, 1)
+    except redis.RedisError as e:
+        print(f"Could not record single-flight stats: {e}")
+
+def _flight_lock_value(deadline):
+    """Lock value: a fresh token and the wall-clock time the leader's deadline ends (0: none)."""
+    ends_at = time.time() + deadline if deadline else 0
+    return f"{uuid.uuid4().hex}:{ends_at:.3f}"
+
+def _flight_leader_remaining(lock):
+    """Seconds until the lock holder's deadline ends, or None if it didn't set one (or is gone)."""
+    if lock is None:
+        return None
+    ends_at = float(lock.rsplit(':', 1)[1])
+    return max(0.0, ends_at - time.time()) if ends_at else None
+
+def _lead_flight(key, lock, compute, budget=None):
+    """Run compute(budget) as the leader, publish the outcome and release the lock."""
+    try:
+        value = compute(budget)
+        message = json.dumps({'ok': True, 'value': value})
+    except Exception as e:
+        message = json.dumps({'ok': False, 'error': str(e)})
+        raise
+    finally:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(f"sf:result:{key}", message, ex=SINGLE_FLIGHT_RESULT_TTL)
+        pipe.publish(f"sf:done:{key}", message)
+        redis_script(_RELEASE_LOCK_LUA)(keys=[f"sf:lock:{key}"], args=[lock], client=pipe)
+        pipe.execute()
+    return value
+
+def single_flight(key, compute, deadline=None, wait_timeout=None, budget=None):
+    """
+    Run compute() once for all concurrent callers with the same key.
+
+    The first caller takes a Redis lock and computes; callers that arrive
+    while it holds the lock wait for its published result, up to the end of
+    the leader's deadline. A follower whose leader fails or doesn't answer in
+    time computes the value itself within what is left of its budget.
+
+    Args:
+        key (str): Identifies identical work (e.g. a question fingerprint)
+        compute (callable): Called as compute(budget) and returns a
+            JSON-serializable value; budget is None for the first leader and
+            otherwise the seconds the caller has left
+        deadline (float, optional): Seconds the leader's compute() may take
+            (None: no deadline); followers wait that long plus SINGLE_FLIGHT_GRACE
+        wait_timeout (float, optional): Most seconds a follower waits (defaults to SINGLE_FLIGHT_WAIT)
+        budget (float, optional): Seconds the whole call may take (defaults to REQUEST_BUDGET)
+
+    Returns:
+        tuple: (value, role) - role is 'leader', 'coalesced', 'timeout' or 'fallback'
+
+    Raises:
+        SingleFlightTimeout: If a follower would have to compute with less
+            than SINGLE_FLIGHT_MIN_BUDGET seconds left
+    """
+    started = time.monotonic()
+    budget = REQUEST_BUDGET if budget is None else budget
+    wait_timeout = SINGLE_FLIGHT_WAIT if wait_timeout is None else wait_timeout
+    lock_key = f"sf:lock:{key}"
 
-    # Paths for the full and short answer files
-    full_path = os.path.join(dir_path, "answer.txt")
-    short_path = os.path.join(dir_path, "short-answer.txt")
+    def budget_left(reason):
+        remaining = budget - (time.monotonic() - started)
+        if remaining < SINGLE_FLIGHT_MIN_BUDGET:
+            raise SingleFlightTimeout(f"{reason} and only {max(0.0, remaining):.1f}s are left to poll")
+        return remaining
 
-    # Write full answer
-    # with open(full_path, "w", encoding="utf-8") as f:
-    #     f.write(answer)
+    lock = _flight_lock_value(deadline)
+    if redis_client.set(lock_key, lock, nx=True, ex=SINGLE_FLIGHT_LOCK_TTL):
+        _record_single_flight('leader')
+        return _lead_flight(key, lock, compute), 'leader'
+
+    # Subscribe before checking for a result, so a result published in
+    # between is seen either on the channel or in sf:result
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(f"sf:done:{key}")
+        raw = redis_client.get(f"sf:result:{key}")
+        wait_until = started + min(wait_timeout, budget)
+        leader_remaining = _flight_leader_remaining(redis_client.get(lock_key))
+        if leader_remaining is not None:
+            wait_until = min(wait_until, time.monotonic() + leader_remaining + SINGLE_FLIGHT_GRACE)
+        while raw is None:
+            remaining = wait_until - time.monotonic()
+            if remaining <= 0:
+                break
+            message = pubsub.get_message(timeout=min(remaining, 1.0))
+            if message and message['type'] == 'message':
+                raw = message['data']
+            elif not redis_client.exists(lock_key):
+                # The leader is gone without publishing (lock expired): take over
+                raw = redis_client.get(f"sf:result:{key}")
+                if raw is None:
+                    left = budget_left("The poll's leader went away")
+                    lock = _flight_lock_value(left)
+                    if redis_client.set(lock_key, lock, nx=True, ex=SINGLE_FLIGHT_LOCK_TTL):
+                        _record_single_flight('leader')
+                        return _lead_flight(key, lock, compute, left), 'leader'
+    finally:
+        pubsub.close()
+
+    if raw is None:
+        waited = time.monotonic() - started
+        print(f"Single-flight wait for {key} timed out after {waited:.1f}s; computing")
+        _record_single_flight('timeout')
+        return compute(budget_left(f"An identical poll didn't finish within {waited:.1f}s")), 'timeout'
+
+    outcome = json.loads(raw)
+    if not outcome['ok']:
+        print(f"Single-flight leader for {key} failed ({outcome['error']}); computing")
+        _record_single_flight('fallback')
+        return compute(budget_left("An identical poll failed")), 'fallback'
+
+    _record_single_flight('coalesced')
+    return outcome['value'], 'coalesced'
+
+def get_single_flight_stats():
+    """Return how many requests led, were coalesced, timed out or fell back."""
+    stats = redis_client.hgetall('sf:stats')
+    return {role: int(stats.get(role, 0)) for role in SINGLE_FLIGHT_ROLES}
+
+# ============================================
+# POLL JOBS
+# ============================================
+# A poll that doesn't fit in one HTTP request (e.g. all 1000 characters on
+# Vercel's 60s limit) runs as a job. Every finished character is
+# checkpointed, so a job that is interrupted resumes where it left off.
+#
+#   job:{id}          hash    question, session, status, total, char_ids, errors, timestamps
+#   job:{id}:results  hash    char_id -> JSON result of each finished character
+#   job:{id}:lease    string  token of the worker currently running the job
+#   jobs:queue        list    job IDs waiting for a worker
+
+JOB_TTL = int(os.getenv("JOB_TTL", "86400"))                       # seconds a job is kept
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))     # worker lease, renewed on each checkpoint
+JOB_TIME_BUDGET = float(os.getenv("JOB_TIME_BUDGET", "50"))        # seconds per /run call (under maxDuration)
+
+def create_poll_job(question, char_ids, session=None, verdict_only=False):
+    """
+    Create a poll job and put it on the queue.
+
+    Args:
+        question (str): The question to ask
+        char_ids (list): Character IDs to poll
+        session (str, optional): Session namespace the results are written to
+        verdict_only (bool): Only ask for answers and passions, see run_poll
+
+    Returns:
+        str: The job ID
+    """
+    job_id = uuid.uuid4().hex[:16]
+    now = time.time()
+    key = f"job:{job_id}"
 
-    # Generate and write short answer
-    short_answer = getAnswer(answer)
-    if short_answer: short_answer = "Yes"
-    else: short_answer = "No"
-    print(short_answer)
-    with open(short_path, "w", encoding="utf-8") as f:
-        f.write(short_answer)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={
+        'id': job_id,
+        'question': question,
+        'session': session or '',
+        'status': 'queued',
+        'total': len(char_ids),
+        'char_ids': json.dumps(list(char_ids)),
+        'verdict_only': int(verdict_only),
+        'errors': 0,
+        'created': now,
+        'updated': now
+    })
+    pipe.expire(key, JOB_TTL)
+    pipe.lpush('jobs:queue', job_id)
+    pipe.execute()
+    return job_id
 
-def process_character(char_id, question):
-    """
-    Process a single character's response to a question.
-    Now returns structured response with response text, answer, and passion.
-    Updates Redis cache with the conversation, answer, and passion.
+def get_poll_job(job_id):
     """
-    result = considerQuestion(question, char_id)
-    
-    # Extract structured data
-    response_text = result['response']
-    answer_bool = result['answer']
-    passion_score = result['passion']
-    
-    # Update Redis cache with the character's response, answer, and passion
-    update_character_chat(char_id, response_text)
-    update_character_answer(char_id, answer_bool)
-    update_character_passion(char_id, passion_score)
-    
-    return {
-        'response': response_text,
-        'answer': answer_bool,
-        'passion': passion_score
-    }
+    Get a job's status, progress and the aggregate of the characters finished so far.
 
-def character_conversation_response(char_id, conversation_so_far):
-    """
-    Get a character's response to the ongoing conversation.
-    
-    Args:
-        char_id (int): Character ID
-        conversation_so_far (str): The conversation that has happened so far
-    
     Returns:
-        str: The character's response to add to the conversation
+        dict, or None if the job doesn't exist (or has expired)
     """
-    char_info = get_character_info(char_id)
-    question = get_global_question()
-    
-    prompt = f"""{char_info['persona']}
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(f"job:{job_id}")
+    pipe.hvals(f"job:{job_id}:results")
+    job, raw_results = pipe.execute()
+    if not job:
+        return None
 
-The question being discussed is: {question}
+    count_yes = 0
+    total_passion = 0.0
+    for raw in raw_results:
+        result = json.loads(raw)
+        count_yes += 1 if result['answer'] else 0
+        total_passion += result['passion']
+    completed = len(raw_results)
+    total = int(job['total'])
 
-Conversation so far:
-{conversation_so_far}
+    return {
+        'job_id': job_id,
+        'question': job['question'],
+        'session_id': job.get('session') or None,
+        'status': job['status'],
+        'verdict_only': job.get('verdict_only') == '1',
+        'progress': {
+            'completed': completed,
+            'total': total,
+            'errors': int(job.get('errors', 0))
+        },
+        'results': {
+            'yes_count': count_yes,
+            'no_count': completed - count_yes,
+            'completed': completed,
+            'total': total,
+            'average_passion': total_passion / completed if completed else 0.0
+        },
+        'created': float(job['created']),
+        'updated': float(job['updated'])
+    }
 
-As {char_info['name']}, respond to this conversation with your thoughts. Keep your response conversational and under 100 words."""
-    
-    response = query_gpt(prompt)
-    return response
+def _checkpointed_character(job_id, verdict_only=False):
+    """Build a poll task that records each finished character in the job's results hash."""
+    def task(char_id, question, char_info, timeout, buffer, session):
+        result = process_character(char_id, question, char_info, timeout, buffer, session, verdict_only)
+        pipe = redis_client.pipeline()
+        pipe.hset(f"job:{job_id}:results", char_id, json.dumps(result))
+        pipe.expire(f"job:{job_id}:results", JOB_TTL)
+        pipe.expire(f"job:{job_id}:lease", JOB_LEASE_SECONDS)
+        pipe.execute()
+        return result
+    return task
 
-def check_mind_changed(char_id, conversation_log):
+def run_poll_job(job_id, time_budget=None):
     """
-    Ask a character if their mind has changed after the conversation.
-    
+    Run (or resume) a job until it is done or the time budget runs out.
+
+    Characters that were already checkpointed are skipped; characters that
+    failed are retried on the next run. Only one worker runs a job at a time.
+
     Args:
-        char_id (int): Character ID
-        conversation_log (str): The full conversation
-    
+        job_id (str): The job ID
+        time_budget (float, optional): Stop picking up new characters after
+            this many seconds, and stop waiting for the ones in flight (None =
+            run to completion); they are picked up again on the next run
+
     Returns:
-        dict: {'answer': bool, 'passion': float}
+        dict: get_poll_job() after this run, or None if the job doesn't exist
     """
-    char_info = get_character_info(char_id)
-    question = get_global_question()
-    
-    prompt = f"""{char_info['persona']}
+    key = f"job:{job_id}"
+    job = redis_client.hgetall(key)
+    if not job:
+        return None
+    if job['status'] == 'complete':
+        return get_poll_job(job_id)
 
-Original question: {question}
+    token = uuid.uuid4().hex
+    if not redis_client.set(f"job:{job_id}:lease", token, nx=True, ex=JOB_LEASE_SECONDS):
+        # Another worker holds the lease; report its progress instead
+        return get_poll_job(job_id)
 
-After this conversation:
-{conversation_log}
+    try:
+        # Claimed: a job run by a local thread or /api/jobs/<id>/run mustn't
+        # stay queued for a standalone worker (which already popped it)
+        redis_client.lrem('jobs:queue', 0, job_id)
+        done = {int(char_id) for char_id in redis_client.hkeys(f"job:{job_id}:results")}
+        pending = [char_id for char_id in json.loads(job['char_ids']) if char_id not in done]
+        redis_client.hset(key, mapping={'status': 'running', 'updated': time.time()})
 
-Has your answer changed? Respond with your final position on the question."""
-    
-    # Use structured output for the response
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": prompt}
-        ],
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "character_question_response",
-                "strict": True,
-                "schema": CharacterQuestionResponse.model_json_schema()
+        started = time.monotonic()
+        errors = 0
+        char_infos = character_registry.get_many(pending)
+        for char_id, result, exc in iter_thread_poll(
+            job['question'], pending, char_infos, POLL_CONCURRENCY, LLM_TIMEOUT,
+            task=_checkpointed_character(job_id, job.get('verdict_only') == '1'), session=job.get('session') or None,
+            deadline=time_budget
+        ):
+            if isinstance(exc, PollDeadlineExceeded):
+                continue
+            if exc is not None:
+                errors += 1
+                print(f"Job {job_id}: character {char_id} generated an exception: {exc}")
+            if time_budget is not None and time.monotonic() - started > time_budget:
+                print(f"Job {job_id}: time budget of {time_budget}s used, pausing")
+                break
+
+        remaining = int(job['total']) - redis_client.hlen(f"job:{job_id}:results")
+        redis_client.hset(key, mapping={
+            'status': 'complete' if remaining == 0 else 'paused',
+            'errors': errors,
+            'updated': time.time()
+        })
+        if remaining == 0:
+            results = {
+                char_id: json.loads(raw) for char_id, raw in redis_client.hgetall(f"job:{job_id}:results").items()
             }
-        },
-        max_tokens=800,
-        temperature=0.8
-    )
-    
-    result = json.loads(response.choices[0].message.content)
-    return {
-        'answer': result['answer'],
-        'passion': result['passion']
-    }
+            record_poll(job['question'], results, int(job['total']), session=job.get('session') or None)
+    except Exception:
+        redis_client.hset(key, mapping={'status': 'failed', 'updated': time.time()})
+        raise
+    finally:
+        if redis_client.get(f"job:{job_id}:lease") == token:
+            redis_client.delete(f"job:{job_id}:lease")
 
-def promptCharacters(question, num):
-    count_yes = 0
-    count_no  = 0
-    total_passion = 0.0
+    return get_poll_job(job_id)
 
-    # Use ThreadPoolExecutor to parallelize API calls
-    # max_workers can be adjusted based on API rate limits
-    with ThreadPoolExecutor(max_workers=500) as executor:
-        # Submit all tasks
-        future_to_char = {
-            executor.submit(process_character, i, question): i 
-            for i in range(1, num+1)
-        }
-        
-        # Process results as they complete
-        for future in as_completed(future_to_char):
-            char_id = future_to_char[future]
-            try:
-                result = future.result()
-                answer = result['answer']
-                passion = result['passion']
-                
-                if answer:
-                    count_yes += 1
-                else:
-                    count_no += 1
-                
-                total_passion += passion
-                print(f"Character {char_id} completed: {'Yes' if answer else 'No'} (passion: {passion:.2f})")
-            except Exception as exc:
-                print(f"Character {char_id} generated an exception: {exc}")
-                count_no += 1  # Count errors as "No" votes
-    
-    # Return results as a dictionary
-    return {
-        'yes_count': count_yes,
-        'no_count': count_no,
-        'total': num,
-        'average_passion': total_passion / num if num > 0 else 0.0
-    }
+def start_poll_job_thread(job_id):
+    """Run a job on a background thread of this process (for long-running servers)."""
+    thread = threading.Thread(target=run_poll_job, args=(job_id,), daemon=True)
+    thread.start()
+    return thread
+
+def poll_job_worker(idle_timeout=5):
+    """
+    Standalone worker loop: take job IDs off jobs:queue and run them.
+
+    Args:
+        idle_timeout (int): Seconds to block waiting for a job before polling again
+    """
+    print("Poll job worker started")
+    while True:
+        item = redis_client.brpop('jobs:queue', timeout=idle_timeout)
+        if item:
+            _, job_id = item
+            print(f"Running job {job_id}")
+            run_poll_job(job_id)
 
 # ============================================
 # SERVER CODE - Flask API
 # ============================================
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 
 # Create a Flask app (this is your web server)
 app = Flask(__name__)
 CORS(app)  # Allow requests from your frontend (important for web apps)
 
+
+# Request metrics. The request is recorded when the response is closed, i.e.
+# after a streamed body has been sent, so streaming endpoints are timed end to
+# end; teardown_request covers requests that never produced a response.
+def _endpoint_label():
+    # The route pattern, not the path, so IDs don't each become a series
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def _record_request_metrics(endpoint, method, status, started):
+    metrics.inc('http_requests_in_flight', -1, endpoint=endpoint)
+    metrics.inc('http_requests_total', endpoint=endpoint, method=method, status=str(status))
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+    if status >= 500:
+        metrics.inc('http_request_errors_total', endpoint=endpoint)
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    metrics.inc('http_requests_in_flight', endpoint=_endpoint_label())
+
+@app.after_request
+def _finish_request_metrics_on_close(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint, method, status = _endpoint_label(), request.method, response.status_code
+        response.call_on_close(lambda: _record_request_metrics(endpoint, method, status, started))
+    return response
+
+@app.teardown_request
+def _finish_request_metrics(exc):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        _record_request_metrics(_endpoint_label(), request.method, 500, started)
+
+
+# Large JSON responses (the character list, polls that embed it) are gzipped
+# when the client accepts it. Streamed responses are left alone so their
+# events still arrive one by one.
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))   # bytes; 0 disables compression
+GZIP_LEVEL = 6
+
+@app.after_request
+def _gzip_response(response):
+    if (not GZIP_MIN_SIZE or response.is_streamed or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# Conditional GETs: responses built from a session's character state carry a
+# weak ETag made of its state version (see get_state_version) and a digest of
+# the query, so an unchanged page is answered with 304 before it is read.
+def _state_etag(version, session):
+    digest = hashlib.sha1(f"{session}|{request.path}|{request.query_string.decode()}".encode()).hexdigest()[:12]
+    return f"{version}-{digest}"
+
+def _not_modified(etag):
+    """A 304 response if the client already has `etag`, else None."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+def _with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'   # may be stored, but revalidate every time
+    return response
+
+
+# Sessions: a client that wants its own poll state sends a session ID as
+# "session_id" in the JSON body, an X-Session-Id header or a ?session_id=
+# query parameter. Without one, the shared default keyspace is used.
+@app.before_request
+def _resolve_session():
+    body = request.get_json(silent=True) if request.is_json else None
+    session = (
+        (body.get('session_id') if isinstance(body, dict) else None)
+        or request.headers.get('X-Session-Id')
+        or request.args.get('session_id')
+    )
+    try:
+        g.session = validate_session_id(session)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+# Start a new session
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    return jsonify({'success': True, 'session_id': new_session_id(), 'ttl': SESSION_TTL}), 201
+
+
+def _valid_deadline(deadline):
+    """A request's optional "deadline": None or a non-negative number of seconds."""
+    if deadline is None:
+        return True
+    return isinstance(deadline, (int, float)) and not isinstance(deadline, bool) and deadline >= 0
+
+def _valid_prompt_batch(prompt_batch):
+    """A request's optional "prompt_batch": None or 1..MAX_PROMPT_BATCH characters per LLM call."""
+    if prompt_batch is None:
+        return True
+    return isinstance(prompt_batch, int) and not isinstance(prompt_batch, bool) and 1 <= prompt_batch <= MAX_PROMPT_BATCH
+
+PROMPT_BATCH_ERROR = f'prompt_batch must be an integer between 1 and {MAX_PROMPT_BATCH}'
+VERDICT_ONLY_ERROR = 'verdict_only must be true or false'
+
 # Route 1: Handle "question" requests
 # This endpoint receives a question and asks multiple characters
 @app.route('/api/question', methods=['POST'])
@@ -568,42 +4588,297 @@ def handle_question():
     """
     Expects JSON like:
     {
-        "question": "Should I buy these shoes?"
+        "question": "Should I buy these shoes?",
+        "bypass_cache": false,  # optional, true forces a fresh poll
+        "async": false,         # optional, true queues a poll job and returns its ID
+        "num": 100,             # optional, number of characters to poll
+        "mode": "sample",       # optional, estimate from a sample of all characters:
+        "precision": 0.05,      #   stop when the intervals are this narrow
+        "confidence": 0.95,     #   confidence level of the intervals
+        "max_queries": 300,     #   most characters to query
+        "stratify_by": "leg_type", # attribute to stratify on
+        "deadline": 50,         # optional, seconds the poll may take (0: no deadline)
+        "prompt_batch": 5,      # optional, characters asked per LLM call (default POLL_PROMPT_BATCH)
+        "verdict_only": false,  # optional, true asks for answers and passions only; a character's
+                                #   reply is written when POST /api/characters/<id>/response asks for it
+        "fields": ["answer", "passion"], # optional, character fields to return (default all)
+        "session_id": "abc123"  # optional, poll in this session's own keyspace
     }
+
+    Characters without an answer by the deadline are listed in
+    results.timed_out and failed ones in results.errors; results.partial
+    is true when either is non-empty.
     """
     try:
         # Get the data sent from the frontend
         data = request.json
         question = data.get('question')
+        session = g.session
 
         # Validate input
         if not question:
             return jsonify({'error': 'Question is required'}), 400
+
+        num = data.get('num', 100)
+        if not isinstance(num, int) or isinstance(num, bool) or not 1 <= num <= len(character_registry.ids()):
+            return jsonify({'error': 'num must be between 1 and the number of characters'}), 400
+
+        deadline = data.get('deadline')
+        if not _valid_deadline(deadline):
+            return jsonify({'error': 'deadline must be a non-negative number of seconds'}), 400
+
+        prompt_batch = data.get('prompt_batch')
+        if not _valid_prompt_batch(prompt_batch):
+            return jsonify({'error': PROMPT_BATCH_ERROR}), 400
+        verdict_only = data.get('verdict_only', False)
+        if not isinstance(verdict_only, bool):
+            return jsonify({'error': VERDICT_ONLY_ERROR}), 400
+
+        try:
+            fields = parse_character_fields(data.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        sample = data.get('mode') == 'sample'
+        if sample:
+            try:
+                precision = float(data.get('precision', 0.05))
+                confidence = float(data.get('confidence', 0.95))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'precision and confidence must be numbers between 0 and 1'}), 400
+            if not 0 < precision < 1 or not 0 < confidence < 1:
+                return jsonify({'error': 'precision and confidence must be between 0 and 1'}), 400
+            for name in ('max_queries', 'batch_size'):
+                value = data.get(name)
+                if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+                    return jsonify({'error': f'{name} must be a positive integer'}), 400
+
+        # Store the session's question in Redis (only once the request is valid:
+        # this also resets the session's poll aggregates)
+        set_global_question(question, session)
+
+        # Long polls run as a job: return its ID now, progress is at /api/jobs/<id>
+        if data.get('async'):
+            job_id = create_poll_job(question, list(range(1, num + 1)), session, verdict_only)
+            # Serverless instances freeze after responding, so there the job is
+            # driven by POST /api/jobs/<id>/run (or a separate poll_job_worker)
+            if not os.getenv("VERCEL"):
+                start_poll_job_thread(job_id)
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': f"/api/jobs/{job_id}",
+                'job': get_poll_job(job_id)
+            }), 202
         
-        # Store the global question in Redis
-        set_global_question(question)
-        
-        # Call your existing function to get responses from characters (100 characters)
-        results = promptCharacters(question, 100)
-        
-        # Update cache with results - the promptCharacters function
-        # should now also update the cache (see modified process_character)
+        # Sampled poll over the whole population with early stopping
+        if sample:
+            results, sampled = sampled_poll(
+                question,
+                precision=precision,
+                confidence=confidence,
+                max_queries=data.get('max_queries'),
+                stratify_by=data.get('stratify_by'),
+                batch_size=data.get('batch_size'),
+                seed=data.get('seed'),
+                engine=data.get('engine'),
+                session=session,
+                deadline=deadline,
+                prompt_batch=prompt_batch,
+                verdict_only=verdict_only
+            )
+            return jsonify({
+                'success': True,
+                'question': question,
+                'results': results,
+                'session_id': session,
+                'characters': get_characters_data(sorted(sampled), session, fields)
+            }), 200
+
+        # Serve repeated (or near-duplicate) questions from the poll cache
+        cache_entry, cache_kind = (None, None)
+        flight_role = None
+        if not data.get('bypass_cache'):
+            cache_entry, cache_kind = lookup_question_cache(question, total=num)
+
+        if cache_entry:
+            hydrate_from_question_cache(cache_entry, session)
+            results = dict(cache_entry['results'])
+            results['poll_id'] = record_reused_poll(question, cache_entry, num, session)
+        else:
+            _, poll_deadline = _poll_limits(None, deadline)
+
+            def poll(budget=None):
+                # Call your existing function to get responses from characters (100 by default).
+                # "engine" ('async' or 'thread') is optional, e.g. for benchmarking the two.
+                # A follower polling on its own only has what is left of its request's budget.
+                run_deadline = poll_deadline or 0
+                if budget is not None:
+                    run_deadline = min(poll_deadline or budget, budget)
+                tally = run_poll(
+                    question, list(range(1, num + 1)), engine=data.get('engine'), session=session,
+                    deadline=run_deadline, prompt_batch=prompt_batch, verdict_only=verdict_only
+                )
+                results = tally.summary()
+                poll_id = results.pop('poll_id')
+
+                # Only complete polls with every reply are worth replaying
+                if not tally.partial and not verdict_only:
+                    store_question_cache(question, results, tally.results, poll_id, session)
+                return {'results': results, 'characters': tally.results, 'source_poll_id': poll_id,
+                        'source_session': session}
+
+            # Identical questions already being polled elsewhere share that poll
+            flight_key = f"{question_fingerprint(question)}:{num}" + (':verdict' if verdict_only else '')
+            flight, flight_role = single_flight(flight_key, poll, poll_deadline)
+            results = dict(flight['results'])
+            if flight_role == 'coalesced' and flight['source_session'] != session:
+                flight['characters'] = {int(k): v for k, v in flight['characters'].items()}
+                hydrate_from_question_cache(dict(flight, question=question), session)
+                results['poll_id'] = record_reused_poll(question, flight, num, session)
+            else:
+                # Our own poll, or one this session's leader has already stored and recorded
+                results['poll_id'] = flight['source_poll_id']
         
         # Get all cached character data
-        cached_data = get_all_characters_data()
+        version = get_state_version(session)
+        cached_data = get_all_characters_data(session, fields)
         
         # Send back the results as JSON
         return jsonify({
             'success': True,
-            'question': get_global_question(),
+            'question': get_global_question(session),
+            'session_id': session,
+            'version': version,
             'results': results,
+            'cache': {
+                'hit': cache_entry is not None,
+                'kind': cache_kind,
+                'matched_question': cache_entry['question'] if cache_entry else None,
+                'single_flight': flight_role
+            },
             'characters': cached_data  # Include all character data from cache
         }), 200
         
+    except SingleFlightTimeout as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def _format_stream_event(event, payload, sse):
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({'event': event, **payload}) + "\n"
+
+# Route 1b: Stream "question" results as each character finishes
+@app.route('/api/question/stream', methods=['POST'])
+def handle_question_stream():
+    """
+    Same input as /api/question (without "mode" and "async"), but streams one
+    event per character as soon as its answer is in, followed by a final summary. Events are NDJSON lines
+    by default, or Server-Sent Events with "format": "sse" (or an
+    "Accept: text/event-stream" header):
+
+        {"event": "start", "question": ..., "total": 100}
+        {"event": "character", "id": 7, "response": ..., "answer": true,
+         "passion": 0.4, "tally": {"yes_count", "no_count", "completed", ...}}
+        {"event": "character", "id": 9, "timed_out": true, "tally": {...}}
+        {"event": "summary", "results": {...}, "cache": {...}}
+
+    The poll stops at "deadline" seconds (default POLL_DEADLINE); characters
+    still outstanding then get a timed_out event. With "prompt_batch" above 1
+    characters are asked in groups, so their events arrive a group at a time.
+    With "verdict_only" the events carry an empty "response".
+    """
+    data = request.json or {}
+    question = data.get('question')
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+
+    if data.get('async') or data.get('mode'):
+        return jsonify({'error': '"async" and "mode" are not supported when streaming; use /api/question'}), 400
+
+    num = data.get('num', 100)
+    if not isinstance(num, int) or isinstance(num, bool) or not 1 <= num <= len(character_registry.ids()):
+        return jsonify({'error': 'num must be between 1 and the number of characters'}), 400
+
+    sse = data.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    bypass_cache = bool(data.get('bypass_cache'))
+    char_ids = list(range(1, num + 1))
+    session = g.session
+
+    deadline = data.get('deadline')
+    if not _valid_deadline(deadline):
+        return jsonify({'error': 'deadline must be a non-negative number of seconds'}), 400
+    timeout, deadline = _poll_limits(None, deadline)
+
+    prompt_batch = data.get('prompt_batch')
+    if not _valid_prompt_batch(prompt_batch):
+        return jsonify({'error': PROMPT_BATCH_ERROR}), 400
+    prompt_batch = prompt_batch or POLL_PROMPT_BATCH
+    verdict_only = data.get('verdict_only', False)
+    if not isinstance(verdict_only, bool):
+        return jsonify({'error': VERDICT_ONLY_ERROR}), 400
+
+    def generate():
+        set_global_question(question, session)
+        tally = PollTally(len(char_ids))
+        yield _format_stream_event('start', {'question': question, 'session_id': session, 'total': tally.total}, sse)
+
+        cache_entry, cache_kind = (None, None)
+        if not bypass_cache:
+            cache_entry, cache_kind = lookup_question_cache(question, total=len(char_ids))
+
+        if cache_entry:
+            hydrate_from_question_cache(cache_entry, session)
+            for char_id, result in sorted(cache_entry['characters'].items()):
+                tally.add(char_id, result)
+                yield _format_stream_event('character', {'id': char_id, **result, 'tally': tally.running()}, sse)
+            results = dict(cache_entry['results'])
+            results['poll_id'] = record_reused_poll(question, cache_entry, tally.total, session)
+        else:
+            buffer = WriteBehindBuffer(session) if POLL_WRITE_BEHIND else None
+            char_infos = character_registry.get_many(char_ids)
+            try:
+                for char_id, result, exc in iter_thread_poll(
+                    question, char_ids, char_infos, POLL_CONCURRENCY, timeout, buffer, session=session,
+                    deadline=deadline, prompt_batch=prompt_batch, verdict_only=verdict_only
+                ):
+                    if exc is None:
+                        tally.add(char_id, result)
+                        yield _format_stream_event('character', {'id': char_id, **result, 'tally': tally.running()}, sse)
+                    elif isinstance(exc, PollDeadlineExceeded):
+                        tally.add_timeout(char_id)
+                        yield _format_stream_event('character', {'id': char_id, 'timed_out': True, 'tally': tally.running()}, sse)
+                    else:
+                        tally.add_error(char_id, exc)
+                        yield _format_stream_event('character', {'id': char_id, 'error': str(exc), 'tally': tally.running()}, sse)
+            finally:
+                if buffer is not None:
+                    buffer.flush()
+            tally.poll_id = record_poll(question, tally.results, tally.total, session=session)
+            results = tally.summary()
+            if not tally.partial and not verdict_only:
+                store_question_cache(question, results, tally.results, tally.poll_id, session)
+
+        yield _format_stream_event('summary', {
+            'question': question,
+            'results': results,
+            'cache': {
+                'hit': cache_entry is not None,
+                'kind': cache_kind,
+                'matched_question': cache_entry['question'] if cache_entry else None
+            }
+        }, sse)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 # Route 2: Handle "conversation" requests
 # This endpoint can be used for back-and-forth conversation with characters
 @app.route('/api/conversation', methods=['POST'])
@@ -611,10 +4886,19 @@ def handle_conversation():
     """
     Expects JSON like:
     {
-        "character_ids": [1, 5, 10, 23]  # Array of character IDs
+        "character_ids": [1, 5, 10, 23],  # Array of character IDs
+        "mode": "rounds",                 # optional, 'sequential' (each speaker answers the
+                                          #   one before) or 'rounds' (default CONVERSATION_MODE)
+        "rounds": 2,                      # optional, response rounds in 'rounds' mode
+                                          #   (default CONVERSATION_ROUNDS)
+        "prompt_batch": 4,                # optional, participants per mind-change call
+                                          #   (default MIND_CHANGE_PROMPT_BATCH)
+        "session_id": "abc123"            # optional, the session that ran the poll
     }
     
     Retrieves the chat history from Redis cache for each character.
+    In 'rounds' mode turns that failed are skipped and listed in
+    conversation_errors.
     """
     try:
         # Get the data sent from the frontend
@@ -624,13 +4908,23 @@ def handle_conversation():
         # Validate input
         if not character_ids or not isinstance(character_ids, list):
             return jsonify({'error': 'character_ids must be a non-empty array'}), 400
+
+        prompt_batch = data.get('prompt_batch')
+        if not _valid_prompt_batch(prompt_batch):
+            return jsonify({'error': PROMPT_BATCH_ERROR}), 400
+
+        mode = data.get('mode') or CONVERSATION_MODE
+        if mode not in ('sequential', 'rounds'):
+            return jsonify({'error': "mode must be 'sequential' or 'rounds'"}), 400
+        rounds = data.get('rounds')
+        if rounds is not None and (
+            not isinstance(rounds, int) or isinstance(rounds, bool) or not 0 <= rounds <= MAX_CONVERSATION_ROUNDS
+        ):
+            return jsonify({'error': f'rounds must be an integer between 0 and {MAX_CONVERSATION_ROUNDS}'}), 400
         
-        # Get data from Redis for each character
-        characters_data = []
-        for char_id in character_ids:
-            char_data = get_character_data(char_id)
-            if char_data:
-                characters_data.append(char_data)
+        # Get data from Redis for every character in one pipelined read
+        session = g.session
+        characters_data = get_characters_data(character_ids, session)
         
         if not characters_data:
             return jsonify({'error': 'No valid characters found'}), 404
@@ -639,57 +4933,77 @@ def handle_conversation():
         characters_data.sort(key=lambda x: x['passion'], reverse=True)
         
         # Initialize conversation log
-        conversation = ""
-        question = get_global_question()
-        
-        # Each character presents their thoughts in order of passion
-        for char_data in characters_data:
-            char_id = char_data['id']
-            char_info = get_character_info(char_id)
+        question = get_global_question(session)
+        context = ConversationContext(question)
+        char_infos = character_registry.get_many(c['id'] for c in characters_data)
+        spoken = {}   # char_id -> what they said, turn by turn
+        conversation_errors = {}
+
+        if mode == 'rounds':
+            # Everyone speaks at once each round, in order of passion
+            spoken, conversation_errors = run_conversation_rounds(
+                context, characters_data, char_infos, question, rounds, session=session
+            )
+        else:
+            # Each character presents their thoughts in order of passion
+            for char_data in characters_data:
+                char_id = char_data['id']
+                char_info = char_infos[char_id]
             
-            # Get character's response to the conversation so far
-            if conversation == "":
-                # First character starts the conversation with their original response
-                response = f"{char_info['name']}: {char_data['chat']}"
-            else:
-                # Subsequent characters respond to the conversation
-                response_text = character_conversation_response(char_id, conversation)
-                response = f"{char_info['name']}: {response_text}"
+                # Get character's response to the conversation so far
+                if len(context) == 0:
+                    # First character starts the conversation with their original response
+                    # (written now if the poll was verdict-only)
+                    response_text = char_data['chat'] or generate_character_prose(char_id, session)['chat']
+                else:
+                    # Subsequent characters respond to the (bounded) conversation so far
+                    response_text = character_conversation_response(char_id, context.render(), char_info, question)
             
-            # Add to conversation log
-            conversation += response + "\n\n"
+                # Add to conversation log
+                context.add(char_info['name'], response_text)
+                spoken[char_id] = [response_text]
+        
+        conversation = context.full_log()
+        
+        # Save the conversation to Redis
+        conv_id = save_conversation(character_ids, conversation, session)
         
-        # Now check if any character's mind has changed
-        updated_characters = []
+        # Now check if any character's mind has changed (all participants at once)
+        verdicts, mind_change_errors = check_minds_changed(
+            [c['id'] for c in characters_data], context.render(), char_infos, question=question,
+            prompt_batch=prompt_batch
+        )
+
+        buffer = WriteBehindBuffer(session)
         for char_data in characters_data:
             char_id = char_data['id']
             
-            # Check if mind changed
-            result = check_mind_changed(char_id, conversation)
-            
-            # Update Redis with new answer and passion
-            update_character_answer(char_id, result['answer'])
-            update_character_passion(char_id, result['passion'])
-            
-            # Append conversation to chat field
-            current_chat = char_data['chat']
-            new_chat = current_chat + "\n\n--- Group Conversation ---\n" + conversation
-            update_character_chat(char_id, new_chat)
+            # New answer and passion; a character whose check failed keeps its old ones
+            result = verdicts.get(char_id, {})
+            buffer.update(char_id, answer=result.get('answer'), passion=result.get('passion'))
             
-            # Get updated character data
-            updated_char = get_character_data(char_id)
-            updated_characters.append(updated_char)
+            # Record the conversation in the character's capped chat history
+            buffer.append_history(char_id, chat_history_entry(
+                'conversation', "\n\n".join(spoken[char_id]),
+                question=question, conversation_id=conv_id,
+                answer=result.get('answer'), passion=result.get('passion')
+            ))
         
-        # Save the conversation to Redis
-        conv_id = save_conversation(character_ids, conversation)
+        # Write every participant's update in one pipeline, then read them back in one
+        buffer.flush()
+        updated_characters = get_characters_data((c['id'] for c in characters_data), session)
         
         return jsonify({
             'success': True,
             'question': question,
+            'session_id': session,
             'conversation_id': conv_id,
             'conversation_log': conversation,
             'character_ids': character_ids,
-            'characters_data': updated_characters
+            'characters_data': updated_characters,
+            'mode': mode,
+            'conversation_errors': conversation_errors,
+            'mind_change_errors': mind_change_errors
         }), 200
         
     except Exception as e:
@@ -702,21 +5016,222 @@ def health_check():
     return jsonify({'status': 'healthy', 'message': 'Server is running'}), 200
 
 
+# Prometheus scrape endpoint
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Current poll totals, maintained incrementally in Redis
+@app.route('/api/poll/summary', methods=['GET'])
+def poll_summary():
+    try:
+        return jsonify({'success': True, 'summary': get_poll_summary(g.session)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Characters ranked by passion
+@app.route('/api/poll/ranking', methods=['GET'])
+def poll_ranking():
+    """
+    Query parameters (all optional):
+        answer=yes|no            only Yes or No voters
+        limit=10, offset=0       page of the ranking
+        order=desc|asc           most or least passionate first
+        min_passion, max_passion passion range
+    e.g. /api/poll/ranking?answer=no&limit=10 for the 10 most passionate No voters
+    """
+    try:
+        answer = request.args.get('answer')
+        if answer not in (None, 'yes', 'no'):
+            return jsonify({'error': 'answer must be yes or no'}), 400
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({'error': 'order must be asc or desc'}), 400
+        limit = request.args.get('limit', 10, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if not 1 <= limit <= 1000 or offset < 0:
+            return jsonify({'error': 'limit must be between 1 and 1000 and offset not negative'}), 400
+
+        characters = get_passion_ranking(
+            answer=None if answer is None else answer == 'yes',
+            limit=limit,
+            offset=offset,
+            descending=order == 'desc',
+            min_passion=request.args.get('min_passion', type=float),
+            max_passion=request.args.get('max_passion', type=float),
+            session=g.session
+        )
+        return jsonify({'success': True, 'count': len(characters), 'characters': characters}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Poll job status and partial results
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = get_poll_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Run or resume a poll job for up to JOB_TIME_BUDGET seconds
+@app.route('/api/jobs/<job_id>/run', methods=['POST'])
+def run_job(job_id):
+    try:
+        job = run_poll_job(job_id, time_budget=JOB_TIME_BUDGET)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Poll history export
+POLL_EXPORT_CSV_COLUMNS = ['poll_id', 'timestamp', 'question', 'mode', 'total', 'character_id', 'answer', 'passion']
+
+@app.route('/api/polls/export', methods=['GET'])
+def export_polls():
+    """
+    Stream the session's recorded polls, oldest first.
+
+    Query parameters (all optional):
+        format=ndjson      'ndjson' (one poll per line, with every character's
+                           answer and passion) or 'csv' (one row per character per poll)
+        start=, end=       Poll IDs or times in ms bounding the range (inclusive)
+        limit=             Most polls exported
+    """
+    fmt = request.args.get('format', 'ndjson')
+    start = request.args.get('start') or '-'
+    end = request.args.get('end') or '+'
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    if (start != '-' and not POLL_ID_PATTERN.match(start)) or (end != '+' and not POLL_ID_PATTERN.match(end)):
+        return jsonify({'error': 'start and end must be poll IDs or times in milliseconds'}), 400
+    try:
+        limit = _query_int('limit', None, 1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    session = g.session
+
+    def generate():
+        polls = iter_poll_history(start, end, limit, session)
+        if fmt == 'ndjson':
+            for poll in polls:
+                yield json.dumps(poll) + "\n"
+            return
+
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(POLL_EXPORT_CSV_COLUMNS)
+        for poll in polls:
+            for character in poll['characters']:
+                writer.writerow([
+                    poll['poll_id'], poll['timestamp'], poll['question'], poll['mode'], poll['total'],
+                    character['id'], int(character['answer']), character['passion']
+                ])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        yield out.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson' if fmt == 'ndjson' else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename=polls.{fmt}'}
+    )
+
+
+# Question cache counters
+@app.route('/api/cache/stats', methods=['GET'])
+def question_cache_stats():
+    try:
+        return jsonify({
+            'success': True,
+            'stats': get_question_cache_stats(),
+            'single_flight': get_single_flight_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # Route 3: Get all cached character data
+MAX_PAGE_SIZE = 1000
+
+def _query_int(name, default=None, minimum=0, maximum=None):
+    """Read an integer query parameter. Raises ValueError if it is malformed or out of range."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError(f"{name} must be between {minimum} and {maximum}" if maximum is not None
+                         else f"{name} must be at least {minimum}")
+    return value
+
 @app.route('/api/characters', methods=['GET'])
 def get_characters():
     """
-    Get all character data from Redis cache.
+    Get character data from Redis cache.
     Useful for checking the current state of all characters.
+
+    Query parameters (all optional; without them every character is returned):
+        fields=answer,passion   only these fields (plus id)
+        offset=0&limit=100      a page of the characters, sorted by id
+        start=1&end=100         characters start..end by id (no keyspace scan)
+
+    Responses carry an ETag; send it back as If-None-Match to get a 304
+    while nothing in the session has changed.
     """
     try:
-        characters = get_all_characters_data()
-        return jsonify({
-            'success': True,
-            'question': get_global_question(),
-            'count': len(characters),
-            'characters': characters
-        }), 200
+        session = g.session
+        try:
+            fields = parse_character_fields(request.args.get('fields'))
+            offset = _query_int('offset', 0)
+            limit = _query_int('limit', None, 1, MAX_PAGE_SIZE)
+            start = _query_int('start', None, 1)
+            end = _query_int('end', None, 1)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Read the version before the data: a write in between only makes the
+        # next revalidation miss, it can never label new data with an old tag
+        version = get_state_version(session)
+        etag = _state_etag(version, session)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        payload = {'success': True, 'question': get_global_question(session), 'version': version}
+        if start is not None or end is not None:
+            start = start or 1
+            end = end or start + (limit or MAX_PAGE_SIZE) - 1
+            if end < start or end - start >= MAX_PAGE_SIZE:
+                return jsonify({'error': f'end must be from start to start + {MAX_PAGE_SIZE - 1}'}), 400
+            characters = get_character_range(start, end, session, fields)
+            payload.update({'start': start, 'end': end})
+        else:
+            char_ids = sorted(iter_character_ids(session))
+            page_ids = char_ids[offset:offset + limit] if limit else char_ids[offset:]
+            characters = get_characters_data(page_ids, session, fields)
+            next_offset = offset + len(page_ids)
+            payload.update({
+                'total': len(char_ids),
+                'offset': offset,
+                'limit': limit,
+                'next_offset': next_offset if next_offset < len(char_ids) else None
+            })
+
+        payload.update({'count': len(characters), 'characters': characters})
+        return _with_etag(jsonify(payload), etag), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -726,12 +5241,45 @@ def get_characters():
 def get_character(char_id):
     """
     Get data for a specific character from Redis cache.
+    Accepts the same ?fields= projection and ETag revalidation as /api/characters.
     """
     try:
-        character = get_character_data(char_id)
-        if not character:
+        session = g.session
+        try:
+            fields = parse_character_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        version = get_state_version(session)
+        etag = _state_etag(version, session)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        characters = get_characters_data([char_id], session, fields)
+        if not characters:
             return jsonify({'error': 'Character not found'}), 404
         
+        return _with_etag(jsonify({
+            'success': True,
+            'character': characters[0]
+        }), etag), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Route 4b: Write a character's reply after a verdict-only poll
+@app.route('/api/characters/<int:char_id>/response', methods=['POST'])
+def generate_character_response(char_id):
+    """
+    Get a character's reply to the session's question, writing it first if
+    the poll was verdict-only. The reply argues for the answer the character
+    already gave; answer and passion are not changed.
+    """
+    try:
+        character = generate_character_prose(char_id, g.session)
+        if character is None:
+            return jsonify({'error': 'Character not found'}), 404
         return jsonify({
             'success': True,
             'character': character
@@ -740,8 +5288,31 @@ def get_character(char_id):
         return jsonify({'error': str(e)}), 500
 
 
+# Route 5: Get a character's chat history
+@app.route('/api/characters/<int:char_id>/history', methods=['GET'])
+def get_character_history(char_id):
+    """
+    Get a character's chat history (poll responses and conversations), oldest first.
+    Optional ?limit=N returns only the most recent N entries.
+    """
+    try:
+        limit = request.args.get('limit', type=int)
+        return jsonify({
+            'success': True,
+            'character_id': char_id,
+            'history': get_chat_history(char_id, limit, g.session)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # Main entry point - start the server
 if __name__ == '__main__':
+    # `python generateResponses.py personas ...` generates personas and exits
+    if sys.argv[1:2] == ['personas']:
+        personas_cli(sys.argv[2:])
+        exit(0)
+
     # Test Redis connection
     try:
         redis_client.ping()
@@ -751,21 +5322,34 @@ if __name__ == '__main__':
         print("  Install: sudo apt install redis-server (Ubuntu) or brew install redis (Mac)")
         print("  Start: redis-server")
         exit(1)
+
+    # `python generateResponses.py worker` runs a poll job worker instead of the server
+    if sys.argv[1:2] == ['worker']:
+        poll_job_worker()
+        exit(0)
     
     # Initialize all 100 characters in Redis at startup
     print("\nInitializing 100 characters in Redis cache...")
     clear_all_characters()  # Clear any old data first
     set_global_question('')  # Initialize global question to empty
-    for i in range(1, 101):
-        init_character_cache(i)
-    print(f"✓ Initialized {len(get_all_characters_data())} characters")
+    print(f"✓ Initialized {init_characters(range(1, 101))} characters")
+
+    # Generate the question-independent intro monologues now so the first
+    # poll only needs one LLM call per character (PREWARM_INTRO_CACHE=0 to skip)
+    if os.getenv("PREWARM_INTRO_CACHE", "1") != "0":
+        print("\nWarming intro monologue cache...")
+        print(f"✓ Generated {prewarm_intro_cache(range(1, 101))} intro monologues")
     
     print("\nStarting Flask server on http://localhost:5037")
     print("Available endpoints:")
     print("  POST /api/question - Ask the village a question")
+    print("  POST /api/question/stream - Same, streaming each character's answer as it arrives")
     print("  POST /api/conversation - Have a conversation with a character")
+    print("  GET  /api/jobs/<id> - Poll job progress and partial results")
+    print("  POST /api/jobs/<id>/run - Run or resume a poll job")
     print("  GET  /api/characters - Get all cached character data")
     print("  GET  /api/characters/<id> - Get specific character data")
+    print("  GET  /api/characters/<id>/history - Get a character's chat history")
     print("  GET  /api/health - Check if server is running")
     
     # Start the server
@@ -0,0 +1,26 @@
+import sys
+from pathlib import Path
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import generateResponses as app_module
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    """An empty in-memory Redis in place of the app's client."""
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(app_module, 'redis_client', client)
+    monkeypatch.setattr(app_module, '_redis_scripts', {})
+    return client
+
+
+@pytest.fixture
+def mock_llm(monkeypatch):
+    """A zero-latency MockLLMProvider as the active provider."""
+    provider = app_module.MockLLMProvider(latency_ms=0, seed=0)
+    monkeypatch.setattr(app_module, '_llm_provider', provider)
+    return provider
@@ -0,0 +1,156 @@
+import asyncio
+import json
+
+import pytest
+
+import generateResponses as app_module
+
+CHAR_IDS = [1, 2, 3, 4, 5]
+
+
+def _reply(items):
+    return json.dumps({'characters': items})
+
+
+def _item(char_id, answer=True, passion=0.5, response='Sounds good to me.'):
+    return {'id': char_id, 'response': response, 'answer': answer, 'passion': passion}
+
+
+@pytest.mark.parametrize('content', [
+    'not json',
+    '{"characters": ',
+    '[]',
+    '{"people": []}',
+    '{"characters": {"id": 1}}',
+    'null',
+])
+def test_malformed_reply_parses_to_nothing(content):
+    assert app_module.parse_batch_response(content, CHAR_IDS) == {}
+
+
+def test_partial_reply_keeps_the_valid_items():
+    content = _reply([
+        _item(1, True, 0.9),
+        _item(2, passion=1.5),            # passion out of range
+        _item(3, passion=True),           # bool is not a passion
+        _item(4, response='  '),          # no reply text
+        _item(9),                         # not asked
+        _item(1, False, 0.1),             # repeat of 1
+        {'id': 5, 'answer': 'yes', 'passion': 0.5, 'response': 'Yes!'},
+        'stray string',
+    ])
+    results = app_module.parse_batch_response(content, CHAR_IDS)
+    assert results == {1: {'answer': True, 'passion': 0.9, 'response': 'Sounds good to me.'}}
+
+
+def test_verdict_reply_needs_no_response():
+    content = _reply([{'id': 1, 'answer': False, 'passion': 0}, {'id': 2, 'answer': True}])
+    assert app_module.parse_batch_response(content, CHAR_IDS, verdict_only=True) == {
+        1: {'answer': False, 'passion': 0.0}
+    }
+
+
+class BatchReplyLLM(app_module.MockLLMProvider):
+    """Mock provider whose batched replies are rewritten by `rewrite`."""
+
+    def __init__(self, rewrite):
+        super().__init__(latency_ms=0, seed=0)
+        self.rewrite = rewrite
+        self.batched_calls = 0
+        self.single_calls = 0
+
+    def _respond(self, request):
+        result = super()._respond(request)
+        try:
+            value = json.loads(result.content)
+        except ValueError:
+            return result
+        if isinstance(value, dict) and 'characters' in value:
+            self.batched_calls += 1
+            return result._replace(content=self.rewrite(value))
+        if isinstance(value, dict) and 'answer' in value:
+            self.single_calls += 1
+        return result
+
+
+@pytest.fixture
+def batch_env(redis_client, monkeypatch):
+    monkeypatch.setattr(app_module, 'metrics', app_module.Metrics())
+    app_module.init_characters(CHAR_IDS)
+    return app_module.character_registry.get_many(CHAR_IDS)
+
+
+def _use(monkeypatch, provider):
+    monkeypatch.setattr(app_module, '_llm_provider', provider)
+    return provider
+
+
+def _run(char_infos, engine):
+    if engine == 'thread':
+        return app_module.process_characters_batch(CHAR_IDS, 'Buy shoes?', char_infos)
+
+    async def run():
+        async with app_module.get_llm().async_session() as llm_session:
+            return await app_module.process_characters_batch_async(llm_session, CHAR_IDS, 'Buy shoes?', char_infos)
+    return asyncio.run(run())
+
+
+def _drop_and_corrupt(value):
+    items = [item for item in value['characters'] if item['id'] != 2]
+    for item in items:
+        if item['id'] == 4:
+            item['passion'] = 7
+    return json.dumps({'characters': items})
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_missing_and_invalid_items_fall_back_one_by_one(batch_env, monkeypatch, engine):
+    llm = _use(monkeypatch, BatchReplyLLM(_drop_and_corrupt))
+    outcomes = _run(batch_env, engine)
+
+    assert sorted(char_id for char_id, _, _ in outcomes) == CHAR_IDS
+    assert all(exc is None and result['response'] for _, result, exc in outcomes)
+    assert llm.batched_calls == 1
+    assert llm.single_calls == 2
+    assert app_module.metrics.total('llm_batch_fallbacks_total') == 2
+    stored = {c['id']: c for c in app_module.get_characters_data(CHAR_IDS)}
+    assert all(stored[char_id]['chat'] for char_id in CHAR_IDS)
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_unparseable_reply_falls_back_for_every_character(batch_env, monkeypatch, engine):
+    llm = _use(monkeypatch, BatchReplyLLM(lambda value: 'Sure! Here are the answers: ...'))
+    outcomes = _run(batch_env, engine)
+
+    assert sorted(char_id for char_id, result, exc in outcomes if exc is None) == CHAR_IDS
+    assert llm.single_calls == len(CHAR_IDS)
+    assert app_module.metrics.total('llm_batch_fallbacks_total') == len(CHAR_IDS)
+
+
+def test_failed_batched_call_falls_back(batch_env, monkeypatch):
+    def fail(value):
+        raise app_module.MockLLMError("batch exploded")
+    llm = _use(monkeypatch, BatchReplyLLM(fail))
+    outcomes = _run(batch_env, 'thread')
+
+    assert sorted(char_id for char_id, result, exc in outcomes if exc is None) == CHAR_IDS
+    assert llm.single_calls == len(CHAR_IDS)
+
+
+def test_rate_limited_batch_is_not_retried_one_by_one(batch_env, monkeypatch):
+    def limited(value):
+        raise app_module.LLMRateLimited("no capacity")
+    llm = _use(monkeypatch, BatchReplyLLM(limited))
+
+    with pytest.raises(app_module.LLMRateLimited):
+        _run(batch_env, 'thread')
+    assert llm.single_calls == 0
+
+
+def test_complete_reply_needs_no_fallback(batch_env, monkeypatch):
+    llm = _use(monkeypatch, BatchReplyLLM(json.dumps))
+    outcomes = _run(batch_env, 'thread')
+
+    assert sorted(char_id for char_id, _, _ in outcomes) == CHAR_IDS
+    assert llm.single_calls == 0
+    assert app_module.metrics.total('llm_batch_fallbacks_total') == 0
@@ -0,0 +1,112 @@
+import pytest
+
+import generateResponses as app_module
+
+
+def _recount(redis_client, session=None):
+    """The aggregates recomputed from the per-character votes they were built from."""
+    votes = redis_client.hgetall(app_module.session_key(app_module.POLL_VOTES_KEY, session))
+    parsed = {int(char_id): (vote[0] == '1', float(vote[2:])) for char_id, vote in votes.items()}
+    return {
+        'yes_count': sum(1 for answer, _ in parsed.values() if answer),
+        'no_count': sum(1 for answer, _ in parsed.values() if not answer),
+        'total': len(parsed),
+        'passion_sum': sum(passion for _, passion in parsed.values()),
+        'ranked': sorted(parsed),
+        'yes_ranked': sorted(char_id for char_id, (answer, _) in parsed.items() if answer),
+    }
+
+
+def _assert_consistent(redis_client, session=None):
+    expected = _recount(redis_client, session)
+    summary = app_module.get_poll_summary(session)
+    assert summary['yes_count'] == expected['yes_count']
+    assert summary['no_count'] == expected['no_count']
+    assert summary['total'] == expected['total']
+    assert summary['average_passion'] * summary['total'] == pytest.approx(expected['passion_sum'])
+    assert sum(bucket['count'] for bucket in summary['passion_histogram']) == expected['total']
+
+    ranked = redis_client.zrange(app_module._passion_key(None, session), 0, -1)
+    yes_ranked = redis_client.zrange(app_module._passion_key(True, session), 0, -1)
+    no_ranked = redis_client.zrange(app_module._passion_key(False, session), 0, -1)
+    assert sorted(map(int, ranked)) == expected['ranked']
+    assert sorted(map(int, yes_ranked)) == expected['yes_ranked']
+    assert len(yes_ranked) + len(no_ranked) == expected['total']
+
+
+def test_votes_are_counted_once(redis_client):
+    app_module.record_poll_vote(1, True, 0.9)
+    app_module.record_poll_vote(2, False, 0.2)
+    app_module.record_poll_vote(3, True, 0.45)
+
+    summary = app_module.get_poll_summary()
+    assert (summary['yes_count'], summary['no_count'], summary['total']) == (2, 1, 3)
+    assert summary['average_passion'] == pytest.approx((0.9 + 0.2 + 0.45) / 3)
+    assert [bucket['count'] for bucket in summary['passion_histogram']] == [0, 0, 1, 0, 1, 0, 0, 0, 0, 1]
+    _assert_consistent(redis_client)
+
+
+def test_revote_replaces_the_previous_vote(redis_client):
+    app_module.record_poll_vote(1, True, 0.9)
+    app_module.record_poll_vote(2, True, 0.5)
+    app_module.record_poll_vote(1, False, 0.3)      # mind change
+    app_module.record_poll_vote(2, None, 0.75)      # passion only, answer kept
+
+    summary = app_module.get_poll_summary()
+    assert (summary['yes_count'], summary['no_count'], summary['total']) == (1, 1, 2)
+    assert summary['average_passion'] == pytest.approx((0.3 + 0.75) / 2)
+    assert redis_client.zscore(app_module._passion_key(False), 1) == pytest.approx(0.3)
+    assert redis_client.zscore(app_module._passion_key(True), 1) is None
+    _assert_consistent(redis_client)
+
+
+def test_removed_vote_leaves_the_totals(redis_client):
+    app_module.record_poll_vote(1, True, 0.9)
+    app_module.record_poll_vote(2, False, 0.2)
+    app_module.remove_poll_vote(1)
+    app_module.remove_poll_vote(3)                  # never voted: no-op
+
+    summary = app_module.get_poll_summary()
+    assert (summary['yes_count'], summary['no_count'], summary['total']) == (0, 1, 1)
+    assert summary['average_passion'] == pytest.approx(0.2)
+    _assert_consistent(redis_client)
+
+    app_module.record_poll_vote(1, True, 0.6)       # and can vote again
+    assert app_module.get_poll_summary()['yes_count'] == 1
+    _assert_consistent(redis_client)
+
+
+def test_resetting_characters_removes_their_votes(redis_client):
+    app_module.init_characters([1, 2, 3])
+    for char_id, answer, passion in ((1, True, 0.8), (2, False, 0.1), (3, True, 0.35)):
+        app_module.update_character_fields(char_id, answer=answer, passion=passion)
+    app_module.init_characters([1, 2], reset=True)
+
+    summary = app_module.get_poll_summary()
+    assert (summary['yes_count'], summary['no_count'], summary['total']) == (1, 0, 1)
+    _assert_consistent(redis_client)
+
+
+def test_mixed_updates_stay_consistent(redis_client):
+    # A deterministic mix of votes, re-votes, partial updates and removals
+    for step in range(200):
+        char_id = step * 7 % 13
+        action = step % 5
+        if action == 4:
+            app_module.remove_poll_vote(char_id)
+        elif action == 3:
+            app_module.record_poll_vote(char_id, None, (step % 11) / 10)
+        else:
+            app_module.record_poll_vote(char_id, step % 3 == 0, (step % 10) / 10)
+    _assert_consistent(redis_client)
+
+
+def test_sessions_have_their_own_aggregates(redis_client):
+    app_module.record_poll_vote(1, True, 0.5, session='a')
+    app_module.record_poll_vote(1, False, 0.5, session='b')
+
+    assert app_module.get_poll_summary('a')['yes_count'] == 1
+    assert app_module.get_poll_summary('b')['no_count'] == 1
+    assert app_module.get_poll_summary()['total'] == 0
+    _assert_consistent(redis_client, 'a')
+    _assert_consistent(redis_client, 'b')
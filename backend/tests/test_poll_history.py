@@ -0,0 +1,74 @@
+import base64
+
+import pytest
+
+import generateResponses as app_module
+
+
+def _results(*rows):
+    return {char_id: {'response': '', 'answer': answer, 'passion': passion} for char_id, answer, passion in rows}
+
+
+def test_pack_round_trip_sorts_ids_and_quantises_passions():
+    results = _results((42, True, 0.123456), (7, False, 1.0), (1000, True, 0.0))
+    assert app_module.unpack_poll_results(app_module.pack_poll_results(results)) == [
+        (7, False, 1.0), (42, True, 0.1235), (1000, True, 0.0)
+    ]
+
+
+def test_pack_layout_and_clamping():
+    # Nine characters so the answer bitset spills into a second byte
+    results = _results(*[(i, i in (0, 3, 8), 0.5) for i in range(9)])
+    results[9] = {'answer': False, 'passion': 1.7}
+    packed = app_module.pack_poll_results(results)
+    assert len(base64.b64decode(packed['ids'])) == 4 * 10
+    assert len(base64.b64decode(packed['passions'])) == 2 * 10
+    assert base64.b64decode(packed['answers']) == bytes([0b00001001, 0b00000001])
+    assert app_module.unpack_poll_results(packed)[-1] == (9, False, 1.0)
+
+
+def test_pack_accepts_json_string_keys():
+    packed = app_module.pack_poll_results({'5': {'answer': True, 'passion': 0.5}})
+    assert app_module.unpack_poll_results(packed) == [(5, True, 0.5)]
+
+
+def test_pack_empty_poll():
+    assert app_module.unpack_poll_results(app_module.pack_poll_results({})) == []
+
+
+def test_record_and_read_back(redis_client):
+    results = _results((3, True, 0.9), (1, False, 0.2), (2, True, 0.4))
+    poll_id = app_module.record_poll('Q?', results, total=4, session='s1')
+
+    [poll] = app_module.iter_poll_history(session='s1')
+    assert poll['poll_id'] == poll_id
+    assert poll['question'] == 'Q?'
+    assert (poll['total'], poll['answered'], poll['yes_count'], poll['no_count']) == (4, 3, 2, 1)
+    assert poll['average_passion'] == pytest.approx(0.5)
+    assert poll['source_poll_id'] is None
+    assert [c['id'] for c in poll['characters']] == [1, 2, 3]
+    # Sessions don't see each other's history
+    assert list(app_module.iter_poll_history(session='s2')) == []
+
+
+def test_reused_poll_is_stored_as_a_reference(redis_client):
+    results = _results((1, True, 0.5), (2, False, 0.5))
+    source = app_module.record_poll('Q?', results, session='s1')
+    entry = {'characters': results, 'source_poll_id': source}
+    reused = app_module.record_reused_poll('Q? again', entry, 2, session='s2')
+
+    fields = redis_client.xrange(app_module.poll_history_key('s2'))[0][1]
+    assert 'ids' not in fields and fields['source'] == source
+    [poll] = app_module.iter_poll_history(session='s2')
+    assert poll['poll_id'] == reused
+    assert poll['source_poll_id'] == source
+    assert poll['characters'] == []
+
+
+def test_history_pages_and_limits(redis_client, monkeypatch):
+    monkeypatch.setattr(app_module, 'POLL_HISTORY_PAGE_SIZE', 3)
+    ids = [app_module.record_poll(f'Q{i}', _results((i, True, 0.5))) for i in range(8)]
+
+    assert [p['poll_id'] for p in app_module.iter_poll_history()] == ids
+    assert [p['question'] for p in app_module.iter_poll_history(limit=5)] == [f'Q{i}' for i in range(5)]
+    assert [p['poll_id'] for p in app_module.iter_poll_history(start=ids[2], end=ids[6])] == ids[2:7]
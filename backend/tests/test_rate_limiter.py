@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+import generateResponses as app_module
+
+
+@pytest.fixture
+def limiter(redis_client):
+    # 60 requests/min: the bulk lane gets 80% (48 requests, 0.8 per second)
+    return app_module.RateLimiter(rpm=60, tpm=0, interactive_reserve=0.2, max_wait=5)
+
+
+def _drain_lane(limiter, priority='bulk'):
+    """Spend a lane's full bucket; every booking fits without waiting."""
+    for _ in range(48 if priority == 'bulk' else 12):
+        assert limiter.reserve(10, priority) == 0
+
+
+def test_full_bucket_lets_calls_go_now(limiter):
+    _drain_lane(limiter)
+
+
+def test_empty_bucket_books_the_next_slots(limiter):
+    _drain_lane(limiter)
+    # One request refills every 1 / 0.8 s; each booking queues behind the last
+    assert limiter.reserve(10) == pytest.approx(1.25, abs=0.02)
+    assert limiter.reserve(10) == pytest.approx(2.5, abs=0.02)
+
+
+def test_bucket_refills_over_time(limiter, redis_client):
+    _drain_lane(limiter)
+    # Pretend the bucket was emptied 5 s ago: 4 requests have refilled since
+    redis_client.hset('ratelimit:llm:requests:bulk', mapping={'level': 0, 'ts': time.time() - 5})
+    for _ in range(4):
+        assert limiter.reserve(10) == 0
+    assert limiter.reserve(10) > 0
+
+
+def test_refill_stops_at_capacity(limiter, redis_client):
+    redis_client.hset('ratelimit:llm:requests:bulk', mapping={'level': 0, 'ts': time.time() - 3600})
+    _drain_lane(limiter)
+    assert limiter.reserve(10) > 0
+
+
+def test_call_over_max_wait_is_refused_without_booking(limiter, redis_client):
+    _drain_lane(limiter)
+    for _ in range(4):
+        limiter.reserve(10)          # books up to 5 s ahead
+    level = redis_client.hget('ratelimit:llm:requests:bulk', 'level')
+    with pytest.raises(app_module.LLMRateLimited):
+        limiter.reserve(10)
+    assert redis_client.hget('ratelimit:llm:requests:bulk', 'level') == level
+
+
+def test_token_bucket_charges_the_request_size(redis_client):
+    # 6000 tokens/min: 4800 for bulk at 80 per second
+    limiter = app_module.RateLimiter(rpm=0, tpm=6000, interactive_reserve=0.2, max_wait=60)
+    assert limiter.reserve(4000) == 0
+    assert limiter.reserve(800) == 0
+    assert limiter.reserve(400) == pytest.approx(5.0, abs=0.05)
+
+
+def test_interactive_calls_have_their_own_reserve(limiter):
+    _drain_lane(limiter)
+    assert limiter.reserve(10, 'bulk') > 0
+    _drain_lane(limiter, 'interactive')
+    # Both lanes empty: an interactive call takes whichever slot comes first
+    assert 0 < limiter.reserve(10, 'interactive') <= 5
+
+
+def test_drain_pauses_every_lane(limiter):
+    limiter.drain()
+    assert limiter.reserve(10, 'bulk') > 0
+    assert limiter.reserve(10, 'interactive') > 0
+
+
+def test_disabled_limiter_is_off(redis_client):
+    assert not app_module.RateLimiter(rpm=0, tpm=0).enabled
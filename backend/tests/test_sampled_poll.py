@@ -0,0 +1,114 @@
+import statistics
+
+import pytest
+
+import generateResponses as app_module
+
+Z95 = statistics.NormalDist().inv_cdf(0.975)
+HUGE = 10 ** 9   # population large enough that the finite population correction is ~1
+
+
+def test_wilson_interval_matches_the_textbook_values():
+    estimate, low, high = app_module.proportion_interval(50, 100, Z95, HUGE)
+    assert estimate == 0.5
+    assert low == pytest.approx(0.4038, abs=1e-4)
+    assert high == pytest.approx(0.5962, abs=1e-4)
+
+    estimate, low, high = app_module.proportion_interval(9, 10, Z95, HUGE)
+    assert (low, high) == (pytest.approx(0.5958, abs=1e-4), pytest.approx(0.9821, abs=1e-4))
+
+
+def test_wilson_interval_edges():
+    assert app_module.proportion_interval(0, 0, Z95, 100) == (0.0, 0.0, 1.0)
+    _, low, high = app_module.proportion_interval(20, 20, Z95, HUGE)
+    assert high == pytest.approx(1.0) and 0.8 < low < 1.0
+    _, low, high = app_module.proportion_interval(0, 20, Z95, HUGE)
+    assert low == pytest.approx(0.0, abs=1e-6) and 0.0 < high < 0.2
+
+
+def test_finite_population_correction_narrows_the_interval():
+    _, low_big, high_big = app_module.proportion_interval(30, 60, Z95, HUGE)
+    _, low_small, high_small = app_module.proportion_interval(30, 60, Z95, 100)
+    assert high_small - low_small < high_big - low_big
+    # The whole population asked: nothing left to estimate
+    assert app_module.proportion_interval(30, 60, Z95, 60) == (0.5, 0.5, 0.5)
+
+
+def test_mean_interval():
+    values = [0.2, 0.4, 0.6, 0.8]
+    mean, low, high = app_module.mean_interval(values, Z95, HUGE)
+    half = Z95 * statistics.stdev(values) / 2
+    assert mean == pytest.approx(0.5)
+    assert (low, high) == (pytest.approx(0.5 - half), pytest.approx(0.5 + half))
+    assert app_module.mean_interval([0.3], Z95, HUGE) == (0.3, 0.0, 1.0)
+
+
+def _answer(char_id):
+    """A fixed answer per character: about 70% yes, passions spread over 0.3-0.7."""
+    return {'response': '', 'answer': char_id % 10 < 7, 'passion': 0.3 + (char_id * 37 % 41) / 100}
+
+
+@pytest.fixture
+def fake_poll(redis_client, monkeypatch):
+    """Replace run_poll with instant, deterministic answers and log each batch."""
+    batches = []
+
+    def run_poll(question, char_ids, engine=None, **kwargs):
+        batches.append(list(char_ids))
+        tally = app_module.PollTally(len(char_ids))
+        for char_id in char_ids:
+            tally.add(char_id, _answer(char_id))
+        return tally
+
+    monkeypatch.setattr(app_module, 'run_poll', run_poll)
+    return batches
+
+
+def _widest(char_ids, population):
+    answers = [_answer(char_id) for char_id in char_ids]
+    yes = app_module.proportion_interval(sum(a['answer'] for a in answers), len(answers), Z95, population)
+    passion = app_module.mean_interval([a['passion'] for a in answers], Z95, population)
+    return max(yes[2] - yes[0], yes[0] - yes[1], passion[2] - passion[0], passion[0] - passion[1])
+
+
+def test_stops_at_the_first_batch_within_precision(fake_poll):
+    population = len(app_module.sample_population())
+    summary, results = app_module.sampled_poll('Q?', precision=0.08, batch_size=20, seed=1)
+
+    assert summary['stopped_reason'] == 'precision_reached'
+    asked = [char_id for batch in fake_poll for char_id in batch]
+    assert summary['queried'] == len(asked) == len(results)
+    # Within precision now, but not one batch earlier
+    assert _widest(asked, population) <= 0.08
+    assert _widest(asked[:-20], population) > 0.08
+    yes_share = summary['yes_share']
+    assert yes_share['high'] - yes_share['estimate'] <= 0.08
+    assert yes_share['estimate'] - yes_share['low'] <= 0.08
+
+
+def test_never_stops_below_the_minimum_sample(fake_poll):
+    summary, _ = app_module.sampled_poll('Q?', precision=0.99, batch_size=10, seed=1)
+    assert summary['stopped_reason'] == 'precision_reached'
+    assert summary['answered'] == app_module.SAMPLE_MIN_SIZE
+
+
+def test_query_budget_stops_the_poll(fake_poll):
+    summary, _ = app_module.sampled_poll('Q?', precision=0.001, max_queries=45, batch_size=20, seed=1)
+    assert summary['stopped_reason'] == 'budget_exhausted'
+    assert summary['queried'] == 45
+    assert [len(batch) for batch in fake_poll] == [20, 20, 5]
+
+
+def test_sample_is_reproducible_with_a_seed(fake_poll):
+    first, _ = app_module.sampled_poll('Q?', precision=0.1, batch_size=25, seed=7)
+    first_batches = list(fake_poll)
+    fake_poll.clear()
+    second, _ = app_module.sampled_poll('Q?', precision=0.1, batch_size=25, seed=7)
+    assert fake_poll == first_batches
+    assert first['yes_share'] == second['yes_share']
+
+
+@pytest.mark.parametrize('kwargs', [{'batch_size': 0}, {'max_queries': -1}, {'batch_size': True}])
+def test_invalid_sizes_are_rejected(redis_client, kwargs):
+    with pytest.raises(ValueError):
+        app_module.sampled_poll('Q?', **kwargs)